@@ -5,7 +5,7 @@ import os
 import sys
 from cm.clouds.cloud_config import CloudConfig
 from cm.framework import messages
-from cm.util import misc, paths
+from cm.util import instrumentation, misc, paths
 
 log = logging.getLogger('cloudman')
 logging.getLogger('boto').setLevel(logging.INFO)
@@ -39,6 +39,7 @@ class UniverseApplication(object):
 
     def __init__(self, **kwargs):
         print "Python version: ", sys.version_info[:2]
+        instrumentation.install()
         self.PERSISTENT_DATA_VERSION = 3  # Current expected and generated PD version
         self.DEPLOYMENT_VERSION = 2
         # Instance persistent data file. This file gets created for
@@ -147,6 +147,9 @@ def _fix_nginx_upload(ud):
         log.error("{0} not found to update".format(nginx_conf_path))
 
 
+_s3_connections = {}
+
+
 def _get_s3connection(ud):
     access_key = ud['access_key']
     secret_key = ud['secret_key']
@@ -180,6 +183,11 @@ def _get_s3connection(ud):
         calling_format = OrdinaryCallingFormat()
         path = ud['s3_conn_path']
 
+    # Reuse an existing connection to the same endpoint, keeping its
+    # keep-alive HTTP connections, instead of building a new one each time
+    conn_key = (access_key, secret_key, is_secure, host, port, path)
+    if conn_key in _s3_connections:
+        return _s3_connections[conn_key]
     # get boto connection
     s3_conn = None
     try:
@@ -193,6 +201,7 @@ def _get_s3connection(ud):
             calling_format=calling_format,
         )
         log.debug('Got boto S3 connection: %s' % s3_conn)
+        _s3_connections[conn_key] = s3_conn
     except BotoServerError as e:
         log.error("Exception getting S3 connection; {0}".format(e))
 
@@ -16,6 +16,7 @@ import pkg_resources
 log = logging.getLogger('cloudman')
 
 import cm.framework
+from cm.util import assets
 from cm.util import misc
 from cm.util import paths
 from cm.app import UniverseApplication
@@ -63,6 +64,10 @@ def app_factory(global_conf, **kwargs):
     app = UniverseApplication(global_conf=global_conf, **kwargs)
     app.startup()
     atexit.register(app.shutdown)
+    # Hash (and precompress) the static files, served by Nginx or below
+    conf = global_conf.copy()
+    conf.update(kwargs)
+    assets.init(conf.get('static_dir', 'static'))
     # Create the universe WSGI application
     webapp = cm.framework.WebApplication(app)
     add_controllers(webapp, app)
@@ -1,3 +1,4 @@
+from cm.clouds import ratelimit
 from cm.util import misc
 from cm.util import paths
 
@@ -63,6 +64,7 @@ class CloudInterface(object):
         self.aws_access_key = self.user_data.get('access_key', None)
         self.aws_secret_key = self.user_data.get('secret_key', None)
         self.tags = {}
+        ratelimit.limiter.configure(self.user_data.get('cloud_api_rate_limits'))
 
     def get_configuration(self):
         """ Return a dict with all the class variables.
@@ -0,0 +1,274 @@
+"""
+Thread-safe management of cloud API (EC2, S3, Nova, Swift) connections.
+
+A single ``boto`` connection object shares its underlying HTTP connection
+pool between all callers so using the same object from the monitor thread,
+web request threads and service threads at the same time is not safe.
+A ``ConnectionPool`` hands out one connection per thread instead, reusing it
+(and hence its keep-alive HTTP connections) for all subsequent calls from
+that thread. Credentials are validated lazily, once per pool, using a cheap
+call and all calls made through a pooled connection are retried with
+exponential backoff if the provider reports throttling (see also
+``cm.clouds.ratelimit``, which keeps calls within the budget). Call counts and
+latencies are recorded per endpoint and are available via ``get_call_stats``.
+"""
+import random
+import threading
+import time
+
+from boto.exception import BotoServerError
+
+from cm.clouds import ratelimit
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Error codes used by the providers to indicate a request has been throttled
+THROTTLING_ERROR_CODES = ['Throttling', 'ThrottlingException',
+                          'RequestLimitExceeded', 'RequestThrottled',
+                          'SlowDown', 'TooManyRequests']
+
+# Errors meaning the credentials themselves are not valid
+AUTH_ERROR_CODES = ['AuthFailure', 'InvalidClientTokenId', 'SignatureDoesNotMatch']
+
+_stats_lock = threading.Lock()
+_call_stats = {}
+
+
+def is_throttling_error(e):
+    """
+    Return ``True`` if exception ``e`` indicates the provider is throttling
+    requests; ``False`` otherwise.
+    """
+    if isinstance(e, BotoServerError):
+        if e.error_code in THROTTLING_ERROR_CODES:
+            return True
+        if e.status in [429, 503]:
+            return True
+    return False
+
+
+def is_auth_error(e):
+    """
+    Return ``True`` if exception ``e`` indicates the credentials used are
+    not valid; ``False`` otherwise.
+    """
+    return isinstance(e, BotoServerError) and \
+        (e.error_code in AUTH_ERROR_CODES or e.status == 401)
+
+
+class CallStats(object):
+    """
+    Counters and latencies for calls made against a single endpoint.
+    """
+    def __init__(self, endpoint):
+        self.endpoint = endpoint
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, duration, error=False, throttled=False):
+        with _stats_lock:
+            self.calls += 1
+            self.total_time += duration
+            self.max_time = max(self.max_time, duration)
+            if error:
+                self.errors += 1
+            if throttled:
+                self.throttled += 1
+
+    def to_dict(self):
+        with _stats_lock:
+            mean_time = self.total_time / self.calls if self.calls else 0.0
+            return {'calls': self.calls,
+                    'errors': self.errors,
+                    'throttled': self.throttled,
+                    'total_time': round(self.total_time, 4),
+                    'mean_time': round(mean_time, 4),
+                    'max_time': round(self.max_time, 4)}
+
+
+def _get_stats(endpoint):
+    with _stats_lock:
+        stats = _call_stats.get(endpoint)
+        if stats is None:
+            stats = _call_stats[endpoint] = CallStats(endpoint)
+        return stats
+
+
+def get_call_stats():
+    """
+    Return a dict, keyed by endpoint (``<pool name>.<method name>``), with
+    the call counters and latencies recorded for the given endpoint.
+    """
+    with _stats_lock:
+        endpoints = _call_stats.values()
+    return dict([(s.endpoint, s.to_dict()) for s in endpoints])
+
+
+def reset_call_stats():
+    with _stats_lock:
+        _call_stats.clear()
+
+
+class ManagedConnection(object):
+    """
+    A thin wrapper around a ``boto`` connection object. Attribute access is
+    passed through to the wrapped connection while method calls are timed
+    and retried with backoff if they get throttled.
+    """
+    def __init__(self, conn, pool):
+        self.__dict__['_conn'] = conn
+        self.__dict__['_pool'] = pool
+
+    def __getattr__(self, name):
+        attr = getattr(self._conn, name)
+        if name.startswith('_') or not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            return self._pool.call(name, attr, *args, **kwargs)
+        return call
+
+    def __setattr__(self, name, value):
+        setattr(self._conn, name, value)
+
+    def __nonzero__(self):
+        return True
+
+    def __repr__(self):
+        return "<ManagedConnection {0}: {1}>".format(self._pool.name, self._conn)
+
+
+class ConnectionPool(object):
+    """
+    Hand out a per-thread connection created by ``factory``.
+
+    :type name: string
+    :param name: A name for the pool (e.g., ``ec2``, ``s3``), used as the
+                 prefix of the endpoints when recording call stats.
+
+    :type factory: callable
+    :param factory: A no-argument callable returning a new connection object.
+
+    :type validator: callable
+    :param validator: A callable that receives a (managed) connection and
+                      performs a cheap call to check the credentials are valid.
+                      It is invoked until it succeeds once. If it raises a
+                      ``BotoServerError`` for invalid credentials (see
+                      ``is_auth_error``), the pool is marked invalid and
+                      ``get`` returns ``None``; other errors are retried on
+                      next use.
+
+    :type kind: string
+    :param kind: The kind of service the connections are for, ``compute`` or
+                 ``object_store``; used to pick the rate limit call family.
+    """
+    def __init__(self, name, factory, validator=None, kind='compute',
+                 max_retries=5, backoff=0.5, max_backoff=20):
+        self.name = name
+        self.kind = kind
+        self.factory = factory
+        self.validator = validator
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.valid = None  # None until validated, then True/False
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Return a connection for the calling thread, creating (and, if this
+        is the pool's first connection, validating) it as needed. Return
+        ``None`` if the connection could not be created or validated.
+        """
+        if self.valid is False:
+            return None
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            raw_conn = self.factory()
+            if not raw_conn:
+                return None
+            conn = ManagedConnection(raw_conn, self)
+            self._local.conn = conn
+        if self.valid is None:
+            with self._lock:
+                if self.valid is None:
+                    self.valid = self._validate(conn)
+            if self.valid is False:
+                self._local.conn = None
+                return None
+        return conn
+
+    def _validate(self, conn):
+        if not self.validator:
+            return True
+        try:
+            self.validator(conn)
+            return True
+        except BotoServerError, e:
+            if not is_auth_error(e):
+                # Do not fail the credentials because of throttling or a
+                # transient error; the validation will be attempted again on
+                # next use
+                log.warning("Error validating the {0} connection (will retry): {1}"
+                            .format(self.name, e))
+                return None
+            log.error("Cannot validate the credentials for the {0} connection: {1}"
+                      .format(self.name, e))
+            return False
+
+    def reset(self):
+        """
+        Discard the calling thread's connection and force the credentials to
+        be re-validated on next use.
+        """
+        self._local.conn = None
+        self.valid = None
+
+    def call(self, method_name, method, *args, **kwargs):
+        """
+        Invoke ``method`` with the provided arguments, within the shared
+        cloud API rate limits. Identical describe calls made concurrently
+        from multiple threads are coalesced into a single call.
+        """
+        family = ratelimit.call_family(method_name, self.kind)
+        if family == 'describe':
+            key = ratelimit.call_key(self.name, method_name, args, kwargs)
+            return ratelimit.coalescer.call(key, self._call, family, method_name,
+                                            method, *args, **kwargs)
+        return self._call(family, method_name, method, *args, **kwargs)
+
+    def _call(self, family, method_name, method, *args, **kwargs):
+        """
+        Invoke ``method`` with the provided arguments, recording the call
+        latency and retrying with exponential backoff if throttled.
+        """
+        stats = _get_stats("{0}.{1}".format(self.name, method_name))
+        attempt = 0
+        while True:
+            ratelimit.limiter.acquire(family)
+            start = time.time()
+            try:
+                result = method(*args, **kwargs)
+                stats.record(time.time() - start)
+                return result
+            except BotoServerError, e:
+                throttled = is_throttling_error(e)
+                stats.record(time.time() - start, error=True, throttled=throttled)
+                if not throttled or attempt >= self.max_retries:
+                    raise
+                sleep_for = min(self.max_backoff, self.backoff * (2 ** attempt))
+                sleep_for *= random.uniform(0.5, 1.0)
+                attempt += 1
+                log.debug("{0}.{1} call throttled ({2}); retrying in {3:.2f}s "
+                          "(attempt {4}/{5})".format(self.name, method_name,
+                                                     e.error_code, sleep_for,
+                                                     attempt, self.max_retries))
+                time.sleep(sleep_for)
+            except Exception:
+                stats.record(time.time() - start, error=True)
+                raise
@@ -1,16 +1,22 @@
 import boto
+import hashlib
 import socket
 import time
 import urllib
 import yaml
 
 from boto.ec2.connection import EC2Connection
+from boto.ec2.regioninfo import RegionInfo
 from boto.exception import BotoServerError, EC2ResponseError
 from boto.s3.connection import S3Connection
 
 from cm.clouds import CloudInterface
+from cm.clouds import ratelimit
+from cm.clouds.connections import ConnectionPool, is_throttling_error
+from cm.clouds.metadata import InstanceMetadata
 from cm.instance import Instance
 from cm.util import misc
+from cm.util import paths
 from cm.util.decorators import TestFlag
 
 import logging
@@ -31,6 +37,9 @@ class EC2Interface(CloudInterface):
         self._security_groups = []
         self._mac_address = None
         self._subnet_id = None
+        self._ec2_pool = None
+        self._s3_pool = None
+        self.metadata = InstanceMetadata(paths.INSTANCE_METADATA_FILE)
         try:
             log.debug("Using boto version {0}".format(boto.__version__))
         except:
@@ -39,56 +48,21 @@ class EC2Interface(CloudInterface):
     @TestFlag('ami-l0cal1')
     def get_ami(self):
         if self.ami is None:
-            for i in range(0, 5):
-                try:
-                    log.debug('Gathering instance ami, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/ami-id')
-                    self.ami = fp.read()
-                    fp.close()
-                    if self.ami:
-                        break
-                except IOError:
-                    pass
+            self.ami = self.metadata.get('ami-id')
         return self.ami
 
     @TestFlag('something.good')
     def get_type(self):
         if self.instance_type is None:
-            for i in range(0, 5):
-                try:
-                    url = 'http://169.254.169.254/latest/meta-data/instance-type'
-                    log.debug('Gathering instance type via {0}; attempt {1}/5'
-                              .format(url, i+1))
-                    fp = urllib.urlopen(url)
-                    if fp.code == 200:
-                        self.instance_type = fp.read()
-                    else:
-                        log.warning("Error (code {0}) retrieving instance type "
-                                    "from url {1}: {2}".format(fp.code, url,
-                                                               fp.read()))
-                    fp.close()
-                    if self.instance_type:
-                        break
-                except IOError:
-                    pass
+            self.instance_type = self.metadata.get('instance-type')
         return self.instance_type
 
     @TestFlag('id-LOCAL')
     def get_instance_id(self):
         if self.instance_id is None:
-            for i in range(0, 5):
-                try:
-                    log.debug('Gathering instance id, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/instance-id')
-                    self.instance_id = fp.read()
-                    fp.close()
-                    if self.instance_id:
-                        log.debug("Instance ID is '%s'" % self.instance_id)
-                        break
-                except IOError:
-                    pass
+            self.instance_id = self.metadata.get('instance-id')
+            if self.instance_id:
+                log.debug("Instance ID is '%s'" % self.instance_id)
         return self.instance_id
 
     @TestFlag(None)
@@ -110,26 +84,15 @@ class EC2Interface(CloudInterface):
     @TestFlag('us-local-1a')
     def get_zone(self):
         if self.zone is None:
-            for i in range(0, 5):
-                try:
-                    log.debug('Gathering instance zone, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/placement/availability-zone')
-                    self.zone = fp.read()
-                    fp.close()
-                    if self.zone:
-                        log.debug("Instance zone is '%s'" % self.zone)
-                        break
-                except IOError:
-                    pass
+            self.zone = self.metadata.get('placement/availability-zone')
+            if self.zone:
+                log.debug("Instance zone is '%s'" % self.zone)
         return self.zone
 
     @TestFlag('b8:8d:12:0e:60:5a')
     def get_mac_address(self):
         if not self._mac_address:
-            fp = urllib.urlopen('http://169.254.169.254/latest/meta-data/mac')
-            self._mac_address = fp.read().strip()
-            fp.close()
+            self._mac_address = (self.metadata.get('mac') or '').strip()
         return self._mac_address
 
     @property
@@ -144,105 +107,51 @@ class EC2Interface(CloudInterface):
 
     def get_vpc_id(self):
         if not self._vpc_id:
-            fp = urllib.urlopen('http://169.254.169.254/latest/meta-data/network/interfaces/macs/%s/vpc-id' % self.get_mac_address())
-            self._vpc_id = fp.read().strip()
-            fp.close()
-            if "404 - Not Found" in self._vpc_id:
-                self._vpc_id = None
+            self._vpc_id = (self.metadata.get_interface('vpc-id') or '').strip() or None
         return self._vpc_id
 
     def get_subnet_id(self):
         if not self.get_vpc_id():
             return None
         if not self._subnet_id:
-            fp = urllib.urlopen('http://169.254.169.254/latest/meta-data/network/interfaces/macs/%s/subnet-id' % self.get_mac_address())
-            self._subnet_id = fp.read().strip()
-            fp.close()
+            self._subnet_id = (self.metadata.get_interface('subnet-id') or '').strip()
         return self._subnet_id
 
     def get_security_group_ids(self):
         if not self._security_group_ids:
-            self._security_group_ids = []
-            fp = urllib.urlopen('http://169.254.169.254/latest/meta-data/network/interfaces/macs/%s/security-group-ids' % self.get_mac_address())
-            lines = fp.readlines()
-            for line in lines:
-                self._security_group_ids.append(urllib.unquote_plus(line.strip()))
-            fp.close()
+            self._security_group_ids = [
+                urllib.unquote_plus(line.strip()) for line in
+                (self.metadata.get_interface('security-group-ids') or '').splitlines()]
             log.debug("Fetched security group ids for the first time: %s" % self._security_group_ids)
         return self._security_group_ids
 
     @TestFlag(['cloudman_sg'])
     def get_security_groups(self):
         if not self._security_groups:
-            for i in range(0, 5):
-                try:
-                    log.debug(
-                        'Gathering instance security group, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/security-groups')
-                    self._security_groups = []
-                    for line in fp.readlines():
-                        self._security_groups.append(
-                            urllib.unquote_plus(line.strip()))
-                    fp.close()
-                    if self._security_groups:
-                        break
-                except IOError:
-                    pass
+            self._security_groups = [
+                urllib.unquote_plus(line.strip()) for line in
+                (self.metadata.get('security-groups') or '').splitlines()]
         return self._security_groups
 
     @TestFlag('local_keypair')
     def get_key_pair_name(self):
         if self.key_pair_name is None:
-            for i in range(0, 5):
-                try:
-                    log.debug(
-                        'Gathering instance public keys (i.e., key pairs), attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/public-keys')
-                    public_keys = fp.read()
-                    self.key_pair_name = public_keys.split('=')[1]
-                    fp.close()
-                    if self.key_pair_name:
-                        log.debug("Got key pair: '%s'" % self.key_pair_name)
-                        break
-                except IOError:
-                    pass
+            public_keys = self.metadata.get('public-keys')
+            if public_keys and '=' in public_keys:
+                self.key_pair_name = public_keys.split('=')[1]
+                log.debug("Got key pair: '%s'" % self.key_pair_name)
         return self.key_pair_name
 
     @TestFlag('127.0.0.1')
     def get_private_ip(self):
         if self.self_private_ip is None:
-            for i in range(0, 5):
-                try:
-                    log.debug('Gathering instance private IP, attempt %s' % i)
-                    # fp = urllib.urlopen('http://169.254.169.254/latest/meta-
-                    # data/local-hostname')
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/local-ipv4')
-                    self.self_private_ip = fp.read()
-                    fp.close()
-                    if self.self_private_ip:
-                        break
-                except IOError:
-                    pass
+            self.self_private_ip = self.metadata.get('local-ipv4')
         return self.self_private_ip
 
     @TestFlag('localhost')
     def get_local_hostname(self):
         if self.local_hostname is None:
-            for i in range(0, 5):
-                try:
-                    log.debug(
-                        'Gathering instance local hostname, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/local-hostname')
-                    self.local_hostname = fp.read()
-                    fp.close()
-                    if self.local_hostname:
-                        break
-                except IOError:
-                    pass
+            self.local_hostname = self.metadata.get('local-hostname')
         return self.local_hostname
 
     @TestFlag('localhost')
@@ -252,36 +161,19 @@ class EC2Interface(CloudInterface):
         Public hostname can be changed -- check it every self.update_frequency.
         """
         if self.public_hostname is None or (time.time() - self.public_hostname_updated > self.update_frequency):
-            for i in range(0, 5):
-                try:
-                    log.debug(
-                        'Gathering instance public hostname, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/public-hostname')
-                    self.public_hostname = fp.read()
-                    fp.close()
-                    if self.public_hostname:
-                        self.public_hostname_updated = time.time()
-                        break
-                except Exception, e:
-                    log.error("Error retrieving FQDN: %s" % e)
+            # The first time round, the hostname cached with the metadata
+            # is as current as can be
+            public_hostname = self.metadata.get(
+                'public-hostname', refresh=self.public_hostname is not None)
+            if public_hostname:
+                self.public_hostname = public_hostname
+                self.public_hostname_updated = time.time()
         return self.public_hostname
 
     @TestFlag('127.0.0.1')
     def get_public_ip(self):
         if self.self_public_ip is None:
-            for i in range(0, 5):
-                try:
-                    log.debug(
-                        'Gathering instance public hostname, attempt %s' % i)
-                    fp = urllib.urlopen(
-                        'http://169.254.169.254/latest/meta-data/public-ipv4')
-                    self.self_public_ip = fp.read()
-                    fp.close()
-                    if self.self_public_ip:
-                        break
-                except Exception, e:
-                    log.error("Error retrieving FQDN: %s" % e)
+            self.self_public_ip = self.metadata.get('public-ipv4')
         return self.self_public_ip
 
     def get_fqdn(self):
@@ -308,6 +200,10 @@ class EC2Interface(CloudInterface):
         Return a ``boto`` object representing the region where currently running.
         """
         if not self.region:
+            known = self.metadata.recall('region')
+            if known:
+                self.region = RegionInfo(name=known['name'], endpoint=known['endpoint'])
+                return self.region
             # Get instance zone and figure out the region from there
             zone = self.get_zone()[:-1]  # truncate zone and be left with region name
             tmp_conn = EC2Connection(self.aws_access_key,
@@ -320,49 +216,69 @@ class EC2Interface(CloudInterface):
                 if zone in r.name:
                     self.region = r
                     log.debug("Got region as '{0}'".format(self.region))
+                    self.metadata.remember('region', {'name': r.name, 'endpoint': r.endpoint})
                     break
         return self.region
 
     @TestFlag(None)
     def get_ec2_connection(self):
-        if not self.ec2_conn:
-            try:
-                log.debug('Establishing boto EC2 connection')
-                # Make sure we get a connection for the correct region
-                region = self.get_region()
-                self.ec2_conn = EC2Connection(
-                    self.aws_access_key, self.aws_secret_key, region=region)
-                # Do a simple query to test if provided credentials are valid
-                try:
-                    self.ec2_conn.get_all_instances()
-                    log.debug("Got boto EC2 connection for region '%s'" %
-                              self.ec2_conn.region.name)
-                except EC2ResponseError, e:
-                    log.error("Cannot validate provided AWS credentials (A:%s, S:%s): %s"
-                              % (self.aws_access_key, self.aws_secret_key, e))
-                    self.ec2_conn = False
-            except Exception, e:
-                log.error(e)
+        if self._ec2_pool is None:
+            self._ec2_pool = ConnectionPool('ec2', self._connect_ec2,
+                                            self._validate_ec2_connection)
+        conn = self._ec2_pool.get()
+        self.ec2_conn = conn if conn else False
         return self.ec2_conn
 
+    def _connect_ec2(self):
+        try:
+            log.debug('Establishing boto EC2 connection')
+            # Make sure we get a connection for the correct region
+            region = self.get_region()
+            return EC2Connection(
+                self.aws_access_key, self.aws_secret_key, region=region)
+        except Exception, e:
+            log.error(e)
+        return None
+
+    def _credentials_digest(self):
+        return hashlib.sha1('{0}:{1}'.format(self.aws_access_key,
+                                             self.aws_secret_key)).hexdigest()
+
+    def _validate_ec2_connection(self, ec2_conn):
+        # The credentials do not change over the lifetime of an instance so
+        # they need not be validated again when CloudMan restarts
+        if self.metadata.recall('validated_credentials') == self._credentials_digest():
+            log.debug("Using EC2 credentials validated previously on this instance")
+            return
+        # Do a simple query to test if provided credentials are valid
+        try:
+            ec2_conn.get_all_zones()
+            log.debug("Got boto EC2 connection for region '%s'" %
+                      ec2_conn.region.name)
+            self.metadata.remember('validated_credentials', self._credentials_digest())
+        except EC2ResponseError, e:
+            log.error("Cannot validate provided AWS credentials (A:%s, S:%s): %s"
+                      % (self.aws_access_key, self.aws_secret_key, e))
+            raise
+
     def get_s3_connection(self):
         # log.debug( 'Getting boto S3 connection' )
-        if not self.s3_conn:
-            log.debug("No S3 Connection, creating a new one.")
-            try:
-                self.s3_conn = S3Connection(
-                    self.aws_access_key, self.aws_secret_key)
-                log.debug('Got boto S3 connection.')
-                # try:
-                #     self.s3_conn.get_bucket('test_creds') # Any bucket name will do - just testing the call
-                #     log.debug( 'Got boto S3 connection.' )
-                # except S3ResponseError, e:
-                #     log.error("Cannot validate provided AWS credentials: %s" % e)
-                #     self.s3_conn = False
-            except Exception, e:
-                log.error(e)
+        if self._s3_pool is None:
+            self._s3_pool = ConnectionPool('s3', self._connect_s3, kind='object_store')
+        self.s3_conn = self._s3_pool.get()
         return self.s3_conn
 
+    def _connect_s3(self):
+        log.debug("No S3 Connection, creating a new one.")
+        try:
+            s3_conn = S3Connection(
+                self.aws_access_key, self.aws_secret_key)
+            log.debug('Got boto S3 connection.')
+            return s3_conn
+        except Exception, e:
+            log.error(e)
+        return None
+
     @TestFlag(None)
     def add_tag(self, resource, key, value):
         """ Add tag as key value pair to the `resource` object. The `resource`
@@ -372,12 +288,18 @@ class EC2Interface(CloudInterface):
             try:
                 log.debug("Adding tag '%s:%s' to resource '%s'" % (
                     key, value, resource.id if resource.id else resource))
+                ratelimit.limiter.acquire('tags')
                 resource.add_tag(key, value)
             except EC2ResponseError, e:
-                log.error(
-                    "Exception adding tag '%s:%s' to resource '%s': %s" % (key,
-                                                                           value, resource, e))
-                self.tags_supported = False
+                if is_throttling_error(e):
+                    # Keep using tags; the value is stored locally below
+                    log.warning("Throttled while adding tag '%s:%s' to resource '%s'"
+                                % (key, value, resource))
+                else:
+                    log.error(
+                        "Exception adding tag '%s:%s' to resource '%s': %s" % (key,
+                                                                               value, resource, e))
+                    self.tags_supported = False
         resource_tags = self.tags.get(resource.id, {})
         resource_tags[key] = value
         self.tags[resource.id] = resource_tags
@@ -395,7 +317,8 @@ class EC2Interface(CloudInterface):
             except EC2ResponseError, e:
                 log.error("Exception getting tag '%s' on resource '%s': %s" %
                           (key, resource, e))
-                self.tags_supported = False
+                if not is_throttling_error(e):
+                    self.tags_supported = False
         if not value:
             resource_tags = self.tags.get(resource.id, {})
             value = resource_tags.get(key)
@@ -2,6 +2,7 @@ import socket
 import time
 from urlparse import urlparse
 
+from cm.clouds.connections import ConnectionPool
 from cm.clouds.ec2 import EC2Interface
 from cm.util import misc
 from cm.util import paths
@@ -72,83 +73,101 @@ class EucaInterface(EC2Interface):
         self.ec2_url = self.user_data.get('ec2_url', None)
 
     def get_ec2_connection(self):
-        if not self.ec2_conn:
-            if self.ec2_url:
-                url = urlparse(self.ec2_url)
-                host = url.hostname
-                port = url.port
-                path = url.path
-                if url.scheme == 'https':
-                    is_secure = True
-                else:
-                    is_secure = False
-                try:
-                    log.debug(
-                        'Establishing local boto EC2 connection to %s' % self.ec2_url)
-                    zone = self.get_zone()
-                    region = RegionInfo(name=zone, endpoint=host)
-                    self.ec2_conn = EC2Connection(
-                        aws_access_key_id=self.aws_access_key,
-                        aws_secret_access_key=self.aws_secret_key,
-                        is_secure=is_secure,
-                        host=host,
-                        port=port,
-                        path=path,
-                        region=region,
-                        debug=2,
-                    )
-                    # Do a simple query to test if provided credentials are
-                    # valid
-                    try:
-                        self.ec2_conn.get_all_instances()
-                        log.debug("Got local boto EC2 connection to %s for region '%s'" %
-                                  (self.ec2_url, self.ec2_conn.region.name))
-                    except EC2ResponseError, e:
-                        log.error("Cannot validate provided local AWS credentials to %s (A:%s, S:%s): %s" % (
-                            self.ec2_url, self.aws_access_key, self.aws_secret_key, e))
-                        self.ec2_conn = False
-                except Exception, e:
-                    log.error(e)  # to match interface for Ec2Interface
-
-            else:
-                super(EucaInterface,
-                      self).get_ec2_connection()  # default to ec2 connection
+        if not self.ec2_url:
+            # default to ec2 connection
+            return super(EucaInterface, self).get_ec2_connection()
+        if self._ec2_pool is None:
+            self._ec2_pool = ConnectionPool('euca-ec2', self._connect_ec2,
+                                            self._validate_ec2_connection)
+        conn = self._ec2_pool.get()
+        self.ec2_conn = conn if conn else False
         return self.ec2_conn
 
+    def _connect_ec2(self):
+        if not self.ec2_url:
+            return super(EucaInterface, self)._connect_ec2()
+        url = urlparse(self.ec2_url)
+        host = url.hostname
+        port = url.port
+        path = url.path
+        if url.scheme == 'https':
+            is_secure = True
+        else:
+            is_secure = False
+        try:
+            log.debug(
+                'Establishing local boto EC2 connection to %s' % self.ec2_url)
+            zone = self.get_zone()
+            region = RegionInfo(name=zone, endpoint=host)
+            return EC2Connection(
+                aws_access_key_id=self.aws_access_key,
+                aws_secret_access_key=self.aws_secret_key,
+                is_secure=is_secure,
+                host=host,
+                port=port,
+                path=path,
+                region=region,
+                debug=2,
+            )
+        except Exception, e:
+            log.error(e)  # to match interface for Ec2Interface
+        return None
+
+    def _validate_ec2_connection(self, ec2_conn):
+        if not self.ec2_url:
+            return super(EucaInterface, self)._validate_ec2_connection(ec2_conn)
+        # Do a simple query to test if provided credentials are valid
+        try:
+            ec2_conn.get_all_zones()
+            log.debug("Got local boto EC2 connection to %s for region '%s'" %
+                      (self.ec2_url, ec2_conn.region.name))
+        except EC2ResponseError, e:
+            log.error("Cannot validate provided local AWS credentials to %s (A:%s, S:%s): %s" % (
+                self.ec2_url, self.aws_access_key, self.aws_secret_key, e))
+            raise
+
     def get_s3_connection(self):
         log.debug('Getting boto S3 connection')
-        if self.s3_conn is None:
-            log.debug("No S3 Connection, creating a new one.")
-            if self.s3_url:
-                url = urlparse(self.s3_url)
-                host = url.hostname
-                port = url.port
-                path = url.path
-                calling_format = SubdomainCallingFormat()
-                if host.find('amazon') == -1:  # assume that non-amazon won't use <bucket>.<hostname> format
-                    calling_format = OrdinaryCallingFormat()
-                if url.scheme == 'https':
-                    is_secure = True
-                else:
-                    is_secure = False
-                try:
-                    self.s3_conn = S3Connection(
-                        aws_access_key_id=self.aws_access_key,
-                        aws_secret_access_key=self.aws_secret_key,
-                        is_secure=is_secure,
-                        port=port,
-                        host=host,
-                        path=path,
-                        calling_format=calling_format,
-                        # debug = 2
-                    )
-                    log.debug('Got boto S3 connection to %s' % self.s3_url)
-                except Exception, e:
-                    log.error("Exception getting S3 connection: %s" % e)
-            else:  # default to Amazon connection
-                super(EucaInterface, self).get_s3_connection()
+        if not self.s3_url:  # default to Amazon connection
+            return super(EucaInterface, self).get_s3_connection()
+        if self._s3_pool is None:
+            self._s3_pool = ConnectionPool('euca-s3', self._connect_s3,
+                                           kind='object_store')
+        self.s3_conn = self._s3_pool.get()
         return self.s3_conn
 
+    def _connect_s3(self):
+        if not self.s3_url:
+            return super(EucaInterface, self)._connect_s3()
+        log.debug("No S3 Connection, creating a new one.")
+        url = urlparse(self.s3_url)
+        host = url.hostname
+        port = url.port
+        path = url.path
+        calling_format = SubdomainCallingFormat()
+        if host.find('amazon') == -1:  # assume that non-amazon won't use <bucket>.<hostname> format
+            calling_format = OrdinaryCallingFormat()
+        if url.scheme == 'https':
+            is_secure = True
+        else:
+            is_secure = False
+        try:
+            s3_conn = S3Connection(
+                aws_access_key_id=self.aws_access_key,
+                aws_secret_access_key=self.aws_secret_key,
+                is_secure=is_secure,
+                port=port,
+                host=host,
+                path=path,
+                calling_format=calling_format,
+                # debug = 2
+            )
+            log.debug('Got boto S3 connection to %s' % self.s3_url)
+            return s3_conn
+        except Exception, e:
+            log.error("Exception getting S3 connection: %s" % e)
+        return None
+
     def get_user_data(self, force=False):
         if self.user_data is None or force:
             self.user_data = misc.load_yaml_file(paths.USER_DATA_FILE)
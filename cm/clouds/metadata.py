@@ -0,0 +1,231 @@
+"""
+A persistent cache of the instance metadata served at 169.254.169.254.
+
+``InstanceMetadata`` fetches all the metadata CloudMan uses concurrently, in
+one pass, the first time any of it is needed and saves it to disk. On a
+CloudMan restart the saved metadata is reused as long as it was saved by the
+same instance (i.e., its instance ID matches); values that may change when an
+instance is stopped and started (e.g., its type or IP addresses) are only
+reused within the same boot. Values derived from the metadata (e.g., the
+region's endpoint) can be saved along with it with ``remember``.
+"""
+import json
+import os
+import threading
+import time
+import urllib2
+
+from cm.util import bulk
+
+import logging
+log = logging.getLogger('cloudman')
+
+METADATA_URL = 'http://169.254.169.254/latest/meta-data/'
+BOOT_ID_FILE = '/proc/sys/kernel/random/boot_id'
+
+# Metadata that does not change over the lifetime of an instance
+INSTANCE_KEYS = ['ami-id', 'placement/availability-zone', 'public-keys',
+                 'security-groups', 'mac']
+# Metadata that does not change until the instance is stopped
+BOOT_KEYS = ['instance-type', 'local-ipv4', 'public-ipv4', 'local-hostname',
+             'public-hostname']
+# Metadata of the instance's network interface, under `network/interfaces/macs/<mac>/`
+INTERFACE_KEYS = ['vpc-id', 'subnet-id', 'security-group-ids']
+
+
+def _read_boot_id():
+    try:
+        with open(BOOT_ID_FILE) as f:
+            return f.read().strip()
+    except IOError:
+        return None
+
+
+class InstanceMetadata(object):
+
+    def __init__(self, cache_file, base_url=METADATA_URL, num_retries=5,
+                 timeout=2, backoff=0.2):
+        self.cache_file = cache_file
+        self.base_url = base_url
+        self.num_retries = num_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.instance_id = None
+        self.boot_id = _read_boot_id()
+        self.values = {}  # Metadata key: value (`None` if not available)
+        self.boot_values = {}
+        self.derived = {}
+        self.loaded = False
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()
+
+    def __repr__(self):
+        return "InstanceMetadata({0})".format(self.instance_id)
+
+    def fetch(self, key):
+        """
+        Fetch the value of the metadata ``key`` (e.g., ``ami-id``) from the
+        metadata service, retrying on errors. Return ``None`` if there is no
+        such key; raise an ``IOError`` if it cannot be fetched.
+        """
+        url = self.base_url + key
+        for attempt in range(self.num_retries):
+            try:
+                fp = urllib2.urlopen(url, timeout=self.timeout)
+                try:
+                    return fp.read()
+                finally:
+                    fp.close()
+            except urllib2.HTTPError, e:
+                if e.code == 404:
+                    return None
+                error = "code {0}".format(e.code)
+            except IOError, e:
+                error = e
+            log.debug("Error fetching instance metadata from {0}; attempt {1}/{2}: {3}"
+                      .format(url, attempt + 1, self.num_retries, error))
+            if attempt < self.num_retries - 1:
+                time.sleep(self.backoff * 2 ** attempt)
+        raise IOError("Could not fetch instance metadata from {0}: {1}".format(url, error))
+
+    def _interface_key(self, key):
+        return 'network/interfaces/macs/{0}/{1}'.format(self.values.get('mac'), key)
+
+    def _load_cache(self):
+        if not os.path.exists(self.cache_file):
+            return False
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+        except (IOError, ValueError), e:
+            log.debug("Ignoring unreadable instance metadata cache {0}: {1}"
+                      .format(self.cache_file, e))
+            return False
+        if cache.get('instance_id') != self.instance_id:
+            log.debug("Ignoring instance metadata cached by instance {0}"
+                      .format(cache.get('instance_id')))
+            return False
+        self.values.update(cache.get('values', {}))
+        self.derived.update(cache.get('derived', {}))
+        if self.boot_id and cache.get('boot_id') == self.boot_id:
+            self.boot_values.update(cache.get('boot_values', {}))
+        return True
+
+    def save(self):
+        cache = {'instance_id': self.instance_id, 'boot_id': self.boot_id,
+                 'values': self.values, 'boot_values': self.boot_values,
+                 'derived': self.derived}
+        tmp_file = self.cache_file + '.tmp'
+        with self._save_lock:
+            try:
+                if not os.path.isdir(os.path.dirname(self.cache_file)):
+                    os.makedirs(os.path.dirname(self.cache_file))
+                with open(tmp_file, 'w') as f:
+                    json.dump(cache, f)
+                os.rename(tmp_file, self.cache_file)
+            except (IOError, OSError), e:
+                log.warning("Could not save the instance metadata cache {0}: {1}"
+                            .format(self.cache_file, e))
+
+    def _fetch_all(self, keys):
+        """
+        Fetch the metadata ``keys`` concurrently. Return a dict with the
+        values of the keys that could be fetched.
+        """
+        fetched = {}
+
+        def _fetch(key):
+            fetched[key] = self.fetch(key)
+        if keys:
+            bulk.run_concurrently([(key, lambda key=key: _fetch(key)) for key in keys],
+                                  max_workers=len(keys))
+        return fetched
+
+    def load(self):
+        """
+        Fetch the instance ID, then load the cached metadata saved by this
+        instance and fetch, concurrently, any missing from the cache. Return
+        ``self``.
+        """
+        with self._lock:
+            if self.loaded:
+                return self
+            started = time.time()
+            try:
+                self.instance_id = self.fetch('instance-id')
+            except IOError, e:
+                log.error("Could not get the instance ID so not caching instance "
+                          "metadata: {0}".format(e))
+            if not self.instance_id:
+                self.loaded = True
+                return self
+            cached = self._load_cache()
+            missing = ([k for k in INSTANCE_KEYS if k not in self.values] +
+                       [k for k in BOOT_KEYS if k not in self.boot_values])
+            for key, value in self._fetch_all(missing).iteritems():
+                (self.boot_values if key in BOOT_KEYS else self.values)[key] = value
+            if self.values.get('mac'):
+                # The interface's metadata is under its MAC address
+                missing_interface = [self._interface_key(k) for k in INTERFACE_KEYS
+                                     if self._interface_key(k) not in self.values]
+                self.values.update(self._fetch_all(missing_interface))
+                missing += missing_interface
+            if not cached or missing:
+                self.save()
+            self.loaded = True
+            log.debug("Loaded the instance metadata of {0} in {1:.2f} seconds ({2} keys "
+                      "fetched)".format(self.instance_id, time.time() - started, len(missing)))
+        return self
+
+    def get(self, key, refresh=False):
+        """
+        Return the value of the metadata ``key`` (e.g., ``ami-id``), loading
+        the metadata if it has not been yet, or ``None`` if there is no such
+        key or it cannot be fetched. If ``refresh`` is set, fetch the value
+        again (and update the cache if it has changed).
+        """
+        if not self.loaded:
+            self.load()
+        if key == 'instance-id' and self.instance_id:
+            return self.instance_id
+        values = self.boot_values if key in BOOT_KEYS else self.values
+        if refresh or key not in values:
+            try:
+                value = self.fetch(key)
+            except IOError, e:
+                log.warning(e)
+                # Keep any known value if the service cannot be reached
+                return values.get(key)
+            if key not in values or values[key] != value:
+                values[key] = value
+                if self.instance_id:
+                    self.save()
+        return values[key]
+
+    def get_interface(self, key):
+        """
+        Return the value of the network interface metadata ``key`` (e.g.,
+        ``vpc-id``), or ``None`` if the instance's network interface does
+        not have it (e.g., ``vpc-id`` outside of a VPC).
+        """
+        mac = self.get('mac')
+        if not mac:
+            return None
+        return self.get(self._interface_key(key))
+
+    def recall(self, name):
+        if not self.loaded:
+            self.load()
+        return self.derived.get(name)
+
+    def remember(self, name, value):
+        """
+        Save the value ``value``, derived from the instance metadata, under
+        ``name`` along with the instance's metadata.
+        """
+        if not self.loaded:
+            self.load()
+        if self.derived.get(name) != value:
+            self.derived[name] = value
+            if self.instance_id:
+                self.save()
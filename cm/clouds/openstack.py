@@ -2,6 +2,8 @@ import time
 import urllib
 import yaml
 
+from cm.clouds import ratelimit
+from cm.clouds.connections import ConnectionPool
 from cm.clouds.ec2 import EC2Interface
 from cm.instance import Instance
 from cm.util.decorators import TestFlag
@@ -55,25 +57,32 @@ class OSInterface(EC2Interface):
 
     @TestFlag(None)
     def get_ec2_connection(self):
-        if not self.ec2_conn:
-            try:
-                log.debug('Establishing a boto Nova connection')
-                self.ec2_conn = self._get_default_ec2_conn()
-                # Do a simple query to test if provided credentials are valid
-                try:
-                    log.debug("Testing the new boto Nova connection ({0})".format(self.ec2_conn))
-                    self.ec2_conn.get_all_key_pairs()
-                    log.debug("Got boto Nova connection for region {0}".format(
-                        self.ec2_conn.region.name))
-                except EC2ResponseError, e:
-                    log.error("Cannot validate provided OpenStack credentials or configuration "
-                              "(AK:{0}, SK:{1}): {2}".format(self.aws_access_key, self.aws_secret_key, e))
-                    self.ec2_conn = None
-            except Exception, e:
-                log.error("Trouble getting boto Nova connection: {0}".format(e))
-                self.ec2_conn = None
+        if self._ec2_pool is None:
+            self._ec2_pool = ConnectionPool('nova', self._connect_ec2,
+                                            self._validate_ec2_connection)
+        self.ec2_conn = self._ec2_pool.get()
         return self.ec2_conn
 
+    def _connect_ec2(self):
+        try:
+            log.debug('Establishing a boto Nova connection')
+            return self._get_default_ec2_conn()
+        except Exception, e:
+            log.error("Trouble getting boto Nova connection: {0}".format(e))
+        return None
+
+    def _validate_ec2_connection(self, ec2_conn):
+        # Do a simple query to test if provided credentials are valid
+        try:
+            log.debug("Testing the new boto Nova connection ({0})".format(ec2_conn))
+            ec2_conn.get_all_key_pairs()
+            log.debug("Got boto Nova connection for region {0}".format(
+                ec2_conn.region.name))
+        except EC2ResponseError, e:
+            log.error("Cannot validate provided OpenStack credentials or configuration "
+                      "(AK:{0}, SK:{1}): {2}".format(self.aws_access_key, self.aws_secret_key, e))
+            raise
+
     def _get_default_ec2_conn(self, region=None):
         ec2_conn = None
         try:
@@ -95,28 +104,29 @@ class OSInterface(EC2Interface):
         # TODO: Port this use_object_store logic to other clouds as well
         if self.app and not self.app.use_object_store:
             return None
-        if not self.s3_conn:
-            log.debug("Establishing a boto Swift connection.")
-            try:
-                self.s3_conn = boto.connect_s3(
-                    aws_access_key_id=self.aws_access_key,
-                    aws_secret_access_key=self.aws_secret_key,
-                    is_secure=self.is_secure,
-                    host=self.s3_host,
-                    port=self.s3_port,
-                    path=self.s3_conn_path,
-                    calling_format=self.calling_format)
-                log.debug('Got boto Swift connection.')
-                # try:
-                #     self.s3_conn.get_bucket('cloudman') # Any bucket name will do - just testing the call
-                #     log.debug('Got boto Swift connection.')
-                # except S3ResponseError, e:
-                #     log.error("Cannot validate provided OpenStack credentials: %s" % e)
-                #     self.s3_conn = None
-            except Exception, e:
-                log.error("Trouble creating a Swift connection: {0}".format(e))
+        if self._s3_pool is None:
+            self._s3_pool = ConnectionPool('swift', self._connect_s3,
+                                           kind='object_store')
+        self.s3_conn = self._s3_pool.get()
         return self.s3_conn
 
+    def _connect_s3(self):
+        log.debug("Establishing a boto Swift connection.")
+        try:
+            s3_conn = boto.connect_s3(
+                aws_access_key_id=self.aws_access_key,
+                aws_secret_access_key=self.aws_secret_key,
+                is_secure=self.is_secure,
+                host=self.s3_host,
+                port=self.s3_port,
+                path=self.s3_conn_path,
+                calling_format=self.calling_format)
+            log.debug('Got boto Swift connection.')
+            return s3_conn
+        except Exception, e:
+            log.error("Trouble creating a Swift connection: {0}".format(e))
+        return None
+
     @TestFlag("127.0.0.1")
     def get_public_ip(self):
         """ NeCTAR's public & private IPs are the same and also local-ipv4 metadata filed
@@ -146,6 +156,7 @@ class OSInterface(EC2Interface):
             try:
                 log.debug("Adding tag '%s:%s' to resource '%s'" % (
                     key, value, resource.id if resource.id else resource))
+                ratelimit.limiter.acquire('tags')
                 resource.add_tag(key, value)
             except EC2ResponseError, e:
                 log.error("Exception adding tag '%s:%s' to resource '%s': %s" % (key, value, resource, e))
@@ -0,0 +1,194 @@
+"""
+A global budget for cloud API calls.
+
+All cloud interfaces share a single ``RateLimiter``, which keeps a token
+bucket per family of calls (e.g., ``describe``, ``instances``, ``tags``) so
+a burst of changes to many volumes or instances is smoothed out instead of
+tripping the provider's throttling. Concurrent identical describe calls are
+merged by a ``Coalescer`` into a single in-flight request whose result is
+handed to all the callers.
+
+The limits can be set via user data using the ``cloud_api_rate_limits`` key,
+for example::
+
+    cloud_api_rate_limits:
+        describe: {rate: 10, burst: 40}
+        tags: {rate: 2, burst: 10}
+"""
+import threading
+import time
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Per family defaults: ``rate`` tokens (calls) per second, up to ``burst``
+DEFAULT_LIMITS = {
+    'describe': {'rate': 5, 'burst': 20},
+    'instances': {'rate': 1, 'burst': 5},
+    'tags': {'rate': 5, 'burst': 20},
+    'object_store': {'rate': 20, 'burst': 50},
+    'default': {'rate': 2, 'burst': 10},
+}
+
+INSTANCE_CALLS = ['run_instances', 'terminate_instances', 'reboot_instances',
+                  'request_spot_instances', 'cancel_spot_instance_requests']
+
+
+def call_family(method_name, kind='compute'):
+    """
+    Return the name of the call family ``method_name`` belongs to. ``kind``
+    is the kind of service the call is made against (``compute`` or
+    ``object_store``).
+    """
+    if kind == 'object_store':
+        return 'object_store'
+    if method_name.startswith('get_all_') or method_name.startswith('get_only_') \
+       or method_name.startswith('describe_') or method_name == 'update':
+        return 'describe'
+    if method_name in INSTANCE_CALLS:
+        return 'instances'
+    if 'tag' in method_name:
+        return 'tags'
+    return 'default'
+
+
+class TokenBucket(object):
+    """
+    A thread-safe token bucket refilled at ``rate`` tokens per second and
+    holding at most ``burst`` tokens.
+    """
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.last_refill = time.time()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.time()
+        self.tokens = min(self.burst, self.tokens + (now - self.last_refill) * self.rate)
+        self.last_refill = now
+
+    def try_acquire(self, tokens=1):
+        """
+        Take ``tokens`` from the bucket without blocking. Return the number
+        of seconds to wait before the tokens become available (``0`` if they
+        were acquired).
+        """
+        with self.lock:
+            self._refill()
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            if self.rate <= 0:
+                return None
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens=1):
+        """
+        Block until ``tokens`` are available and take them from the bucket.
+        Return the total time spent waiting.
+        """
+        waited = 0
+        while True:
+            wait = self.try_acquire(tokens)
+            if wait == 0:
+                return waited
+            if wait is None:  # A rate of 0 disables the limit
+                return waited
+            time.sleep(wait)
+            waited += wait
+
+
+class RateLimiter(object):
+    """
+    A collection of ``TokenBucket``s, one per call family.
+    """
+    def __init__(self, limits=None):
+        self.lock = threading.Lock()
+        self.buckets = {}
+        self.configure(limits)
+
+    def configure(self, limits=None):
+        """
+        (Re)create the buckets using ``DEFAULT_LIMITS`` updated with the
+        provided ``limits`` dict (keyed by family name).
+        """
+        all_limits = dict([(f, dict(l)) for f, l in DEFAULT_LIMITS.iteritems()])
+        for family, limit in (limits or {}).iteritems():
+            try:
+                all_limits.setdefault(family, {}).update(limit)
+            except (TypeError, ValueError), e:
+                log.warning("Ignoring invalid cloud API rate limit for '{0}' ({1}): {2}"
+                            .format(family, limit, e))
+        with self.lock:
+            self.buckets = dict([(f, TokenBucket(l.get('rate', 1), l.get('burst', 1)))
+                                 for f, l in all_limits.iteritems()])
+
+    def acquire(self, family):
+        """
+        Block until a call from ``family`` is allowed to go ahead.
+        """
+        with self.lock:
+            bucket = self.buckets.get(family) or self.buckets.get('default')
+        waited = bucket.acquire()
+        if waited > 1:
+            log.debug("Waited {0:.2f}s for a '{1}' cloud API call token"
+                      .format(waited, family))
+        return waited
+
+
+class _InFlightCall(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class Coalescer(object):
+    """
+    Merge concurrent calls that have the same key into a single call.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = {}
+
+    def call(self, key, fn, *args, **kwargs):
+        """
+        Invoke ``fn`` unless a call with the same ``key`` is already in
+        progress, in which case wait for it and return its result (or raise
+        its exception).
+        """
+        with self.lock:
+            pending = self.in_flight.get(key)
+            owner = pending is None
+            if owner:
+                pending = self.in_flight[key] = _InFlightCall()
+        if not owner:
+            pending.done.wait()
+            if pending.error is not None:
+                raise pending.error
+            return pending.result
+        try:
+            pending.result = fn(*args, **kwargs)
+            return pending.result
+        except Exception, e:
+            pending.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.in_flight[key]
+            pending.done.set()
+
+
+def call_key(name, method_name, args, kwargs):
+    """
+    Return a key identifying a call, for use with a ``Coalescer``.
+    """
+    return (name, method_name, repr(args), repr(sorted(kwargs.items())))
+
+
+# Shared by all the cloud interfaces
+limiter = RateLimiter()
+coalescer = Coalescer()
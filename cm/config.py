@@ -171,6 +171,12 @@ class Configuration(dict):
     def multiple_processes(self):
         return self.get("configure_multiple_galaxy_processes", False)
 
+    @property
+    def db_pooler(self):
+        # Pool Galaxy's database connections by default if it runs multiple
+        # processes
+        return self.get("db_pooler", self.multiple_processes)
+
     @property
     def condor_enabled(self):
         return self.get("condor_enabled", False)
@@ -16,6 +16,8 @@ NGINX_GALAXY_REPORTS = "nginx_galaxy_reports_locations"
 NGINX_GALAXY = "nginx_galaxy_locations"
 NGINX_CLOUDERA_MANAGER = "nginx_cloudera_manager_locations"
 NGINX_CLOUDGENE = "nginx_cloudgene_locations"
+NGINX_STATUS_CACHE = "nginx_status_cache"
+NGINX_STATUS_CACHE_LOCATIONS = "nginx_status_cache_locations"
 
 PROFTPD_CONF_TEMPLATE = "proftpd.conf"
 SGE_INSTALL_TEMPLATE = "sge_install_template"
@@ -2,10 +2,13 @@ import json
 import logging
 import os
 import subprocess
+import threading
 import time
 
 import cm.util.paths as paths
 from cm.util import Time
+from cm.util import instrumentation
+from cm.util import metrics
 from cm.util import misc
 from cm.base.controller import BaseController
 from cm.framework import expose
@@ -456,6 +459,10 @@ class CM(BaseController):
         snap_status = self.app.manager.snapshot_status()
         status_dict['snapshot'] = {'status': str(snap_status[0]),
                                    'progress': str(snap_status[1])}
+        pooler = self.app.manager.service_registry.get_active(
+            ServiceRole.to_string(ServiceRole.PGBOUNCER))
+        if pooler:
+            status_dict['db_pool'] = pooler.get_stats()
         status_dict['master_is_exec_host'] = self.app.manager.master_exec_host
         status_dict['ignore_deps_framework'] = self.app.config.ignore_unsatisfiable_dependencies
         status_dict['messages'] = self.messages_string(self.app.msgs.get_messages())
@@ -484,6 +491,41 @@ class CM(BaseController):
         else:
             return json.dumps({'log_messages': self.app.logger.logmessages})
 
+    @expose
+    def instrumentation(self, trans):
+        """
+        Return request latencies, forked process and cloud API call stats
+        as JSON.
+        """
+        return json.dumps(instrumentation.get_stats())
+
+    @expose
+    def node_metrics(self, trans, instance_id='master', resolution='1m', window=''):
+        """
+        Return the utilization metrics of instance ``instance_id`` (``master``
+        for the master) as JSON, at ``resolution`` (``10s``, ``1m`` or ``10m``)
+        and optionally only for the last ``window`` seconds.
+        """
+        window = int(window) if str(window).isdigit() else None
+        return json.dumps(metrics.node_metrics.to_dict(instance_id, resolution, window))
+
+    @expose
+    def postgres_stats(self, trans):
+        """
+        Return the connection, checkpoint and replication statistics of the
+        PostgreSQL server as JSON.
+        """
+        svcs = self.app.manager.get_services(svc_role=ServiceRole.GALAXY_POSTGRES)
+        return json.dumps(svcs[0].get_stats() if svcs else {})
+
+    @expose
+    def metrics(self, trans):
+        """
+        Return the instrumentation data in the Prometheus text format.
+        """
+        trans.response.set_content_type("text/plain; version=0.0.4")
+        return instrumentation.to_prometheus()
+
     def messages_string(self, messages):
         """
         Convert all messages into a string representation.
@@ -518,6 +560,21 @@ class CM(BaseController):
         else:
             return "Cannot find %s service." % service_name
 
+    @expose
+    def resize_galaxy(self, trans, web='', handlers=''):
+        """
+        Change the number of Galaxy web and/or job handler processes without
+        stopping Galaxy (see ``GalaxyService.resize``).
+        """
+        web = int(web) if str(web).isdigit() else None
+        handlers = int(handlers) if str(handlers).isdigit() else None
+        svcs = self.app.manager.get_services(svc_role=ServiceRole.GALAXY)
+        if not svcs or not svcs[0].get_topology():
+            return "Galaxy is not running multiple processes."
+        threading.Thread(target=svcs[0].resize, args=(web, handlers)).start()
+        return "Resizing Galaxy to {0} web and {1} handler processes.".format(
+            web or len(svcs[0].get_topology().web), handlers or len(svcs[0].get_topology().handlers))
+
     @expose
     def update_galaxy(self, trans, repository="http://bitbucket.org/galaxy/galaxy-dist", db_only=False):
         if db_only == 'True':
@@ -8,6 +8,8 @@ from cm import util
 
 import simplejson
 
+from cm.util import assets
+
 import helpers
 # This adds the routes url_for function to the helpers bundle that gets
 # sent for template generation.
@@ -23,6 +25,17 @@ log = logging.getLogger('cloudman')
 url_for = base.routes.url_for
 
 
+def static_url(path):
+    """
+    Return the URL of the static file at `path` (e.g., `/static/style/base.css`)
+    in its content-hashed form (see `cm.util.assets`) so it can be cached by
+    browsers for good.
+    """
+    return url_for(assets.static_url(path))
+
+helpers.static_url = static_url
+
+
 def expose(func):
     """
     Decorator: mark a function as 'exposed' and thus web accessible
@@ -7,6 +7,7 @@ import types
 import logging
 import os.path
 import tarfile
+import time
 
 from Cookie import SimpleCookie
 
@@ -21,6 +22,8 @@ from paste.response import HeaderDict
 # For FieldStorage
 import cgi
 
+from cm.util import instrumentation
+
 log = logging.getLogger('cloudman')
 
 
@@ -90,6 +93,7 @@ class WebApplication(object):
         friendly objects, finds the appropriate method to handle the request
         and calls it.
         """
+        start = time.time()
         # Map url using routes
         path_info = environ.get('PATH_INFO', '')
         map = self.mapper.match(path_info)
@@ -135,6 +139,8 @@ class WebApplication(object):
             body = self.handle_controller_exception(e, trans, **kwargs)
             if not body:
                 raise
+        finally:
+            instrumentation.record_request(controller_name, action, time.time() - start)
         # Now figure out what we got back and try to get it to the browser in
         # a smart way
         if callable(body):
@@ -5,6 +5,8 @@ from paste.httpheaders import ETAG
 
 from paste.urlparser import StaticURLParser
 
+from cm.util import assets
+
 
 class CacheableStaticURLParser(StaticURLParser):
     def __init__(self, directory, cache_seconds=None):
@@ -13,6 +15,12 @@ class CacheableStaticURLParser(StaticURLParser):
 
     def __call__(self, environ, start_response):
         path_info = environ.get('PATH_INFO', '')
+        if path_info.startswith('/{0}/'.format(assets.HASHED_DIR)):
+            # A content-hashed URL (see `cm.util.assets`): drop the hash and
+            # let the file be cached for good
+            request.path_info_pop(environ)
+            request.path_info_pop(environ)
+            return self.__class__(self.directory, assets.FAR_FUTURE)(environ, start_response)
         if not path_info:
             return self.add_slash(environ, start_response)
         if path_info == '/':
@@ -25,7 +33,7 @@ class CacheableStaticURLParser(StaticURLParser):
             return self.not_found(environ, start_response)
         if os.path.isdir(full):
             # @@: Cache?
-            return self.__class__(full)(environ, start_response)
+            return self.__class__(full, self.cache_seconds)(environ, start_response)
         if environ.get('PATH_INFO') and environ.get('PATH_INFO') != '/':
             return self.error_extra_path(environ, start_response)
         if_none_match = environ.get('HTTP_IF_NONE_MATCH')
@@ -8,9 +8,10 @@ import time
 
 from boto.exception import EC2ResponseError
 
+from cm.clouds.connections import is_throttling_error
 from cm.services import ServiceRole
 from cm.services import ServiceType
-from cm.util import instance_lifecycle, instance_states, misc, spot_states, Time
+from cm.util import instance_lifecycle, instance_states, metrics, misc, spot_states, Time
 from cm.util.decorators import TestFlag
 
 log = logging.getLogger('cloudman')
@@ -41,6 +42,7 @@ class Instance(object):
         # Machine state as obtained from the cloud middleware (see
         # instance_states Bunch)
         self.m_state = m_state
+        self.time_created = Time.now()
         self.last_m_state_change = Time.now()
         # A time stamp when the most recent update of the instance state
         # (m_state) took place
@@ -154,6 +156,20 @@ class Instance(object):
                 "Cannot get cloud instance object without an instance ID?")
         return self.inst
 
+    def get_launch_time(self):
+        """
+        Return the time (in UTC) the instance was launched, as reported by the
+        cloud middleware, or the time this object was created if the launch
+        time is not known (e.g., for an unfilled spot request).
+        """
+        launch_time = getattr(self.inst, 'launch_time', None)
+        if launch_time:
+            try:
+                return dt.datetime.strptime(launch_time[:19], "%Y-%m-%dT%H:%M:%S")
+            except (TypeError, ValueError):
+                pass
+        return self.time_created
+
     def is_spot(self):
         """ Test is this Instance is a Spot instance.
 
@@ -309,6 +325,7 @@ class Instance(object):
         try:
             if self in self.app.manager.worker_instances:
                 self.app.manager.worker_instances.remove(self)
+                metrics.node_metrics.remove(self.id)
                 log.info(
                     "Instance '%s' removed from the internal instance list." % self.id)
                 # If this was the last worker removed, add master back as execution host.
@@ -343,7 +360,8 @@ class Instance(object):
             except EC2ResponseError, e:
                 log.debug("Error updating instance {0} state: {1}".format(
                     self.get_id(), e))
-                self.m_state = instance_states.ERROR
+                if not is_throttling_error(e):
+                    self.m_state = instance_states.ERROR
         else:
             if not self.is_spot() or self.spot_was_filled():
                 log.debug("Instance object {0} not found during m_state update; "
@@ -644,6 +662,8 @@ class Instance(object):
                     self.worker_status = msplit[8]
                     self.nfs_tfs = msplit[9]
                     self.slurmd_running = msplit[10]
+                    if len(msplit) > 11:
+                        metrics.node_metrics.add(self.id, metrics.decode(msplit[11]))
                 else:
                     log.debug("Worker {0} in state Stopping so not updating status"
                               .format(self.get_desc()))
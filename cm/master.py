@@ -1,6 +1,7 @@
 """Galaxy CM master manager"""
 import commands
 import datetime as dt
+import functools
 import logging
 import logging.config
 import os
@@ -15,9 +16,12 @@ from cm.instance import Instance
 from cm.services import ServiceRole
 from cm.services import ServiceType
 from cm.services import service_states
+from cm.services.apps.pgbouncer import pooler_enabled
 from cm.services.registry import ServiceRegistry
 from cm.services.data.filesystem import Filesystem
-from cm.util import cluster_status, comm, misc, Time
+from cm.services.data.volume_monitor import VolumeStatusMonitor
+from cm.util import cluster_status, comm, instrumentation, metrics, misc, string_as_bool, Time
+from cm.util.bulk import BulkObjectOperations, run_concurrently
 from cm.util.decorators import TestFlag, cluster_ready
 from cm.util.manager import BaseConsoleManager
 import cm.util.paths as paths
@@ -68,6 +72,8 @@ class ConsoleManager(BaseConsoleManager):
         self.initial_cluster_type = None
         self.cluster_storage_type = None
         self.service_registry = ServiceRegistry(self.app)
+        # Refreshes the status of all the cluster volumes in batches
+        self.volume_monitor = VolumeStatusMonitor(self.app)
         self.services = []
         self.default_galaxy_data_size = 0
 
@@ -108,11 +114,18 @@ class ConsoleManager(BaseConsoleManager):
             ok = self.service_registry.register(new_service)
         if ok:
             # Activate the service
-            service = self.service_registry.services.get(new_service.name, None)
+            service = self.service_registry.get(new_service.name)
             if service:
                 log.debug("Activating service {0}".format(new_service.name))
                 service.activated = True
                 self._update_dependencies(new_service, "ADD")
+                # Galaxy connects to its database through the connection
+                # pooler (when enabled) so run it wherever Postgres runs,
+                # including clusters restored from persistent data
+                if ServiceRole.GALAXY_POSTGRES in service.svc_roles and \
+                   pooler_enabled(self.app) and \
+                   not self.service_registry.is_active('PgBouncer'):
+                    self.activate_master_service(self.service_registry.get('PgBouncer'))
             else:
                 log.debug("Could not find service {0} to activate?!".format(
                           new_service.name))
@@ -206,6 +219,8 @@ class ConsoleManager(BaseConsoleManager):
         als = []
         if self.initial_cluster_type == 'Galaxy':
             als = ['Postgres', 'ProFTPd', 'Galaxy', 'GalaxyReports', 'NodeJSProxy']
+            if pooler_enabled(self.app):
+                als.insert(1, 'PgBouncer')
         log.debug("Activating app-level services: {0}".format(als))
         for svc_name in als:
             svc = self.service_registry.get(svc_name)
@@ -648,15 +663,14 @@ class ConsoleManager(BaseConsoleManager):
         Lastly, if svc_role is ``None``, but a ``svc_type`` is specified, returns
         all services matching type.
         """
-        svcs = []
-        for service_name, service in self.service_registry.iteritems():
-            if service_name == svc_name:
-                return [service]
-            elif svc_role in service.svc_roles:
-                svcs.append(service)
-            elif service.svc_type == svc_type and svc_role is None:
-                svcs.append(service)
-        return svcs
+        service = self.service_registry.get(svc_name) if svc_name else None
+        if service:
+            return [service]
+        elif svc_role is not None:
+            return self.service_registry.get_by_role(svc_role)
+        elif svc_type is not None:
+            return self.service_registry.get_by_type(svc_type)
+        return []
 
     def get_srvc_status(self, srvc):
         """
@@ -764,6 +778,9 @@ class ConsoleManager(BaseConsoleManager):
         status_dict = {}
         for srvc in self.service_registry.itervalues():
             status_dict[srvc.name] = srvc.state  # NGTODO: Needs special handling for file systems
+        # Services not loaded yet (see `ServiceRegistry.get`) have not been started
+        for name in self.service_registry.names():
+            status_dict.setdefault(name, service_states.UNSTARTED)
         return status_dict
 
     def get_galaxy_rev(self):
@@ -1449,7 +1466,8 @@ class ConsoleManager(BaseConsoleManager):
             # Add a file system for user's data
             if self.app.use_volumes:
                 _add_data_fs()
-            # Add PostgreSQL service
+            # Add PostgreSQL service (and the connection pooler for Galaxy's
+            # database along with it)
             self.activate_master_service(self.service_registry.get('Postgres'))
             # Add ProFTPd service
             self.activate_master_service(self.service_registry.get('ProFTPd'))
@@ -1613,17 +1631,19 @@ class ConsoleManager(BaseConsoleManager):
         # TODO: recover services if the process fails midway
         log.info("Setting up the cluster for sharing")
         self.cluster_manipulation_in_progress = True
-        self._stop_app_level_services()
-
         # Initiate snapshot of the galaxyData file system
         snap_ids = []
+        snap_desc = ("CloudMan share-a-cluster %s; %s"
+                     % (self.app.config['cluster_name'], self.app.config['bucket_cluster']))
         svcs = self.get_services(svc_type=ServiceType.FILE_SYSTEM)
         for svc in svcs:
             if ServiceRole.GALAXY_DATA in svc.svc_roles:
-                snap_ids = svc.create_snapshot(snap_description="CloudMan share-a-cluster %s; %s"
-                                               % (self.app.config['cluster_name'],
-                                                  self.app.config['bucket_cluster']))
-        self._start_app_level_services()
+                # The snapshots must have completed before they can be shared
+                snap_ids = self._online_snapshot(svc, snap_desc, wait=True)
+                if snap_ids is None:
+                    self._stop_app_level_services()
+                    snap_ids = svc.create_snapshot(snap_description=snap_desc)
+                    self._start_app_level_services()
         # Create a new folder-like structure inside cluster's bucket and copy
         # the cluster configuration files
         s3_conn = self.app.cloud_interface.get_s3_connection()
@@ -1674,14 +1694,11 @@ class ConsoleManager(BaseConsoleManager):
                       % (self.app.config['bucket_cluster'], e))
             return False
         # Copy current cluster's configuration files into the shared folder
+        bucket_ops = BulkObjectOperations(self.app.cloud_interface.get_s3_connection,
+                                          self.app.config['bucket_cluster'])
         for conf_file in conf_files:
             if 'clusterName' not in conf_file:  # Skip original cluster name file
-                misc.copy_file_in_bucket(s3_conn,
-                                         self.app.config['bucket_cluster'],
-                                         self.app.config['bucket_cluster'],
-                                         conf_file, os.path.join(
-                                             shared_names_root, conf_file),
-                                         preserve_acl=False)
+                bucket_ops.copy(conf_file, os.path.join(shared_names_root, conf_file))
                 copied_key_names.append(
                     os.path.join(shared_names_root, conf_file))
         # Save the list of files contained in the shared bucket so derivative
@@ -1691,23 +1708,22 @@ class ConsoleManager(BaseConsoleManager):
         misc.save_file_to_bucket(s3_conn, self.app.config['bucket_cluster'], os.path.join(shared_names_root, fl), fl)
         copied_key_names.append(os.path.join(shared_names_root, fl))  # Add it to the list so it's permissions get set
         # Adjust permissions on the new keys and the created snapshots
-        ec2_conn = self.app.cloud_interface.get_ec2_connection()
-        for snap_id in snap_ids:
-            try:
-                if user_ids:
-                    log.debug(
-                        "Adding createVolumePermission for snap '%s' for users '%s'" % (snap_id, user_ids))
-                    ec2_conn.modify_snapshot_attribute(
-                        snap_id, attribute='createVolumePermission',
-                        operation='add', user_ids=user_ids)
-                else:
-                    ec2_conn.modify_snapshot_attribute(
-                        snap_id, attribute='createVolumePermission',
-                        operation='add', groups=['all'])
-            except EC2ResponseError, e:
-                log.error(
-                    "Error modifying snapshot '%s' attribute: %s" % (snap_id, e))
-        err = False
+        if user_ids:
+            log.debug("Adding createVolumePermission for snaps '%s' for users '%s'"
+                      % (snap_ids, user_ids))
+            permission = {'user_ids': user_ids}
+        else:
+            permission = {'groups': ['all']}
+
+        def _share_snapshot(snap_id):
+            # Connections are per thread so get one in the worker thread
+            ec2_conn = self.app.cloud_interface.get_ec2_connection()
+            ec2_conn.modify_snapshot_attribute(
+                snap_id, attribute='createVolumePermission', operation='add',
+                **permission)
+        snap_tasks = [("Modifying snapshot '%s' attribute" % snap_id,
+                       functools.partial(_share_snapshot, snap_id)) for snap_id in snap_ids]
+        snap_failed = run_concurrently(snap_tasks)
         if canonical_ids:
             # In order to list the keys associated with a shared instance, a user
             # must be given READ permissions on the cluster's bucket as a whole.
@@ -1717,10 +1733,7 @@ class ConsoleManager(BaseConsoleManager):
             # Grant READ permissions for the keys required to bootstrap the
             # shared instance
             for k_name in copied_key_names:
-                if not misc.add_key_user_grant(s3_conn, self.app.config['bucket_cluster'],
-                                               k_name, 'READ', canonical_ids):
-                    log.error("Error adding READ permission for key '%s'" % k_name)
-                    err = True
+                bucket_ops.grant(k_name, 'READ', canonical_ids)
         else:  # If no canonical_ids are provided, means to set the permissions to public-read
             # See above, but in order to access keys, the bucket root must be given read permissions
             # FIXME: this method sets the bucket's grant to public-read and
@@ -1728,13 +1741,15 @@ class ConsoleManager(BaseConsoleManager):
             # depends on down the line if the publicly shared instance is deleted
             # misc.make_bucket_public(s3_conn, self.app.config['bucket_cluster'])
             for k_name in copied_key_names:
-                if not misc.make_key_public(s3_conn, self.app.config['bucket_cluster'], k_name):
-                    log.error("Error making key '%s' public" % k_name)
-                    err = True
-        if err:
+                bucket_ops.make_public(k_name)
+        result = bucket_ops.run()
+        if result.failed or snap_failed:
             # TODO: Handle this with more user input?
-            log.error("Error modifying permissions for keys in bucket '%s'" %
-                      self.app.config['bucket_cluster'])
+            log.error("Error sharing the cluster: %s of %s bucket '%s' operations "
+                      "and %s of %s snapshot permission changes failed"
+                      % (len(result.failed), len(result.failed) + result.succeeded,
+                         self.app.config['bucket_cluster'], len(snap_failed),
+                         len(snap_tasks)))
 
         self.cluster_manipulation_in_progress = False
         return True
@@ -1839,15 +1854,43 @@ class ConsoleManager(BaseConsoleManager):
             ok = False
         return ok
 
+    def _online_snapshot(self, fs_service, snap_description, wait=False):
+        """
+        Snapshot file system ``fs_service`` without stopping the
+        application-level services (see ``Filesystem.create_online_snapshot``),
+        having Postgres write a checkpoint first if its data lives on the file
+        system. Online snapshots can be disabled by setting the
+        ``online_snapshots`` user data option to ``False``.
+
+        Return the list of created snapshot IDs or ``None`` if the file
+        system needs to be snapshotted offline.
+        """
+        if not (string_as_bool(self.app.config.get('online_snapshots', True)) and
+                fs_service.supports_online_snapshot()):
+            return None
+        quiesce = None
+        pgs = self.service_registry.get(ServiceRole.to_string(ServiceRole.GALAXY_POSTGRES))
+        if pgs and pgs.state == service_states.RUNNING and \
+                self.app.path_resolver.psql_dir.startswith(
+                    os.path.join(fs_service.mount_point, '')):
+            quiesce = pgs.checkpoint
+        log.info("Creating an online snapshot of file system '%s'" % fs_service.name)
+        return fs_service.create_online_snapshot(snap_description, quiesce=quiesce,
+                                                 wait=wait)
+
     @TestFlag(['snap-snapFS'])
     def snapshot_file_system(self, file_system_name):
         """
         Create a snapshot of the volume(s) used for the `file_system_name`.
         Note that this method applies only to volume-backed file systems.
 
-        The method will automatically stop any application-level services,
-        create a snapshot of the volume(s) and, after the snapshot(s) have
-        been created, start the application-level services. These are the steps:
+        If the file system supports it, the snapshot is taken online: the file
+        system is frozen only while the snapshot is initiated and the method
+        returns without waiting for the snapshot to complete (see
+        ``_online_snapshot``). Otherwise, the method will automatically stop
+        any application-level services, create a snapshot of the volume(s) and,
+        after the snapshot(s) have been created, start the application-level
+        services. These are the steps:
             1. Suspend all application-level services
             2. Unmount and detach the volume associated with the file system
             3. Create a snapshot of the volume
@@ -1855,8 +1898,6 @@ class ConsoleManager(BaseConsoleManager):
             5. Unsuspend services
         """
         log.info("Initiating file system '%s' snapshot." % file_system_name)
-        self.cluster_manipulation_in_progress = True
-        self._stop_app_level_services()
         snap_ids = []
         fs_service = self.service_registry.get(file_system_name)
         if fs_service:
@@ -1864,6 +1905,13 @@ class ConsoleManager(BaseConsoleManager):
             snap_desc = ("Created by CloudMan ({0}; {1}) from file system '{2}'"
                          .format(self.app.config['cluster_name'],
                                  self.app.config['bucket_cluster'], file_system_name))
+            snap_ids = self._online_snapshot(fs_service, snap_desc)
+            if snap_ids is not None:
+                log.info("File system {0} snapshot(s) initiated: {1}"
+                         .format(file_system_name, snap_ids))
+                return snap_ids
+            self.cluster_manipulation_in_progress = True
+            self._stop_app_level_services()
             snap_ids = fs_service.create_snapshot(snap_description=snap_desc)
             # Start things back up
             self._start_app_level_services()
@@ -2262,6 +2310,7 @@ class ConsoleMonitor(object):
         self.last_system_change_time = Time.now()
         self.update_frequency = 10  # Frequency (in seconds) between system updates
         self.num_workers = -1
+        self.node_sampler = metrics.NodeSampler()
         # Start the monitor thread
         self.monitor_thread = threading.Thread(target=self.__monitor)
 
@@ -2479,29 +2528,39 @@ class ConsoleMonitor(object):
             misc.save_file_to_bucket(s3_conn, self.app.config['bucket_cluster'],
                                      "%s.clusterName" % self.app.config['cluster_name'], cn_file)
 
+    def _add_service(self, service, results):
+        log.debug("Monitor adding service '%s'" % service.get_full_name())
+        self.last_system_change_time = Time.now()
+        if service.add():
+            log.debug("Monitor done adding service {0} (setting config_changed)"
+                      .format(service.get_full_name()))
+            results.append(service)
+
     def _start_services(self):
         config_changed = False  # Flag to indicate if cluster conf was changed
         # Check and add any new services
-        for service in self.app.manager.service_registry.active():
-            if service.state == service_states.UNSTARTED or \
-               service.state == service_states.SHUT_DOWN and \
-               service.state != service_states.STARTING:
-                log.debug("Monitor adding service '%s'" % service.get_full_name())
-                self.last_system_change_time = Time.now()
-                if service.add():
-                    log.debug("Monitor done adding service {0} (setting config_changed)"
-                              .format(service.get_full_name()))
-                    config_changed = True
-            # log.debug("Monitor DIDN'T add service {0}? Service state: {1}"\
-            # .format(service.get_full_name(), service.state))
-            # Store cluster conf after all services have been added.
-            # NOTE: this flag relies on the assumption service additions are
-            # sequential (i.e., monitor waits for the service add call to complete).
-            # If any of the services are to be added via separate threads, a
-            # system-wide flag should probably be maintained for that particular
-            # service that would indicate the configuration of the service is
-            # complete. This could probably be done by monitoring
-            # the service state flag that is already maintained?
+        to_add = [service for service in self.app.manager.service_registry.active()
+                  if service.state == service_states.UNSTARTED or
+                  service.state == service_states.SHUT_DOWN and
+                  service.state != service_states.STARTING]
+        added = []
+        # Storage bring-up stage: file systems are independent of each other
+        # so add them all concurrently, and wait for them before moving on
+        fs_threads = [threading.Thread(target=self._add_service, args=(service, added))
+                      for service in to_add if service.svc_type == ServiceType.FILE_SYSTEM]
+        for t in fs_threads:
+            t.start()
+        for t in fs_threads:
+            t.join()
+        for service in to_add:
+            if service.svc_type != ServiceType.FILE_SYSTEM:
+                self._add_service(service, added)
+        # Store cluster conf after all services have been added.
+        # NOTE: this flag relies on the assumption the monitor waits for all
+        # the service add calls to complete (file systems are added in
+        # separate threads but those are joined above).
+        if added:
+            config_changed = True
         svcs = self.app.manager.get_services(svc_type=ServiceType.FILE_SYSTEM)
         for svc in svcs:
             if ServiceRole.GALAXY_DATA in svc.svc_roles and svc.grow is not None:
@@ -2594,8 +2653,12 @@ class ConsoleMonitor(object):
             self._update_frequency()
             if (Time.now() - self.last_update_time).seconds > self.update_frequency:
                 self.last_update_time = Time.now()
+                metrics.node_metrics.add('master', self.node_sampler.read())
                 for service in self.app.manager.service_registry.active():
+                    start = time.time()
                     service.status()
+                    instrumentation.record_monitor_step(
+                        "status.{0}".format(service.get_full_name()), time.time() - start)
                 # Indicate migration is in progress
                 migration_service = self.app.manager.get_services(svc_role=ServiceRole.MIGRATION)
                 if migration_service:
@@ -59,6 +59,7 @@ class ServiceRole(object):
     CLOUDGENE = {'type': ServiceType.APPLICATION, 'name': "Cloudgene Service"}
     NODEJSPROXY = {'type': ServiceType.APPLICATION, 'name': "NodeJS Proxy Service"}
     SUPERVISOR = {'type': ServiceType.APPLICATION, 'name': "Supervisor Service"}
+    PGBOUNCER = {'type': ServiceType.APPLICATION, 'name': "PgBouncer Service"}
 
     @staticmethod
     def get_type(role):
@@ -94,58 +95,11 @@ class ServiceRole(object):
 
     @staticmethod
     def _role_from_string(val):
-        if val == "SGE":
-            return ServiceRole.SGE
-        elif val == "SLURMCTLD":
-            return ServiceRole.SLURMCTLD
-        elif val == "SLURMD":
-            return ServiceRole.SLURMD
-        elif val == "JOB_MANAGER":
-            return ServiceRole.JOB_MANAGER
-        elif val == "Galaxy":
-            return ServiceRole.GALAXY
-        elif val == "Postgres":
-            return ServiceRole.GALAXY_POSTGRES
-        elif val == "GalaxyReports":
-            return ServiceRole.GALAXY_REPORTS
-        elif val == "Pulsar":
-            return ServiceRole.PULSAR
-        elif val == "Autoscale":
-            return ServiceRole.AUTOSCALE
-        elif val == "PSS":
-            return ServiceRole.PSS
-        elif val == "galaxyData":
-            return ServiceRole.GALAXY_DATA
-        elif val == "galaxyIndices":
-            return ServiceRole.GALAXY_INDICES
-        elif val == "galaxyTools":
-            return ServiceRole.GALAXY_TOOLS
-        elif val == "GenericFS":
-            return ServiceRole.GENERIC_FS
-        elif val == "TransientNFS":
-            return ServiceRole.TRANSIENT_NFS
-        elif val == "Hadoop":
-            return ServiceRole.HADOOP
-        elif val == "Migration":
-            return ServiceRole.MIGRATION
-        elif val == "HTCondor":
-            return ServiceRole.HTCONDOR
-        elif val == "ProFTPd":
-            return ServiceRole.PROFTPD
-        elif val == "ClouderaManager":
-            return ServiceRole.CLOUDERA_MANAGER
-        elif val == "Nginx":
-            return ServiceRole.NGINX
-        elif val == "Cloudgene":
-            return ServiceRole.CLOUDGENE
-        elif val == "NodeJSProxy":
-            return ServiceRole.NODEJSPROXY
-        elif val == "Supervisor":
-            return ServiceRole.SUPERVISOR
-        else:
+        role = _STRING_TO_ROLE.get(val)
+        if role is None:
             log.warn(
                 "Attempt to convert unknown role name from string: {0}".format(val))
-            return None
+        return role
 
     @staticmethod
     def to_string(svc_roles):
@@ -163,55 +117,9 @@ class ServiceRole(object):
 
     @staticmethod
     def _role_to_string(svc_role):
-        if svc_role == ServiceRole.SGE:
-            return "SGE"
-        elif svc_role == ServiceRole.SLURMCTLD:
-            return "Slurmctld"
-        elif svc_role == ServiceRole.SLURMD:
-            return "Slurmd"
-        elif svc_role == ServiceRole.JOB_MANAGER:
-            return "Job manager"
-        elif svc_role == ServiceRole.GALAXY:
-            return "Galaxy"
-        elif svc_role == ServiceRole.GALAXY_POSTGRES:
-            return "Postgres"
-        elif svc_role == ServiceRole.GALAXY_REPORTS:
-            return "GalaxyReports"
-        elif svc_role == ServiceRole.PULSAR:
-            return "Pulsar"
-        elif svc_role == ServiceRole.AUTOSCALE:
-            return "Autoscale"
-        elif svc_role == ServiceRole.PSS:
-            return "PSS"
-        elif svc_role == ServiceRole.GALAXY_DATA:
-            return "galaxyData"
-        elif svc_role == ServiceRole.GALAXY_INDICES:
-            return "galaxyIndices"
-        elif svc_role == ServiceRole.GALAXY_TOOLS:
-            return "galaxyTools"
-        elif svc_role == ServiceRole.GENERIC_FS:
-            return "GenericFS"
-        elif svc_role == ServiceRole.TRANSIENT_NFS:
-            return "TransientNFS"
-        elif svc_role == ServiceRole.HTCONDOR:
-            return "HTCondor"
-        elif svc_role == ServiceRole.HADOOP:
-            return "Hadoop"
-        elif svc_role == ServiceRole.MIGRATION:
-            return "Migration"
-        elif svc_role == ServiceRole.PROFTPD:
-            return "ProFTPd"
-        elif svc_role == ServiceRole.CLOUDERA_MANAGER:
-            return "ClouderaManager"
-        elif svc_role == ServiceRole.NGINX:
-            return "Nginx"
-        elif svc_role == ServiceRole.CLOUDGENE:
-            return "Cloudgene"
-        elif svc_role == ServiceRole.NODEJSPROXY:
-            return "NodeJSProxy"
-        elif svc_role == ServiceRole.SUPERVISOR:
-            return "Supervisor"
-        else:
+        try:
+            return _ROLE_TO_STRING[svc_role['name']]
+        except (KeyError, TypeError):
             raise Exception(
                 "Unrecognized role {0}. Cannot convert to string".format(svc_role))
 
@@ -239,6 +147,42 @@ class ServiceRole(object):
         return ServiceRole.to_string(known_roles)
 
 
+# Conversion tables between roles and their string representation, as
+# (role, string the role is converted to, string the role is parsed from).
+# Note that a few roles are not parsed from the string they convert to.
+_ROLE_STRINGS = [
+    (ServiceRole.SGE, "SGE", "SGE"),
+    (ServiceRole.SLURMCTLD, "Slurmctld", "SLURMCTLD"),
+    (ServiceRole.SLURMD, "Slurmd", "SLURMD"),
+    (ServiceRole.JOB_MANAGER, "Job manager", "JOB_MANAGER"),
+    (ServiceRole.GALAXY, "Galaxy", "Galaxy"),
+    (ServiceRole.GALAXY_POSTGRES, "Postgres", "Postgres"),
+    (ServiceRole.GALAXY_REPORTS, "GalaxyReports", "GalaxyReports"),
+    (ServiceRole.PULSAR, "Pulsar", "Pulsar"),
+    (ServiceRole.AUTOSCALE, "Autoscale", "Autoscale"),
+    (ServiceRole.PSS, "PSS", "PSS"),
+    (ServiceRole.GALAXY_DATA, "galaxyData", "galaxyData"),
+    (ServiceRole.GALAXY_INDICES, "galaxyIndices", "galaxyIndices"),
+    (ServiceRole.GALAXY_TOOLS, "galaxyTools", "galaxyTools"),
+    (ServiceRole.GENERIC_FS, "GenericFS", "GenericFS"),
+    (ServiceRole.TRANSIENT_NFS, "TransientNFS", "TransientNFS"),
+    (ServiceRole.HTCONDOR, "HTCondor", "HTCondor"),
+    (ServiceRole.HADOOP, "Hadoop", "Hadoop"),
+    (ServiceRole.MIGRATION, "Migration", "Migration"),
+    (ServiceRole.PROFTPD, "ProFTPd", "ProFTPd"),
+    (ServiceRole.CLOUDERA_MANAGER, "ClouderaManager", "ClouderaManager"),
+    (ServiceRole.NGINX, "Nginx", "Nginx"),
+    (ServiceRole.CLOUDGENE, "Cloudgene", "Cloudgene"),
+    (ServiceRole.NODEJSPROXY, "NodeJSProxy", "NodeJSProxy"),
+    (ServiceRole.SUPERVISOR, "Supervisor", "Supervisor"),
+    (ServiceRole.PGBOUNCER, "PgBouncer", "PgBouncer"),
+]
+# Role name: string
+_ROLE_TO_STRING = dict([(role['name'], to_str) for role, to_str, from_str in _ROLE_STRINGS])
+# String: role
+_STRING_TO_ROLE = dict([(from_str, role) for role, to_str, from_str in _ROLE_STRINGS])
+
+
 class ServiceDependency(object):
     """
     Represents a dependency that another service required for its function.
@@ -291,7 +235,7 @@ class Service(object):
 
     def __init__(self, app, service_type=None):
         self.app = app
-        self.activated = False
+        self._activated = False
         self.state = service_states.UNSTARTED
         self.last_state_change_time = dt.datetime.utcnow()
         self.time_started = None
@@ -302,6 +246,22 @@ class Service(object):
         self.svc_roles = []
         self.dependencies = []
 
+    @property
+    def activated(self):
+        return self._activated
+
+    @activated.setter
+    def activated(self, value):
+        """
+        Set whether the service is `activated`, keeping the service registry
+        index of active services up to date.
+        """
+        self._activated = value
+        # Workers do not have service_registry field implemented yet
+        manager = getattr(self.app, 'manager', None)
+        if hasattr(manager, 'service_registry'):
+            manager.service_registry.activation_changed(self)
+
     def start(self):
         raise NotImplementedError("Subclasses of Service must implement this.")
 
@@ -326,7 +286,8 @@ class Service(object):
                 #      dependency.owning_service.name))
                 no_services_satisfy_dependency = True
                 remove_dependency = False
-                for svc in self.app.manager.service_registry.itervalues():
+                for svc in self.app.manager.service_registry.get_by_role(
+                        dependency.service_role):
                     # log.debug("Checking service %s state." % svc.name)
                     if dependency.is_satisfied_by(svc):
                         no_services_satisfy_dependency = False
@@ -6,13 +6,12 @@ import commands
 import logging
 import os
 
-from socket import AF_INET, socket, SOCK_STREAM
-
 log = logging.getLogger('cloudman')
 
 
 from cm.services import Service
 from cm.services import ServiceType
+from cm.util import health
 
 
 class ApplicationService(Service):
@@ -87,14 +86,11 @@ class ApplicationService(Service):
         else:
             return -1
 
-    def _port_bound(self, port):
+    def _port_bound(self, port, max_age=0):
         """
         Determine if any process is listening on localhost on specified port.
+        The check is done via the shared health prober, accepting a result up
+        to ``max_age`` seconds old.
         """
-        s = socket(AF_INET, SOCK_STREAM)
-        try:
-            result = s.connect_ex(('127.0.0.1', port))
-            # log.debug("Port 127.0.0.1:{0} is bound? {1}".format(port, result == 0))
-            return result == 0
-        finally:
-            s.close()
+        probe = health.prober.tcp('port-{0}'.format(port), '127.0.0.1', port)
+        return health.prober.is_up(probe, max_age=max_age)
@@ -1,15 +1,20 @@
 """Service implementation for the Galaxy application."""
 import os
-import urllib2
 import subprocess
+import threading
+import time
 from datetime import datetime
 
 from cm.services.apps import ApplicationService
 from cm.services import service_states
 from cm.services import ServiceRole
 from cm.services import ServiceDependency
+from cm.services.apps.pgbouncer import pooler_enabled
+from cm.util import galaxy_topology
+from cm.util import health
 from cm.util import paths
 from cm.util import misc
+from cm.util import reconcile
 from cm.util.decorators import TestFlag, delay
 from cm.util.galaxy_conf import galaxy_option_manager
 from cm.util.galaxy_conf import populate_process_options
@@ -43,7 +48,13 @@ class GalaxyService(ApplicationService):
             ServiceDependency(self, ServiceRole.GALAXY_TOOLS),
             ServiceDependency(self, ServiceRole.PROFTPD)
         ]
+        if pooler_enabled(app):
+            self.dependencies.append(ServiceDependency(self, ServiceRole.PGBOUNCER))
         self.option_manager = galaxy_option_manager(app)
+        # Process topology when running multiple processes (see
+        # `get_topology`)
+        self.topology = None
+        self.resize_lock = threading.Lock()
 
     @property
     def galaxy_home(self):
@@ -104,7 +115,10 @@ class GalaxyService(ApplicationService):
             # the process starts in an attempt to circumvent this problem.
             patch_run_sh_command = ("sudo sed -i -e \"s/server.log \\$\\@$/\\0; "
                                     "sleep 4/\" %s/run.sh" % self.galaxy_home)
-            misc.run(patch_run_sh_command)
+            run_sh = os.path.join(self.galaxy_home, 'run.sh')
+            reconcile.reconcile('patch:{0}'.format(run_sh),
+                                lambda: reconcile.file_fingerprint(run_sh),
+                                lambda: misc.run(patch_run_sh_command))
             self.extra_daemon_args = ""
         else:
             # Instead of sticking with default paster.pid and paster.log,
@@ -180,7 +194,48 @@ class GalaxyService(ApplicationService):
         """
         return self.app.config.multiple_processes
 
-    def galaxy_run_command(self, args):
+    @property
+    def topology_file(self):
+        return os.path.join(self.galaxy_home, 'cloudman_processes.json')
+
+    def get_topology(self):
+        """
+        Return the `galaxy_topology.GalaxyTopology` of the Galaxy processes
+        (as last configured, possibly by a previous CloudMan run), or `None`
+        if Galaxy has not been configured to run multiple processes.
+        """
+        if self.topology is None and os.path.exists(self.topology_file):
+            try:
+                with open(self.topology_file) as f:
+                    self.topology = galaxy_topology.GalaxyTopology.loads(f.read())
+            except (IOError, ValueError, KeyError), e:
+                log.error("Error loading Galaxy process topology: {0}".format(e))
+        return self.topology
+
+    def _set_topology(self, topology):
+        """
+        Configure Galaxy's processes for `topology` and record it.
+        """
+        previous = self.get_topology()
+        removed = []
+        if previous:
+            removed = [p for p in previous.processes if p.name not in topology.names()]
+        populate_process_options(self.option_manager, topology, removed)
+        self.topology = topology
+        try:
+            with open(self.topology_file, 'w') as f:
+                f.write(topology.dumps())
+        except IOError, e:
+            log.error("Error saving Galaxy process topology: {0}".format(e))
+        log.debug("Galaxy process topology: {0}".format(topology))
+
+    def main_port(self):
+        topology = self.get_topology()
+        if self.multiple_processes() and topology:
+            return topology.get('main').port
+        return galaxy_topology.WEB_BASE_PORT
+
+    def galaxy_run_command(self, args, env_vars=None):
         """
         Compose the command used to manage Galaxy process.
 
@@ -190,9 +245,14 @@ class GalaxyService(ApplicationService):
         :type args: string
         :param args: Arguments to feed to Galaxy's run command, for example:
                      `--daemon` or `--stop-daemon`.
+
+        :type env_vars: dict
+        :param env_vars: Environment variables to set instead of `env_vars`.
         """
+        if env_vars is None:
+            env_vars = self.env_vars
         env_exports = "; ".join(["export %s='%s'" % (
-            key, value) for key, value in self.env_vars.iteritems()])
+            key, value) for key, value in env_vars.iteritems()])
         venv = "source $GALAXY_HOME/.venv/bin/activate"
         run_command = '%s - galaxy -c "%s; %s; sh $GALAXY_HOME/run.sh %s"' % (
             paths.P_SU, env_exports, venv, args)
@@ -202,7 +262,7 @@ class GalaxyService(ApplicationService):
     def status(self):
         """Set the status of the service based on the state of the app process."""
         old_state = self.state
-        if self._is_galaxy_running():
+        if self._is_galaxy_running(max_age=health.STATUS_MAX_AGE):
             self.state = service_states.RUNNING
         elif (self.state == service_states.SHUTTING_DOWN or
               self.state == service_states.SHUT_DOWN or
@@ -248,18 +308,15 @@ class GalaxyService(ApplicationService):
             # Force cluster configuration state update on status change
             self.app.manager.console_monitor.store_cluster_config()
 
-    def _is_galaxy_running(self):
-        """Check is Galaxy process is running and the UI is accessible."""
+    def _is_galaxy_running(self, max_age=0):
+        """
+        Check is Galaxy process is running and the UI is accessible. The UI is
+        checked with a ``HEAD`` request by the shared health prober, accepting
+        a result up to ``max_age`` seconds old.
+        """
         if self._check_daemon('galaxy'):
-            dns = "http://127.0.0.1:8080"
-            running_error_codes = [403]  # Error codes under which Galaxy runs
-            try:
-                urllib2.urlopen(dns)
-                return True
-            except urllib2.HTTPError, e:
-                return e.code in running_error_codes
-            except:
-                return False
+            probe = health.prober.http('galaxy', 'http://127.0.0.1:{0}/'.format(self.main_port()))
+            return health.prober.is_up(probe, max_age=max_age)
         else:
             log.debug("Galaxy UI does not seem to be accessible.")
             return False
@@ -270,14 +327,92 @@ class GalaxyService(ApplicationService):
 
         Optionally set Galaxy to use multiple processes, then populate dynamic
         options (i.e., arbitrary options coming from user data), adjust system
-        paths and set admin users.
+        paths (and the database connection) and set admin users.
         """
         if self.multiple_processes():
-            populate_process_options(self.option_manager)
+            # Processes that already exist keep their ports (Nginx and any
+            # process left running by a previous start use them)
+            self._set_topology(galaxy_topology.plan(
+                *galaxy_topology.process_counts(self.app), previous=self.get_topology()))
         populate_dynamic_options(self.option_manager)
-        populate_galaxy_paths(self.option_manager)
+        # Connect via the connection pooler if it is in use
+        pooler = self.app.manager.service_registry.get_active(
+            ServiceRole.to_string(ServiceRole.PGBOUNCER))
+        populate_galaxy_paths(self.option_manager,
+                              database_port=pooler.port if pooler else None)
         populate_admin_users(self.option_manager)
 
+    def _process_command(self, process, args):
+        env_vars = dict([(k, v) for k, v in self.env_vars.iteritems() if k != "GALAXY_RUN_ALL"])
+        return self.galaxy_run_command(
+            "--server-name={0} --pid-file={0}.pid --log-file={0}.log {1}".format(process.name, args),
+            env_vars=env_vars)
+
+    def _wait_for_process(self, process, timeout=300):
+        """
+        Wait for the Galaxy `process` to accept connections on its port.
+        """
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._port_bound(process.port):
+                return True
+            time.sleep(2)
+        log.error("Galaxy process {0} did not start listening on port {1} within {2} seconds"
+                  .format(process.name, process.port, timeout))
+        return False
+
+    def _restart_process(self, process):
+        misc.run(self._process_command(process, "--stop-daemon"))
+        return misc.run(self._process_command(process, "--daemon")) and \
+            self._wait_for_process(process)
+
+    def resize(self, num_web=None, num_handlers=None):
+        """
+        Change the number of web and job handler processes of a running
+        Galaxy without stopping it: new processes are started and, once they
+        are accepting connections, added to Nginx's upstream servers before
+        the processes no longer needed are taken out of Nginx and stopped. If
+        the job handlers change, the remaining processes are then restarted
+        one at a time so they pick up the new configuration. The new process
+        counts are kept (as the ``web_thread_count`` and
+        ``handler_thread_count`` options) for when Galaxy is restarted.
+
+        :rtype: bool
+        :return: ``True`` if all the processes were started successfully.
+        """
+        current = self.get_topology()
+        if not (self.multiple_processes() and current and self.state == service_states.RUNNING):
+            log.warning("Galaxy is not running multiple processes; not resizing it.")
+            return False
+        with self.resize_lock:
+            topology = galaxy_topology.plan(num_web or len(current.web),
+                                            num_handlers or len(current.handlers),
+                                            previous=current)
+            added = [p for p in topology.processes if p.name not in current.names()]
+            removed = [p for p in current.processes if p.name not in topology.names()]
+            handlers_changed = ([h.name for h in topology.handlers] !=
+                                [h.name for h in current.handlers])
+            log.info("Resizing Galaxy from {0} to {1}".format(current, topology))
+            self.app.config['web_thread_count'] = len(topology.web)
+            self.app.config['handler_thread_count'] = len(topology.handlers)
+            self._set_topology(topology)
+            ok = True
+            for process in added:
+                if not (misc.run(self._process_command(process, "--daemon")) and
+                        self._wait_for_process(process)):
+                    ok = False
+            nginx_svc = self.app.manager.service_registry.get_active('Nginx')
+            if nginx_svc:
+                nginx_svc.reconfigure(setup_ssl=nginx_svc.ssl_is_on)
+            for process in removed:
+                misc.run(self._process_command(process, "--stop-daemon"))
+            if handlers_changed:
+                for process in topology.processes:
+                    if process not in added:
+                        ok = self._restart_process(process) and ok
+            log.info("Done resizing Galaxy to {0}".format(topology))
+            return ok
+
     def add_galaxy_admin_users(self, admins_list=[]):
         """
         Add email addresses provided as Galaxy admin users.
@@ -4,6 +4,7 @@ import subprocess
 
 from cm.services.apps import ApplicationService
 
+from cm.util import health
 from cm.util import paths
 from cm.util import misc
 from cm.services import service_states
@@ -34,8 +35,8 @@ class GalaxyReportsService(ApplicationService):
     def __repr__(self):
         return "Galaxy Reports service on port {0}".format(DEFAULT_REPORTS_PORT)
 
-    def _check_galaxy_reports_running(self):
-        return self._port_bound(self.reports_port)
+    def _check_galaxy_reports_running(self, max_age=0):
+        return self._port_bound(self.reports_port, max_age=max_age)
 
     def start(self):
         self.state = service_states.STARTING
@@ -108,12 +109,13 @@ class GalaxyReportsService(ApplicationService):
             paths.P_SU, self.conf_dir, args)
         return misc.run(command)
 
-    def _running(self):
+    def _running(self, max_age=0):
         """
         Check if the app is running and return `True` if so; `False` otherwise.
+        A port check result up to ``max_age`` seconds old is accepted.
         """
         if self._check_daemon('galaxyreports'):
-            if self._check_galaxy_reports_running():
+            if self._check_galaxy_reports_running(max_age=max_age):
                 return True
         return False
 
@@ -123,7 +125,7 @@ class GalaxyReportsService(ApplicationService):
            self.state == service_states.UNSTARTED or \
            self.state == service_states.WAITING_FOR_USER_ACTION:
             pass
-        elif self._running():
+        elif self._running(max_age=health.STATUS_MAX_AGE):
             self.state = service_states.RUNNING
         elif self.state != service_states.STARTING:
             log.error("Galaxy reports error; Galaxy reports not runnnig")
@@ -74,6 +74,30 @@ class BaseJobManager(ApplicationService):
         """
         raise NotImplementedError("disable_node method not implemented")
 
+    def drain_node(self, alias, address):
+        """
+            Stop scheduling new jobs on the node identified by ``alias`` and/or
+            ``address`` while letting the jobs already running on it finish.
+            Unless overridden, this is the same as ``disable_node``.
+
+            :rtype: bool
+            :return: ``True`` if the node was successfully put into the
+                     draining state; ``False`` otherwise.
+        """
+        return self.disable_node(alias, address)
+
+    def undrain_node(self, alias, address):
+        """
+            Undo ``drain_node``, allowing new jobs to be scheduled on the node
+            identified by ``alias`` and/or ``address``. Unless overridden, this
+            is the same as ``enable_node``.
+
+            :rtype: bool
+            :return: ``True`` if the node was successfully enabled for running
+                     jobs; ``False`` otherwise.
+        """
+        return self.enable_node(alias, address)
+
     def idle_nodes(self):
         """
             Return a list of nodes that are currently not executing any jobs.
@@ -113,6 +137,9 @@ class BaseJobManager(ApplicationService):
                      dict is to have at least the following keys:
                      ``job_state``, ``time_job_entered_state``. Valid
                      ``job_state`` values include: ``running``, ``pending``,
-                     ``queued``, ``error``.
+                     ``queued``, ``error``. If known, the number of slots
+                     (i.e., CPUs) used or requested by a job should be
+                     provided as ``job_slots`` (the autoscaler assumes 1
+                     otherwise).
         """
         raise NotImplementedError("jobs method not implemented")
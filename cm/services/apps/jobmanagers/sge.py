@@ -600,6 +600,29 @@ class SGEService(BaseJobManager):
         log.debug("Disabling node {0} from running jobs.".format(alias))
         return self._remove_instance_from_exec_list(alias, address)
 
+    def drain_node(self, alias, address, queue_name='all.q'):
+        """
+        Disable the ``queue_name`` queue instance on the node named ``alias``
+        with ``address`` as it's private IP or local hostname so no new jobs
+        get scheduled on it while the running jobs finish.
+        """
+        log.debug("Draining node {0} ({1})".format(alias, address))
+        return misc.run('export SGE_ROOT={0}; . $SGE_ROOT/default/common/settings.sh; '
+                        '{1}/bin/lx24-amd64/qmod -d {2}@{3}'
+                        .format(self.app.path_resolver.sge_root,
+                                self.app.path_resolver.sge_root, queue_name, address))
+
+    def undrain_node(self, alias, address, queue_name='all.q'):
+        """
+        Re-enable the ``queue_name`` queue instance on the node named ``alias``
+        with ``address`` as it's private IP or local hostname.
+        """
+        log.debug("Undraining node {0} ({1})".format(alias, address))
+        return misc.run('export SGE_ROOT={0}; . $SGE_ROOT/default/common/settings.sh; '
+                        '{1}/bin/lx24-amd64/qmod -e {2}@{3}'
+                        .format(self.app.path_resolver.sge_root,
+                                self.app.path_resolver.sge_root, queue_name, address))
+
     def idle_nodes(self):
         """
         Return a list of nodes that are currently not executing any jobs. Each
@@ -241,10 +241,11 @@ class SlurmctldService(BaseJobManager):
         (eg, ``['master', 'w1', 'w2']``).
         """
         # Get a listing of idle nodes as reported by Slurm's sinfo command. The
-        # format of the returned string is as follows: 'master,w1,w2'
+        # format of the returned string is as follows: 'master,w1,w2'. Note
+        # that nodes that have been drained (vs. are still draining) are idle.
         idle_nodes = []
         try:
-            idle_nodes = commands.getoutput("sinfo -o '%T %n' -h | grep -E 'idle|down' | awk '{ print $NF }' "
+            idle_nodes = commands.getoutput("sinfo -o '%T %n' -h | grep -E 'idle|down|drained' | awk '{ print $NF }' "
                                             "| tr '\n' ',' | sed '$ s/,$//'").split(",")
         except Exception, e:
             log.error("Trouble getting idle nodes from Slurm: {0}".format(e))
@@ -13,23 +13,32 @@ class SlurmInfo(object):
     def jobs(self):
         """
             A list of jobs with info about each. Each list entry is a
-            dict with the following keys: ``time_job_entered_state`` and
-            ``job_state`` keys. Valid ``job_state`` values include: ``running``,
-             ``pending``.
+            dict with the following keys: ``time_job_entered_state``,
+            ``job_state`` and ``job_slots`` keys. Valid ``job_state`` values
+            include: ``running``, ``pending``.
         """
         jobs = []
-        # For now we're only filtering jobs in pending or running state
-        cmd = "squeue -h -o'%T %S' --states=PENDING,RUNNING"
+        # For now we're only filtering jobs in pending or running state. Running
+        # jobs entered their state at start time and pending ones at submit time.
+        cmd = "squeue -h -o'%T %S %V %C' --states=PENDING,RUNNING"
         squeue_out = commands.getoutput(cmd)
         if squeue_out:
             squeue_out = squeue_out.split('\n')
             for job in squeue_out:
-                job_state = job.split()[0].lower()
-                if job.split()[1] == 'N/A':
+                fields = job.split()
+                if len(fields) < 4:
+                    continue
+                job_state = fields[0].lower()
+                entered = fields[1] if job_state == 'running' else fields[2]
+                if entered == 'N/A':
                     continue  # The job is still being scheduled
-                time_job_entered_state = datetime.strptime(job.split()[1],
+                time_job_entered_state = datetime.strptime(entered,
                                                            "%Y-%m-%dT%H:%M:%S")
+                try:
+                    job_slots = int(fields[3])
+                except ValueError:
+                    job_slots = 1
                 job_info = {'job_state': job_state, 'time_job_entered_state':
-                            time_job_entered_state}
+                            time_job_entered_state, 'job_slots': job_slots}
                 jobs.append(job_info)
         return jobs
@@ -1,15 +1,23 @@
-import fnmatch
 import grp
 import logging
 import os
 import pwd
+import shutil
 
 from cm.services import ServiceDependency, ServiceRole, ServiceType, service_states
 from cm.services.apps import ApplicationService
 from cm.util import misc, paths
+from cm.util.treecopy import TreeCopy
 
 log = logging.getLogger('cloudman')
 
+# Number of parts of a directory tree copied at the same time
+COPY_WORKERS = 4
+# Trees copied from the tools file system to the data file system (as source,
+# target directory names)
+TOOLS_TREE = ('tools', 'tools')
+GALAXY_TREE = ('galaxy-central', 'galaxy-app')
+
 
 class Migrate1to2:
     """Functionality for upgrading from version 1 to 2.
@@ -72,17 +80,18 @@ class Migrate1to2:
     def _copy_to_new_fs(self):
         fs_galaxy_data = self.app.manager.get_services(svc_role=ServiceRole.GALAXY_DATA)[0]
         fs_galaxy_tools = self.app.manager.get_services(svc_role=ServiceRole.GALAXY_TOOLS)[0]
-        source_path = os.path.join(fs_galaxy_tools.mount_point, "tools")
-        target_path = os.path.join(fs_galaxy_data.mount_point, "tools")
-        ok_tools = self._as_galaxy("cp -R {0} {1}".format(source_path, target_path))
-
-        source_path = os.path.join(fs_galaxy_tools.mount_point, "galaxy-central")
-        target_path = os.path.join(fs_galaxy_data.mount_point, "galaxy-app")
-        if (os.path.exists(target_path)):
+        source_path = os.path.join(fs_galaxy_tools.mount_point, TOOLS_TREE[0])
+        target_path = os.path.join(fs_galaxy_data.mount_point, TOOLS_TREE[1])
+        ok_tools = TreeCopy(source_path, target_path, num_workers=COPY_WORKERS).run()
+
+        source_path = os.path.join(fs_galaxy_tools.mount_point, GALAXY_TREE[0])
+        target_path = os.path.join(fs_galaxy_data.mount_point, GALAXY_TREE[1])
+        copier = TreeCopy(source_path, target_path, num_workers=COPY_WORKERS)
+        if os.path.exists(target_path) and not copier.in_progress():
             log.debug("Target path for galaxy-app ({0}) already exists! Skipping...".format(target_path))
             ok_galaxy = True
         else:
-            ok_galaxy = self._as_galaxy("cp -R {0} {1}".format(source_path, target_path))
+            ok_galaxy = copier.run()
         if (ok_tools and ok_galaxy):
             return True
         else:
@@ -116,35 +125,51 @@ class Migrate1to2:
 
         ok_db = self._as_galaxy("sed -i 's|database_connection = postgres://galaxy@localhost:5840/galaxy|database_connection = postgres://galaxy@localhost:{0}/galaxy|' {1}"
                                 .format(paths.C_PSQL_PORT, galaxy_ini_loc))
-        # Adjust content of tools' env.sh to reflect the new path
-        tools_dir = os.path.join(galaxy_data_loc, 'tools')
-        env_files = []
-        for root, dirnames, filenames in os.walk(tools_dir):
-            for filename in fnmatch.filter(filenames, 'env.sh'):
-                env_files.append(os.path.join(root, filename))
-        log.debug("Found the following env.sh files: {0}".format(env_files))
-        for f in env_files:
-            cmd = "sed --in-place=.orig 's/galaxyTools/galaxyData/g' {0}".format(f)
-            misc.run(cmd)
-        # Update broken symlinks for the tools' `default` dirs
-        default_symlinks = misc.detect_symlinks('/mnt/galaxyData/tools',
-                                                'default',
-                                                symlink_as_file=False)
-        if not default_symlinks:
-            log.debug("No 'default' symlinks found to update!")
-        for link in default_symlinks:
-            link_name = link[0]
-            # We'll make the symlinks relative so extract target's basename
-            target_name = os.path.basename(link[1])
-            os.unlink(link_name)
-            os.symlink(target_name, link_name)
-            log.debug("Updated symlink {0} to {1}.".format(link_name, target_name))
+        # Adjust content of tools' env.sh to reflect the new path and update
+        # broken symlinks for the tools' `default` dirs
+        self._adjust_tool_paths(os.path.join(galaxy_data_loc, 'tools'))
         if (ok_tools and ok_db):
             return True
         else:
             log.error("Problems updating Galaxy tools or database location; look at the log.")
             return False
 
+    def _adjust_tool_paths(self, tools_dir):
+        """
+        In a single pass over ``tools_dir``, point the tools' ``env.sh``
+        files at ``galaxyData`` instead of ``galaxyTools`` (keeping the
+        originals as ``env.sh.orig``) and make the tools' ``default``
+        symlinks relative.
+        """
+        env_files = 0
+        for root, dirnames, filenames in os.walk(tools_dir):
+            for name in dirnames + filenames:
+                path = os.path.join(root, name)
+                if name == 'default' and os.path.islink(path):
+                    # We'll make the symlinks relative so extract target's basename
+                    target_name = os.path.basename(os.readlink(path).rstrip('/'))
+                    os.unlink(path)
+                    os.symlink(target_name, path)
+                    log.debug("Updated symlink {0} to {1}.".format(path, target_name))
+                elif name == 'env.sh' and not os.path.islink(path):
+                    env_files += 1
+                    try:
+                        self._rewrite_file(path, 'galaxyTools', 'galaxyData')
+                    except (IOError, OSError), e:
+                        log.error("Error updating {0}: {1}".format(path, e))
+        log.debug("Updated {0} env.sh files under {1}".format(env_files, tools_dir))
+
+    def _rewrite_file(self, path, old, new):
+        with open(path) as f:
+            content = f.read()
+        if old not in content:
+            return
+        st = os.stat(path)
+        shutil.copy2(path, path + '.orig')
+        os.chown(path + '.orig', st.st_uid, st.st_gid)
+        with open(path, 'w') as f:
+            f.write(content.replace(old, new))
+
     def _update_user_data(self):
         if 'filesystems' in self.app.config.user_data:
             old_fs_list = self.app.config.user_data.get('filesystems') or []
@@ -199,10 +224,16 @@ class Migrate1to2:
         fs_galaxy_data = fs_galaxy_data_list[0]
         fs_galaxy_tools = fs_galaxy_tools_list[0]
         space_available = int(fs_galaxy_data.size) - int(fs_galaxy_data.size_used)
-        if space_available < int(fs_galaxy_tools.size_used):
+        # Only the trees that get copied need to fit, not the whole tools volume
+        space_required = 0
+        for source, target in [TOOLS_TREE, GALAXY_TREE]:
+            source_path = os.path.join(fs_galaxy_tools.mount_point, source)
+            if os.path.isdir(source_path):
+                space_required += misc.get_dir_size(source_path)
+        if space_available < space_required:
             log.debug("Cannot migrate from 1 to 2: Insufficient space available on "
                       "Galaxy data volume. Available: {0}, Required: {1}"
-                      .format(space_available, fs_galaxy_tools.size_used))
+                      .format(space_available, space_required))
             return False
         for svc in self.app.manager.get_services(svc_type=ServiceType.FILE_SYSTEM):
             if ServiceRole.GALAXY_TOOLS in svc.svc_roles and ServiceRole.GALAXY_DATA in svc.svc_roles:
@@ -1,6 +1,7 @@
 import os
 
 from cm.conftemplates import conf_manager
+from cm.util import galaxy_topology
 from cm.util import misc
 from cm.util import paths
 from cm.services import ServiceRole
@@ -10,6 +11,10 @@ from cm.services.apps import ApplicationService
 import logging
 log = logging.getLogger('cloudman')
 
+# Number of idle connections to the backend servers each Nginx worker keeps
+GALAXY_KEEPALIVE = 32
+CMF_KEEPALIVE = 8
+
 
 class NginxService(ApplicationService):
     def __init__(self, app):
@@ -26,6 +31,7 @@ class NginxService(ApplicationService):
                                  'ClouderaManager', 'Cloudgene']
         # A list of currently active CloudMan services being proxied
         self.active_proxied = []
+        self._version = None
 
     def start(self):
         """
@@ -58,13 +64,28 @@ class NginxService(ApplicationService):
             if misc.run(self.exe):
                 self.state == service_states.RUNNING
 
-    def reload(self):
+    def check_config(self):
+        """
+        Test the Nginx configuration (`nginx -t`).
+        """
+        return misc.run('{0} -t -c {1}'.format(self.exe, self.conf_file),
+                        "Nginx configuration test failed",
+                        "Nginx configuration test OK")
+
+    def reload(self, check=True):
         """
-        Reload nginx process (`nginx -s reload`)
+        Reload nginx process (`nginx -s reload`) if its configuration is OK
+        (the test is skipped if `check` is not set).
         """
-        # TODO: run `nginx -t` before attemping to reload the process to make
-        # sure the conf files are OK and thus reduce chances of screwing up
-        misc.run('{0} -c {1} -s reload'.format(self.exe, self.conf_file))
+        if not check or self.check_config():
+            return misc.run('{0} -c {1} -s reload'.format(self.exe, self.conf_file))
+        return False
+
+    @property
+    def version(self):
+        if self._version is None:
+            self._version = misc.getoutput("{0} -v".format(self.exe))
+        return self._version
 
     def _define_upstream_servers(self):
         """
@@ -73,6 +94,7 @@ class NginxService(ApplicationService):
 
             upstream galaxy_app {
                 server 127.0.0.1:8080;
+                keepalive 32;
             }
             upstream galaxy_reports_app {
                 server 127.0.0.1:9001;
@@ -86,21 +108,18 @@ class NginxService(ApplicationService):
         # Collect active servers
         galaxy_svc = self.app.manager.service_registry.get_active('Galaxy')
         if galaxy_svc:
-            if not galaxy_svc.multiple_processes():
-                galaxy_server = "server 127.0.0.1:8080;"
+            topology = galaxy_svc.get_topology()
+            if not galaxy_svc.multiple_processes() or not topology:
+                galaxy_server = "server 127.0.0.1:{0};".format(galaxy_svc.main_port())
             else:
-                web_thread_count = int(self.app.config.web_thread_count)
-                galaxy_server = 'ip_hash;'
-                if web_thread_count > 9:
-                    log.warning("Current code supports max 9 web threads. "
-                                "Setting the web thread count to 9.")
-                    web_thread_count = 9
-                for i in range(web_thread_count):
-                    galaxy_server += "server 127.0.0.1:808%s;" % i
+                # The web processes as configured for Galaxy
+                galaxy_server = 'ip_hash;' + ''.join(topology.upstream_servers())
+            galaxy_server += 'keepalive {0};'.format(GALAXY_KEEPALIVE)
             servers.append(('galaxy', galaxy_server))
         cmf_svc = self.app.manager.service_registry.get_active('ClouderaManager')
         if cmf_svc:
-            servers.append(('cmf', 'server 127.0.0.1:{0};'.format(cmf_svc.cm_port)))
+            servers.append(('cmf', 'server 127.0.0.1:{0};keepalive {1};'.format(
+                cmf_svc.cm_port, CMF_KEEPALIVE)))
         # Format the active servers
         for server in servers:
             upstream_servers += '''
@@ -109,33 +128,75 @@ class NginxService(ApplicationService):
     }}'''.format(server[0], server[1])
         return upstream_servers
 
-    def _write_template_file(self, template_file, parameters, conf_file):
+    def _render_template(self, template_file, parameters):
         """
         Given a plain text `template_file` path and appropriate `parameters`,
-        load the file as a `string.Template`, substitute the `parameters` and
-        write out the file to the `conf_file` path.
+        load the file as a `string.Template` and return it with the
+        `parameters` substituted, or `None` if that fails.
         """
         template = conf_manager.load_conf_template(template_file)
         try:
-            t = template.substitute(parameters)
-            # create conf directory if required
-            if not os.path.exists(os.path.dirname(conf_file)):
-                log.debug("Configuration path does not exist. Creating path: {0}".format(os.path.dirname(conf_file)))
-                os.makedirs(os.path.dirname(conf_file))
-            # Write out the file
-            with open(conf_file, 'w') as f:
-                print >> f, t
-            log.debug("Wrote Nginx config file {0}".format(conf_file))
+            return template.substitute(parameters) + '\n'
         except KeyError, kexc:
             log.error("KeyError filling template {0}: {1}".format(template_file,
                       kexc))
-        except IOError, ioexc:
-            log.error("IOError writing template file {0}: {1}".format(conf_file,
-                      ioexc))
+        return None
+
+    def _apply_config(self, files, obsolete):
+        """
+        Write out the config `files` (a dict of file path: content) and
+        delete the `obsolete` files, then test the configuration and reload
+        Nginx, but only if that changes any of the files. If the new
+        configuration does not pass the test, the previous files are put
+        back. If it passes but Nginx cannot be reloaded (e.g., because it is
+        not running yet), the new configuration is kept for Nginx to pick up
+        when it starts.
+
+        :rtype: bool
+        :return: ``True`` if Nginx was reloaded with a changed configuration.
+        """
+        previous = {}  # Path: previous content (None if the file did not exist)
+        for conf_file, content in files.items() + [(f, None) for f in obsolete]:
+            current = None
+            if os.path.exists(conf_file):
+                with open(conf_file) as f:
+                    current = f.read()
+            if content != current:
+                previous[conf_file] = current
+        if not previous:
+            log.debug("Nginx config is unchanged; not reloading")
+            return False
+
+        def _write(conf_file, content):
+            try:
+                if content is None:
+                    misc.delete_file(conf_file)
+                    return
+                if not os.path.exists(os.path.dirname(conf_file)):
+                    log.debug("Configuration path does not exist. Creating path: {0}"
+                              .format(os.path.dirname(conf_file)))
+                    os.makedirs(os.path.dirname(conf_file))
+                with open(conf_file, 'w') as f:
+                    f.write(content)
+            except (IOError, OSError), e:
+                log.error("Error writing Nginx config file {0}: {1}".format(conf_file, e))
+        for conf_file in previous:
+            _write(conf_file, files.get(conf_file))
+        log.debug("Updated Nginx config files {0}".format(previous.keys()))
+        if not self.check_config():
+            log.error("Not reloading Nginx; reverting to the previous config")
+            for conf_file, content in previous.iteritems():
+                _write(conf_file, content)
+            return False
+        if self.reload(check=False):
+            return True
+        log.warning("Could not reload Nginx; it will use the updated config once started")
+        return False
 
     def reconfigure(self, setup_ssl):
         """
-        (Re)Generate Nginx configuration files and reload the server process.
+        (Re)Generate Nginx configuration files and, if any of them changed,
+        reload the server process (see `_apply_config`).
 
         :type   setup_ssl: boolean
         :param  setup_ssl: if set, force HTTPS with a self-signed certificate.
@@ -143,21 +204,28 @@ class NginxService(ApplicationService):
         if self.exe:
             log.debug("Updating Nginx config at {0}".format(self.conf_file))
             params = {}
+            files, obsolete = {}, []
+
+            def _add(template_file, parameters, conf_file):
+                content = self._render_template(template_file, parameters)
+                if content is not None:
+                    files[conf_file] = content
             # Customize the appropriate nginx template
-            if "1.4" in misc.getoutput("{0} -v".format(self.exe)):
+            if "1.4" in self.version:
                 nginx_tmplt = conf_manager.NGINX_14_CONF_TEMPLATE
                 params = {'galaxy_user_name': paths.GALAXY_USER_NAME,
                           'nginx_conf_dir': self.conf_dir}
                 if setup_ssl:
                     log.debug("Using Nginx v1.4+ template w/ SSL")
                     # Generate a self-signed certificate
-                    log.info("Generating self-signed certificate for SSL encryption")
                     cert_home = "/root/.ssh/"
                     certfile = os.path.join(cert_home, "instance_selfsigned_cert.pem")
                     keyfile = os.path.join(cert_home, "instance_selfsigned_key.pem")
-                    misc.run("yes '' | openssl req -x509 -nodes -days 3650 -newkey "
-                             "rsa:1024 -keyout " + keyfile + " -out " + certfile)
-                    misc.run("chmod 440 " + keyfile)
+                    if not (os.path.exists(certfile) and os.path.exists(keyfile)):
+                        log.info("Generating self-signed certificate for SSL encryption")
+                        misc.run("yes '' | openssl req -x509 -nodes -days 3650 -newkey "
+                                 "rsa:1024 -keyout " + keyfile + " -out " + certfile)
+                        misc.run("chmod 440 " + keyfile)
                     server_tmplt = conf_manager.NGINX_SERVER_SSL
                     self.ssl_is_on = True
                 else:
@@ -174,9 +242,9 @@ class NginxService(ApplicationService):
                     'galaxy_data': self.app.path_resolver.galaxy_data,
                 }
                 log.debug("Using Nginx pre-v1.4 template")
-            # Write out the main nginx.conf file
-            self._write_template_file(nginx_tmplt, params, self.conf_file)
-            # Write out the default server block file
+            # The main nginx.conf file
+            _add(nginx_tmplt, params, self.conf_file)
+            # The default server block file
             if server_tmplt:
                 # This means we're dealing with Nginx v1.4+ & split conf files
                 upstream_servers = self._define_upstream_servers()
@@ -185,19 +253,32 @@ class NginxService(ApplicationService):
                     'nginx_conf_dir': self.conf_dir
                 }
                 conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'default.server')
-                self._write_template_file(server_tmplt, params, conf_file)
+                _add(server_tmplt, params, conf_file)
                 # Pulsar has it's own server config
                 pulsar_svc = self.app.manager.service_registry.get_active('Pulsar')
                 if pulsar_svc:
                     pulsar_tmplt = conf_manager.NGINX_SERVER_PULSAR
                     params = {'pulsar_port': pulsar_svc.pulsar_port}
                     conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'pulsar.server')
-                    self._write_template_file(pulsar_tmplt, params, conf_file)
-                # Write out the location blocks for hosted services
+                    _add(pulsar_tmplt, params, conf_file)
+                # The location blocks for hosted services
                 # Always include default locations (CloudMan, VNC, error)
                 default_tmplt = conf_manager.NGINX_DEFAULT
                 conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'default.locations')
-                self._write_template_file(default_tmplt, {}, conf_file)
+                _add(default_tmplt, {}, conf_file)
+                # Optional microcache for CloudMan's JSON status endpoints
+                cache_ttl = int(self.app.config.get('status_cache_ttl', 0) or 0)
+                cache_conf_file = os.path.join(self.conf_dir, 'conf.d', 'cloudman_cache.conf')
+                cache_locations_file = os.path.join(self.conf_dir, 'sites-enabled',
+                                                    'status_cache.locations')
+                if cache_ttl > 0:
+                    misc.make_dir(os.path.dirname(paths.P_NGINX_CACHE_DIR))
+                    _add(conf_manager.NGINX_STATUS_CACHE,
+                         {'cache_dir': paths.P_NGINX_CACHE_DIR}, cache_conf_file)
+                    _add(conf_manager.NGINX_STATUS_CACHE_LOCATIONS,
+                         {'cache_ttl': cache_ttl}, cache_locations_file)
+                else:
+                    obsolete.extend([cache_conf_file, cache_locations_file])
                 # Now add running services
                 # Galaxy Reports
                 reports_svc = self.app.manager.service_registry.get_active('GalaxyReports')
@@ -205,42 +286,46 @@ class NginxService(ApplicationService):
                 if reports_svc:
                     reports_tmplt = conf_manager.NGINX_GALAXY_REPORTS
                     params = {'reports_port': reports_svc.reports_port}
-                    self._write_template_file(reports_tmplt, params, reports_conf_file)
+                    _add(reports_tmplt, params, reports_conf_file)
                 else:
-                    misc.delete_file(reports_conf_file)
+                    obsolete.append(reports_conf_file)
                 # Galaxy
                 galaxy_svc = self.app.manager.service_registry.get_active('Galaxy')
                 gxy_conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'galaxy.locations')
                 if galaxy_svc:
                     galaxy_tmplt = conf_manager.NGINX_GALAXY
+                    topology = galaxy_svc.get_topology()
                     params = {
                         'galaxy_home': paths.P_GALAXY_HOME,
-                        'galaxy_data': self.app.path_resolver.galaxy_data
+                        'galaxy_data': self.app.path_resolver.galaxy_data,
+                        'galaxy_manager_port': (topology.manager.port if topology
+                                                else galaxy_topology.MANAGER_BASE_PORT)
                     }
-                    self._write_template_file(galaxy_tmplt, params, gxy_conf_file)
+                    _add(galaxy_tmplt, params, gxy_conf_file)
                 else:
-                    misc.delete_file(gxy_conf_file)
+                    obsolete.append(gxy_conf_file)
                 # Cloudera Manager
                 cmf_svc = self.app.manager.service_registry.get_active('ClouderaManager')
                 cmf_conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'cmf.locations')
                 if cmf_svc:
                     cmf_tmplt = conf_manager.NGINX_CLOUDERA_MANAGER
-                    self._write_template_file(cmf_tmplt, {}, cmf_conf_file)
+                    _add(cmf_tmplt, {}, cmf_conf_file)
                 else:
-                    misc.delete_file(cmf_conf_file)
+                    obsolete.append(cmf_conf_file)
                 # Cloudgene
                 cg_svc = self.app.manager.service_registry.get_active('Cloudgene')
                 cg_conf_file = os.path.join(self.conf_dir, 'sites-enabled', 'cloudgene.locations')
                 if cg_svc:
                     cg_tmplt = conf_manager.NGINX_CLOUDGENE
                     params = {'cg_port': cg_svc.port}
-                    self._write_template_file(cg_tmplt, params, cg_conf_file)
+                    _add(cg_tmplt, params, cg_conf_file)
                 else:
-                    misc.delete_file(cg_conf_file)
-            self.reload()
+                    obsolete.append(cg_conf_file)
+            return self._apply_config(files, obsolete)
         else:
             log.warning("Cannot find nginx executable to reload nginx config (got"
                         " '{0}')".format(self.exe))
+        return False
 
     def status(self):
         """
@@ -0,0 +1,183 @@
+"""
+Service implementation for PgBouncer, a connection pooler run in front of
+Galaxy's PostgreSQL database.
+
+With Galaxy running multiple (web, handler, manager) processes, each process
+keeps its own pool of database connections and hence its own PostgreSQL
+backends. PgBouncer runs in transaction pooling mode so all the processes
+share a fixed number of server connections; Galaxy is pointed at it via its
+``database_connection`` option (see ``GalaxyService.update_galaxy_config``).
+"""
+import os
+import signal
+import socket
+import threading
+
+from cm.services import service_states
+from cm.services import ServiceRole
+from cm.services import ServiceDependency
+from cm.services.apps import ApplicationService
+from cm.util import galaxy_topology
+from cm.util import health
+from cm.util import misc
+from cm.util import paths
+from cm.util import pgwire
+from cm.util import string_as_bool
+
+import logging
+log = logging.getLogger('cloudman')
+
+DEFAULT_PGBOUNCER_PORT = 6432
+DEFAULT_POOL_SIZE = 20
+
+
+def pooler_enabled(app):
+    """
+    Indicate if Galaxy's database connections should be pooled, i.e., if
+    the ``db_pooler`` user data option is set (it defaults to on when Galaxy
+    runs multiple processes) and PgBouncer is installed.
+    """
+    return (string_as_bool(app.config.db_pooler) and
+            misc.which('pgbouncer', ['/usr/sbin']) is not None)
+
+
+class PgBouncerService(ApplicationService):
+
+    def __init__(self, app):
+        super(PgBouncerService, self).__init__(app)
+        self.name = ServiceRole.to_string(ServiceRole.PGBOUNCER)
+        self.svc_roles = [ServiceRole.PGBOUNCER]
+        self.dependencies = [ServiceDependency(self, ServiceRole.GALAXY_POSTGRES)]
+        self.port = int(app.config.get('db_pooler_port', DEFAULT_PGBOUNCER_PORT))
+        self.pool_size = int(app.config.get('db_pool_size', DEFAULT_POOL_SIZE))
+        self.conf_dir = paths.P_PGBOUNCER_DIR
+        self.conf_file = os.path.join(self.conf_dir, 'cloudman.ini')
+        self.run_dir = paths.P_PGBOUNCER_RUN_DIR
+        self.pid_file = os.path.join(self.run_dir, 'pgbouncer.pid')
+        # Connection to PgBouncer's admin console, used to get pool stats
+        self.console = pgwire.Connection(self.port, database='pgbouncer',
+                                         socket_dirs=(self.run_dir,))
+        # The console is queried from the web server's threads
+        self.console_lock = threading.Lock()
+
+    def __repr__(self):
+        return "PgBouncer service on port {0}".format(self.port)
+
+    def _write_config(self):
+        galaxy_processes = galaxy_topology.num_processes(self.app)
+        misc.make_dir(self.conf_dir)
+        misc.make_dir(self.run_dir, owner='postgres')
+        auth_file = os.path.join(self.conf_dir, 'userlist.txt')
+        # Authentication is left to PostgreSQL, which trusts local connections
+        with open(auth_file, 'w') as f:
+            f.write('"galaxy" ""\n"postgres" ""\n')
+        conf = [
+            '[databases]',
+            'galaxy = host=127.0.0.1 port={0} dbname=galaxy'.format(
+                self.app.path_resolver.psql_db_port),
+            '',
+            '[pgbouncer]',
+            'listen_addr = 127.0.0.1',
+            'listen_port = {0}'.format(self.port),
+            'unix_socket_dir = {0}'.format(self.run_dir),
+            'auth_type = trust',
+            'auth_file = {0}'.format(auth_file),
+            'admin_users = postgres',
+            'stats_users = postgres',
+            'pool_mode = transaction',
+            'default_pool_size = {0}'.format(self.pool_size),
+            'reserve_pool_size = {0}'.format(max(1, self.pool_size / 4)),
+            # Each Galaxy process may hold its full SQLAlchemy pool
+            'max_client_conn = {0}'.format(galaxy_processes * 15 + 100),
+            'ignore_startup_parameters = extra_float_digits',
+            'pidfile = {0}'.format(self.pid_file),
+            'logfile = {0}'.format(os.path.join(self.run_dir, 'pgbouncer.log')),
+        ]
+        with open(self.conf_file, 'w') as f:
+            f.write('\n'.join(conf) + '\n')
+        log.debug("Wrote PgBouncer config to {0}".format(self.conf_file))
+
+    def start(self):
+        self.state = service_states.STARTING
+        log.debug("Starting PgBouncer service")
+        self.status()
+        if self.state != service_states.RUNNING:
+            self._write_config()
+            if not misc.run('{0} - postgres -c "{1} -d -q {2}"'.format(
+                            paths.P_SU, misc.which('pgbouncer', ['/usr/sbin']), self.conf_file),
+                            "Error starting PgBouncer",
+                            "Started PgBouncer on port {0}".format(self.port)):
+                self.state = service_states.ERROR
+
+    def remove(self, synchronous=False):
+        if self.state in [service_states.RUNNING, service_states.STARTING, service_states.ERROR]:
+            log.info("Removing '{0}' service".format(self.name))
+            super(PgBouncerService, self).remove(synchronous)
+            self.state = service_states.SHUTTING_DOWN
+            with self.console_lock:
+                self.console.close()
+            pid = self._get_pid()
+            if pid:
+                try:
+                    # SIGINT lets the transactions in progress complete
+                    os.kill(pid, signal.SIGINT)
+                except OSError, e:
+                    log.debug("Error stopping PgBouncer (pid {0}): {1}".format(pid, e))
+            self.state = service_states.SHUT_DOWN
+        elif self.state == service_states.UNSTARTED:
+            self.state = service_states.SHUT_DOWN
+        else:
+            log.debug("{0} service not running (state: {1}) so not removing it."
+                      .format(self.name, self.state))
+
+    def _get_pid(self):
+        try:
+            with open(self.pid_file) as f:
+                return int(f.read().strip())
+        except (IOError, ValueError):
+            return None
+
+    def _running(self, max_age=0):
+        pid = self._get_pid()
+        if not pid:
+            return False
+        try:
+            os.kill(pid, 0)
+        except OSError:
+            return False
+        return self._port_bound(self.port, max_age=max_age)
+
+    def status(self):
+        if self.state in [service_states.SHUTTING_DOWN, service_states.SHUT_DOWN,
+                          service_states.UNSTARTED, service_states.WAITING_FOR_USER_ACTION]:
+            pass
+        elif self._running(max_age=health.STATUS_MAX_AGE):
+            self.state = service_states.RUNNING
+        elif self.state != service_states.STARTING:
+            log.error("PgBouncer is not running")
+            self.state = service_states.ERROR
+
+    def get_stats(self):
+        """
+        Return a dict describing the use of the connection pool for Galaxy's
+        database: the number of active and waiting clients, of active and
+        idle server connections, the longest time a client has been waiting
+        (``max_wait``, in seconds) and ``saturation``, the fraction of the
+        pool's server connections in use. Return an empty dict if PgBouncer
+        cannot be queried.
+        """
+        try:
+            with self.console_lock:
+                pools = self.console.query_dicts('SHOW POOLS')
+        except (pgwire.PGError, socket.error), e:
+            log.debug("Cannot get PgBouncer pool stats: {0}".format(e))
+            return {}
+        stats = {'pool_mode': 'transaction', 'pool_size': self.pool_size}
+        for field, column in [('clients_active', 'cl_active'), ('clients_waiting', 'cl_waiting'),
+                              ('servers_active', 'sv_active'), ('servers_idle', 'sv_idle')]:
+            stats[field] = sum([int(p.get(column) or 0) for p in pools
+                                if p.get('database') == 'galaxy'])
+        stats['max_wait'] = max([int(p.get('maxwait') or 0) for p in pools] or [0])
+        stats['saturation'] = round(float(stats['servers_active']) / self.pool_size, 2)
+        stats['saturated'] = stats['clients_waiting'] > 0
+        return stats
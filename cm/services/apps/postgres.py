@@ -1,18 +1,29 @@
 import os
 import pwd
 import grp
+import socket
+import threading
+import time
 
 from cm.services import service_states
 from cm.services import ServiceRole
 from cm.services import ServiceDependency
 from cm.services.apps import ApplicationService
+from cm.util import galaxy_topology
 from cm.util import misc
 from cm.util import paths
+from cm.util import pgtune
+from cm.util import pgwire
+from cm.util import reconcile
+from cm.util import string_as_bool
 from cm.util.decorators import TestFlag
 
 import logging
 log = logging.getLogger('cloudman')
 
+# Number of seconds for which the existence of the `galaxy` database is cached
+DB_RECHECK_INTERVAL = 300
+
 
 class PostgresService(ApplicationService):
 
@@ -23,6 +34,11 @@ class PostgresService(ApplicationService):
         self.psql_port = app.path_resolver.psql_db_port
         self.dependencies = [ServiceDependency(self, ServiceRole.GALAXY_DATA),
                              ServiceDependency(self, ServiceRole.MIGRATION)]
+        # A persistent connection used to check on the server
+        self.monitor = pgwire.Connection(self.psql_port)
+        self.monitor_lock = threading.Lock()
+        self.native_checks = True
+        self.galaxy_db_checked = 0
 
     def start(self):
         self.state = service_states.STARTING
@@ -50,12 +66,14 @@ class PostgresService(ApplicationService):
     def manage_postgres(self, to_be_started=True):
         psql_data_dir = self.app.path_resolver.psql_dir
         # Make sure postgres is owner of its directory before any operations
+        # (unless the ownership has not drifted since it was last set)
         if os.path.exists(self.app.path_resolver.psql_dir):
-            misc.run(
-                "%s --recursive postgres:postgres %s" % (
-                    paths.P_CHOWN, psql_data_dir),
-                "Error setting ownership of Postgres data directory %s" % psql_data_dir,
-                "Successfully set ownership of Postgres data directory %s" % psql_data_dir)
+            reconcile.ensure_owner(
+                psql_data_dir, 'postgres', 'postgres', lambda: misc.run(
+                    "%s --recursive postgres:postgres %s" % (
+                        paths.P_CHOWN, psql_data_dir),
+                    "Error setting ownership of Postgres data directory %s" % psql_data_dir,
+                    "Successfully set ownership of Postgres data directory %s" % psql_data_dir))
         # Check on the status of PostgreSQL server
         self.status()
         if to_be_started and self.state is not service_states.RUNNING:
@@ -105,6 +123,7 @@ class PostgresService(ApplicationService):
                 # Start PostgreSQL server so a role for Galaxy user can be
                 # created
                 if cont:
+                    self.tune()
                     log.debug(
                         "Starting PostgreSQL on port {0} as part of the initial setup..."
                         .format(self.psql_port))
@@ -152,6 +171,7 @@ class PostgresService(ApplicationService):
             self.status()
             if to_be_started and self.state is not service_states.RUNNING:
                 # Start PostgreSQL database
+                self.tune()
                 log.debug("Starting PostgreSQL...")
                 if misc.run('%s - postgres -c "%s/pg_ctl -w -D %s -l /tmp/pgSQL.log -o\\\"-p %s\\\" start"' %
                             (paths.P_SU, self.app.path_resolver.pg_home, psql_data_dir, self.psql_port)):
@@ -164,6 +184,8 @@ class PostgresService(ApplicationService):
             log.info("Stopping PostgreSQL from {0} on port {1}...".format(
                 psql_data_dir, self.psql_port))
             self.state = service_states.SHUTTING_DOWN
+            # The monitoring connection would hold up a smart shutdown
+            self._close_monitor()
             if misc.run('%s - postgres -c "%s/pg_ctl -w -D %s -o\\\"-p %s\\\" stop"'
                % (paths.P_SU, self.app.path_resolver.pg_home, psql_data_dir, self.psql_port)):
                 self.state = service_states.SHUT_DOWN
@@ -172,27 +194,152 @@ class PostgresService(ApplicationService):
                 return False
         return True
 
+    def tune(self):
+        """
+        Apply PostgreSQL settings sized for the master instance (see
+        ``cm.util.pgtune``) unless disabled via ``postgres_tuning`` user data
+        option. The settings are regenerated before each start so they follow
+        the master's instance type.
+        """
+        if not string_as_bool(self.app.config.get('postgres_tuning', True)):
+            return False
+        data_dir = self.app.path_resolver.psql_dir
+        try:
+            with open(os.path.join(data_dir, 'PG_VERSION')) as f:
+                version = pgtune.parse_version(f.read())
+            num_processes = galaxy_topology.num_processes(self.app)
+            total_memory = self.app.manager.total_memory
+            num_cpus = self.app.manager.num_cpus
+            settings = pgtune.tune(total_memory, num_cpus, num_processes, version)
+            comment = "Instance type {0}: {1} CPUs, {2} MB of memory, {3} Galaxy processes".format(
+                self.app.cloud_interface.get_type(), num_cpus, total_memory / 1024,
+                num_processes)
+            if pgtune.apply(data_dir, settings, comment):
+                os.chown(os.path.join(data_dir, pgtune.INCLUDE_FILE_NAME),
+                         pwd.getpwnam("postgres")[2], grp.getgrnam("postgres")[2])
+                log.info("Tuned PostgreSQL for this instance: {0}".format(comment))
+            return True
+        except (IOError, OSError, ValueError, KeyError), e:
+            log.error("Error tuning PostgreSQL: {0}".format(e))
+            return False
+
+    def _query(self, sql):
+        """
+        Run ``sql`` over the monitoring connection, reconnecting once if the
+        connection has gone stale (e.g., the server was restarted).
+        """
+        with self.monitor_lock:
+            was_open = self.monitor.is_open()
+            try:
+                return self.monitor.query(sql)
+            except socket.error:
+                if not was_open:
+                    raise
+                return self.monitor.query(sql)
+
+    def _close_monitor(self):
+        with self.monitor_lock:
+            self.monitor.close()
+        self.galaxy_db_checked = 0
+
+    def _check_postgres_native(self):
+        if time.time() - self.galaxy_db_checked < DB_RECHECK_INTERVAL:
+            self._query('SELECT 1')
+            return True
+        if self._query("SELECT 1 FROM pg_database WHERE datname = 'galaxy'"):
+            self.galaxy_db_checked = time.time()
+            return True
+        return False
+
     def check_postgres(self):
         """
         Check if PostgreSQL server is running and if `galaxy` database exists.
 
+        The check is done over a persistent connection to the server, caching
+        the existence of the `galaxy` database for ``DB_RECHECK_INTERVAL``
+        seconds, and falls back to running ``psql`` if the server cannot be
+        connected to as the `postgres` user without a password.
+
         :rtype: bool
         :return: ``True`` if the server is running and `galaxy` database exists,
                  ``False`` otherwise.
         """
-        # log.debug("\tChecking PostgreSQL")
+        if self.native_checks:
+            try:
+                return self._check_postgres_native()
+            except pgwire.PGError, e:
+                if not e.is_auth_error():
+                    log.debug("PostgreSQL check failed: {0}".format(e))
+                    return False
+                log.warning("Cannot connect to PostgreSQL to check on it ({0}); "
+                            "will be checking using psql".format(e))
+                self.native_checks = False
+                self._close_monitor()
+            except socket.error, e:
+                # Unless the server is running yet cannot be reached (e.g.,
+                # its socket is elsewhere), it is just not running
+                if not self._check_daemon('postgres'):
+                    return False
+                log.debug("PostgreSQL is running but cannot be connected to "
+                          "({0}); checking using psql".format(e))
+        return self._check_postgres_psql()
+
+    def _check_postgres_psql(self):
         if self._check_daemon('postgres'):
-            # log.debug("\tPostgreSQL daemon running. Trying to connect and
-            # select tables.")
             cmd = ('%s - postgres -c "%s/psql -p %s -c \\\"SELECT datname FROM PG_DATABASE;\\\" "'
                    % (paths.P_SU, self.app.path_resolver.pg_home, self.psql_port))
             dbs = misc.getoutput(cmd, quiet=True)
             if dbs.find('galaxy') > -1:
-                # log.debug("\tPostgreSQL daemon on port {0} OK, 'galaxy' database exists."
-                #     .format(self.psql_port))
                 return True
         return False
 
+    def checkpoint(self):
+        """
+        Have PostgreSQL write all modified buffers to disk (e.g., ahead of a
+        snapshot of its file system so the snapshot needs little recovery).
+        """
+        if self.native_checks:
+            try:
+                self._query('CHECKPOINT')
+                log.debug("PostgreSQL checkpoint completed")
+                return True
+            except (pgwire.PGError, socket.error), e:
+                log.debug("Cannot run a checkpoint over the monitoring connection "
+                          "({0}); using psql".format(e))
+        return misc.run('%s - postgres -c "%s/psql -p %s -c \\\"CHECKPOINT\\\" "'
+                        % (paths.P_SU, self.app.path_resolver.pg_home, self.psql_port),
+                        "Error running a PostgreSQL checkpoint",
+                        "PostgreSQL checkpoint completed")
+
+    def get_stats(self):
+        """
+        Return a dict with the number of connections to the server (in total
+        and per database), checkpoint and replication statistics, or an
+        empty dict if the server cannot be queried.
+        """
+        if not self.native_checks:
+            return {}
+        try:
+            connections = self._query(
+                "SELECT datname, count(*) FROM pg_stat_activity GROUP BY datname")
+            max_connections = self._query("SHOW max_connections")
+            checkpoints = self._query(
+                "SELECT checkpoints_timed, checkpoints_req, buffers_checkpoint "
+                "FROM pg_stat_bgwriter")
+            replicas = self._query("SELECT count(*) FROM pg_stat_replication")
+        except (pgwire.PGError, socket.error), e:
+            log.debug("Cannot get PostgreSQL stats: {0}".format(e))
+            return {}
+        by_database = dict([(db, int(n)) for db, n in connections if db is not None])
+        return {'server_version': self.monitor.parameters.get('server_version'),
+                'connections': sum([int(n) for db, n in connections]),
+                'connections_by_database': by_database,
+                'max_connections': int(max_connections[0][0]),
+                'checkpoints_timed': int(checkpoints[0][0]),
+                'checkpoints_requested': int(checkpoints[0][1]),
+                'buffers_checkpoint': int(checkpoints[0][2]),
+                'replicas': int(replicas[0][0])}
+
     def status(self):
         """Set the status of the service based on the state of the app process."""
         if self.state != service_states.SHUT_DOWN:
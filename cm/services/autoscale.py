@@ -2,13 +2,23 @@ import datetime
 import logging
 from cm.services import (Service, ServiceDependency, ServiceRole, ServiceType,
                          service_states)
+from cm.services.autoscale_planner import ScaleDownPlanner
+from cm.services.autoscale_policies import ClusterLoad, get_policy
+from cm.util import instance_states, metrics, spot_states
 
 
 log = logging.getLogger('cloudman')
 
 
 class AutoscaleService(Service):
-    def __init__(self, app, as_min=-1, as_max=-1, instance_type=None):
+    def __init__(self, app, as_min=-1, as_max=-1, instance_type=None, clock=None):
+        """
+        :type clock: object
+        :param clock: Source of the current time, providing ``now`` and
+                      ``utcnow`` methods like ``datetime.datetime`` does (the
+                      default). Replaced with a virtual clock by the
+                      autoscaling simulator (see ``autoscale_simulator``).
+        """
         super(AutoscaleService, self).__init__(app)
         self.state = service_states.UNSTARTED
         self.svc_roles = [ServiceRole.AUTOSCALE]
@@ -18,6 +28,13 @@ class AutoscaleService(Service):
         self.as_max = as_max  # Max number of nodes autoscale should maintain
         self.as_min = as_min  # Min number of nodes autoscale should maintain
         self.instance_type = instance_type  # Type of instances to start
+        self.policy = get_policy()  # Decides how many instances to add
+        self.clock = clock or datetime.datetime
+        self.planner = ScaleDownPlanner(app, self.clock)  # Decides which instances to remove
+        # Instances whose CPU utilization (in percent) over the last couple of
+        # minutes is above this are not considered idle
+        self.busy_cpu = 25
+        self.worker_cpus = None  # Number of CPUs of the workers last seen ready
 
     def __repr__(self):
         return "Autoscale"
@@ -30,8 +47,12 @@ class AutoscaleService(Service):
             if self.as_min > -1 and self.as_max > -1:
                 if self.instance_type is None or self.instance_type == '':
                     self.instance_type = self.app.cloud_interface.get_type()
-                log.debug("Turning autoscaling ON; using instances of type '%s'" %
-                          self.instance_type)
+                self.policy = get_policy(self.app.config.get('autoscale_policy'))
+                self.planner = ScaleDownPlanner(
+                    self.app, self.clock,
+                    self.app.config.get('billing_granularity') or 'hour')
+                log.debug("Turning autoscaling ON; using instances of type '%s', "
+                          "policy %s and %s" % (self.instance_type, self.policy, self.planner))
                 self.state = service_states.RUNNING
             else:
                 log.debug("Cannot start autoscaling because limits are not set (min: '%s' max: '%s')" % (
@@ -40,6 +61,7 @@ class AutoscaleService(Service):
     def remove(self, synchronous=False):
         log.info("Removing '%s' service" % self.name)
         super(AutoscaleService, self).remove(synchronous)
+        self.planner.cancel()
         self.as_max = -1
         self.as_min = -1
         self.state = service_states.UNSTARTED
@@ -52,53 +74,60 @@ class AutoscaleService(Service):
             log.debug(
                 "Autoscaling DOWN: %s instance(s)" % num_instances_to_remove)
             self.app.manager.remove_instances(num_instances_to_remove)
-        elif self.too_small():
-            num_instances_to_add = self.get_num_instances_to_add()
-            log.debug("Autoscaling UP: %s instance(s)" % num_instances_to_add)
-            self.app.manager.add_instances(
-                num_instances_to_add, instance_type=self.instance_type)
+        else:
+            load = self.get_cluster_load()
+            if load.pending_slots > 0 and self.planner.draining:
+                # Put the draining instances back to work before adding any
+                log.debug("Autoscaling: reclaimed %s draining instance(s)" %
+                          self.planner.cancel())
+            if self.too_small(load):
+                num_instances_to_add = self.get_num_instances_to_add(load)
+                if num_instances_to_add > 0:
+                    log.debug("Autoscaling UP: %s instance(s)" % num_instances_to_add)
+                    self.app.manager.add_instances(
+                        num_instances_to_add, instance_type=self.instance_type)
+            elif load.pending_slots == 0:
+                # Drain and eventually remove idle instances, leaving at least self.as_min
+                num_terminated = self.planner.step(
+                    self.get_idle_instances(),
+                    len(self.app.manager.worker_instances) - int(self.as_min))
+                if num_terminated:
+                    log.debug("Autoscaling DOWN: %s instance(s)" % num_terminated)
 
     def too_large(self):
-        """Check if the current size of the cluster is too large.
-           The following checks are included:
-               - number of nodes is more than the max size of the cluster set by user
-               - there are idle nodes and a new hour is about to begin (so not to get charged for the new hour)
+        """Check if the current size of the cluster is too large, i.e., the
+           number of nodes is more than the max size of the cluster set by user.
+           Idle nodes in a cluster within its limits are scaled down by the
+           billing-aware planner (see ``ScaleDownPlanner``) instead.
         """
         # log.debug("Checking if cluster is too LARGE")
         if len(self.app.manager.worker_instances) > self.as_max:
             log.debug("Cluster is too explicitly large")
             return True
-        elif int(datetime.datetime.utcnow().strftime("%M")) > 57 and \
-            len(self.app.manager.worker_instances) > self.as_min and \
-                self.get_num_instances_to_remove() > 0:
-            # len(self.app.manager.get_idle_instances()) > 0 and \
-            log.debug("Cluster is too large")
-            return True
         return False
 
-    def too_small(self):
+    def too_small(self, load=None):
         """Check if the current size of the cluster is too small.
            The following checks are included:
                - number of nodes is less than the min size of the cluster set by user
-               - minute in the current hour is less than 54 (this is to ensure down-scaling and up-scaling don't conflict)
-               - there are no idle resources, jobs are queued and job turnaround time is slow
+               - number of nodes is less than the max size of the cluster set by user
+                 and the scaling policy asks for more nodes given the current
+                 cluster load (``load``, see ``get_cluster_load``)
         """
-        log.debug("Checking if cluster too SMALL: minute:%s,idle:%s,total workers:%s,avail workers:%s,min:%s,max:%s" %
-                  (datetime.datetime.utcnow().strftime("%M"),
-                   len(self.app.manager.get_idle_instances()),
-                   len(self.app.manager.worker_instances),
-                   self.app.manager.get_num_available_workers(), self.as_min,
-                   self.as_max))
-
-        if len(self.app.manager.worker_instances) < self.as_min:
-            return True
-        elif int(datetime.datetime.utcnow().strftime("%M")) < 55 and \
-            len(self.app.manager.get_idle_instances()) == 0 and \
-            len(self.app.manager.worker_instances) < self.as_max and \
-            len(self.app.manager.worker_instances) == self.app.manager.get_num_available_workers() and \
-                self.slow_job_turnover():
+        num_workers = len(self.app.manager.worker_instances)
+        if num_workers < self.as_min:
             return True
-        return False
+        elif num_workers >= self.as_max:
+            return False
+        if load is None:
+            load = self.get_cluster_load()
+        log.debug("Checking if cluster too SMALL: pending slots:%s, running slots:%s, "
+                  "mean runtime:%s, total workers:%s, ready workers:%s, in-flight "
+                  "workers:%s, CPU utilization:%s, min:%s, max:%s" %
+                  (load.pending_slots, load.running_slots, load.mean_runtime,
+                   load.num_workers, load.num_ready, load.num_in_flight,
+                   load.cpu_utilization, self.as_min, self.as_max))
+        return self.policy.num_to_add(load) > 0
 
     # *************** Helper methods ***************
     def slow_job_turnover(self, threshold=60, num_queued_jobs=2):
@@ -123,31 +152,103 @@ class AutoscaleService(Service):
             return True
         return False
 
-    def get_queue_jobs(self):
+    def get_jobs(self):
+        """Return a list of the jobs currently registered with all the active
+           job managers (see ``BaseJobManager.jobs``).
+        """
+        jobs = []
+        for job_manager_svc in self.app.manager.service_registry.active(
+                service_role=ServiceRole.JOB_MANAGER):
+            jobs.extend(job_manager_svc.jobs())
+        # log.debug("Autoscaling jobs: {0}".format(jobs))
+        return jobs
+
+    def get_queue_jobs(self, jobs=None):
         """Query job manager queue and filter running and queued jobs. Then, calculate total
            time in the queue (running or queued) for each of the jobs. Return a dict
            with two keys 'running' and 'queued' where each key corresponds to a list
            of queued times (in seconds) for running and queued jobs, respectively.
            For example: {'running': [169147, 149527], 'queued': [167525, 167512]}
+           If provided, ``jobs`` are used instead of querying the job managers.
         """
         running_jobs = []
         queued_jobs = []
-        for job_manager_svc in self.app.manager.service_registry.active(
-                service_role=ServiceRole.JOB_MANAGER):
-            jobs = job_manager_svc.jobs()
-            # log.debug("Autoscaling jobs: {0}".format(jobs))
-            for job in jobs:
-                now = datetime.datetime.now()
-                if job.get('job_state') == 'running':
-                    time_job_entered_state = job.get('time_job_entered_state',
-                                                     datetime.datetime.now())
-                    running_jobs.append(self.total_seconds(now - time_job_entered_state))
-                elif job.get('job_state') == 'pending':
-                    time_job_entered_state = job.get('time_job_entered_state',
-                                                     datetime.datetime.now)
-                    queued_jobs.append(self.total_seconds(now - time_job_entered_state))
+        if jobs is None:
+            jobs = self.get_jobs()
+        now = self.clock.now()
+        for job in jobs:
+            time_job_entered_state = job.get('time_job_entered_state') or now
+            if job.get('job_state') == 'running':
+                running_jobs.append(self.total_seconds(now - time_job_entered_state))
+            elif job.get('job_state') == 'pending':
+                queued_jobs.append(self.total_seconds(now - time_job_entered_state))
         return {'running': running_jobs, 'queued': queued_jobs}
 
+    def get_idle_instances(self):
+        """Return the worker instances the job managers report as idle, except
+           for the ones that have been busy (judging by their recent CPU
+           utilization, see ``cm.util.metrics``) doing work outside of the
+           job managers' control.
+        """
+        idle = []
+        for inst in self.app.manager.get_idle_instances():
+            cpu = metrics.node_metrics.mean(inst.id, 'cpu', 120)
+            if cpu is not None and cpu > self.busy_cpu:
+                log.debug("Instance %s is idle but busy (CPU: %.1f%%); not removing it"
+                          % (inst.get_desc(), cpu))
+                continue
+            idle.append(inst)
+        return idle
+
+    def get_in_flight_instances(self):
+        """Return a list of worker instances that have been requested but are not
+           yet ready to run jobs (e.g., pending instances or open spot requests).
+        """
+        in_flight = []
+        for inst in self.app.manager.worker_instances:
+            if inst.worker_status in ('Ready', 'Stopping', 'Error', spot_states.CANCELLED):
+                continue
+            if inst.m_state in (instance_states.SHUTTING_DOWN, instance_states.TERMINATED,
+                                instance_states.ERROR):
+                continue
+            in_flight.append(inst)
+        return in_flight
+
+    def get_cluster_load(self):
+        """Return a ``ClusterLoad`` object describing the current demand for job
+           slots (from the job managers) and the supply of worker instances.
+        """
+        jobs = self.get_jobs()
+        pending_slots = running_slots = 0
+        for job in jobs:
+            if job.get('job_state') == 'pending':
+                pending_slots += job.get('job_slots') or 1
+            elif job.get('job_state') == 'running':
+                running_slots += job.get('job_slots') or 1
+        q_jobs = self.get_queue_jobs(jobs)
+        r_jobs_mean, r_jobs_stdv = self.meanstdv(q_jobs['running'])
+        workers = self.app.manager.worker_instances
+        ready = [w for w in workers if w.worker_status == 'Ready']
+        # Worker CPUs are reported with the ALIVE messages so only look at the
+        # ready ones; assume new instances will be alike
+        cpus = [w.num_cpus for w in ready if w.num_cpus]
+        if cpus:
+            self.worker_cpus = int(round(sum(cpus) / float(len(cpus))))
+        # Until a worker has reported, assume workers are like the master
+        # (they are started from its image and, by default, instance type)
+        cpus_per_node = self.worker_cpus or self.app.manager.num_cpus
+        cpu_utils = [u for u in [metrics.node_metrics.mean(w.id, 'cpu', 300) for w in ready]
+                     if u is not None]
+        return ClusterLoad(pending_slots=pending_slots,
+                           running_slots=running_slots,
+                           mean_runtime=r_jobs_mean,
+                           cpus_per_node=cpus_per_node,
+                           num_workers=len(workers),
+                           num_ready=len(ready),
+                           num_in_flight=len(self.get_in_flight_instances()),
+                           cpu_utilization=(sum(cpu_utils) / len(cpu_utils)
+                                            if cpu_utils else None))
+
     def get_num_instances_to_remove(self):
         """Return the number of instance to remove during auto-DOWN-scaling.
            The function returns the number of idle instances while respecting
@@ -164,17 +265,22 @@ class AutoscaleService(Service):
                 self.app.manager.worker_instances) - int(self.as_min)
         return num_instances_to_remove
 
-    def get_num_instances_to_add(self):
+    def get_num_instances_to_add(self, load=None):
         """Return the number of instance to add during auto-UP-scaling.
-           The function returns 1 unless the number of instances autoscaling should
-           maintain is less then the current number of instances. In that case, it
-           returns the difference."""
-        num_instances_to_add = 1  # Add one instance at a time for now
-        if len(self.app.manager.worker_instances) + num_instances_to_add < self.as_min:
-            num_instances_to_add = int(
-                self.as_min) - len(self.app.manager.worker_instances)
-        elif len(self.app.manager.worker_instances) + num_instances_to_add > self.as_max:
-            num_instances_to_add = 0  # Already at as_max
+           The function returns the number of instances the scaling policy asks
+           for given the current cluster ``load``, while respecting the min and
+           max number of instances that autoscaling should maintain. Instances
+           that have been requested but are not ready yet count toward the
+           limits."""
+        num_workers = len(self.app.manager.worker_instances)
+        if num_workers < self.as_min:
+            num_instances_to_add = int(self.as_min) - num_workers
+        else:
+            if load is None:
+                load = self.get_cluster_load()
+            num_instances_to_add = self.policy.num_to_add(load)
+        if num_workers + num_instances_to_add > self.as_max:
+            num_instances_to_add = max(0, int(self.as_max) - num_workers)
         return num_instances_to_add
 
     def total_seconds(self, td):
@@ -194,4 +300,5 @@ class AutoscaleService(Service):
         return mean, std
 
     def __str__(self):
-        return "Autoscaling limits min: %s max: %s; instance type: '%s'" % (self.as_min, self.as_max, self.instance_type)
+        return "Autoscaling limits min: %s max: %s; instance type: '%s'; policy: %s; %s" % (
+            self.as_min, self.as_max, self.instance_type, self.policy, self.planner)
@@ -0,0 +1,166 @@
+"""
+Billing-aware scale-down for the ``Autoscale`` service.
+
+Idle worker instances are not terminated right away. Instead, the planner
+picks the ones that are about to cost money (i.e., whose already paid-for
+billing period is running out) and drains them in the job manager so no new
+jobs get scheduled on them. A drained instance is terminated only once it has
+been confirmed idle for a grace period; if jobs show up in the meantime, the
+draining instances are put back to work.
+
+The billing granularity of the cloud is set via user data using the
+``billing_granularity`` key; one of ``second``, ``minute`` or ``hour``
+(default).
+"""
+import math
+
+from cm.services import ServiceRole
+
+import logging
+log = logging.getLogger('cloudman')
+
+BILLING_GRANULARITIES = {'second': 1, 'minute': 60, 'hour': 3600}
+DEFAULT_BILLING_GRANULARITY = 'hour'
+
+
+def total_seconds(td):
+    return td.seconds + td.days * 24 * 3600
+
+
+class ScaleDownPlanner(object):
+
+    def __init__(self, app, clock, granularity=DEFAULT_BILLING_GRANULARITY,
+                 min_billed=60, idle_grace=120, drain_grace=60, window=300):
+        """
+        :type clock: object
+        :param clock: Source of the current time (see ``AutoscaleService``).
+
+        :type granularity: string
+        :param granularity: Unit of billing; one of ``BILLING_GRANULARITIES``.
+
+        :type min_billed: int
+        :param min_billed: Minimum number of seconds an instance is billed for.
+
+        :type idle_grace: int
+        :param idle_grace: Number of seconds an instance must have been idle
+                           for before it is considered for removal.
+
+        :type drain_grace: int
+        :param drain_grace: Number of seconds a draining instance must be
+                            confirmed idle for before it is terminated.
+
+        :type window: int
+        :param window: Look-ahead (in seconds) used when computing the cost of
+                       keeping an instance; should cover the time it takes to
+                       drain and terminate an instance.
+        """
+        self.app = app
+        self.clock = clock
+        if granularity not in BILLING_GRANULARITIES:
+            log.warning("Unknown billing granularity '{0}'; using '{1}'"
+                        .format(granularity, DEFAULT_BILLING_GRANULARITY))
+            granularity = DEFAULT_BILLING_GRANULARITY
+        self.granularity = granularity
+        self.unit = BILLING_GRANULARITIES[granularity]
+        self.min_billed = min_billed
+        self.idle_grace = idle_grace
+        self.drain_grace = drain_grace
+        self.window = max(window, drain_grace)
+        self.idle_since = {}  # Instance ID: time the instance was first seen idle
+        self.draining = {}  # Instance ID: time draining the instance started
+
+    def __repr__(self):
+        return "ScaleDownPlanner(billing: {0})".format(self.granularity)
+
+    def prepaid_seconds(self, inst, now):
+        """
+        Return the number of seconds left in the billing period ``inst`` has
+        already been charged for.
+        """
+        elapsed = max(0, total_seconds(now - inst.get_launch_time()))
+        billed = max(self.min_billed, math.ceil(elapsed / float(self.unit)) * self.unit)
+        return billed - elapsed
+
+    def cost_to_keep(self, inst, now):
+        """
+        Return the number of seconds ``inst`` would newly be charged for if
+        it is kept for another ``self.window`` seconds.
+        """
+        extra = self.window - self.prepaid_seconds(inst, now)
+        if extra <= 0:
+            return 0
+        return math.ceil(extra / float(self.unit)) * self.unit
+
+    def _job_managers(self):
+        return self.app.manager.service_registry.active(service_role=ServiceRole.JOB_MANAGER)
+
+    def _address(self, inst):
+        return inst.local_hostname or getattr(inst, 'private_ip', None)
+
+    def drain(self, inst, now):
+        log.debug("Draining instance {0} ahead of termination".format(inst.get_desc()))
+        for job_manager_svc in self._job_managers():
+            job_manager_svc.drain_node(inst.alias, self._address(inst))
+        self.draining[inst.id] = now
+
+    def cancel(self):
+        """
+        Put all the draining instances back to work. Return the number of
+        instances that were draining.
+        """
+        workers = dict([(w.id, w) for w in self.app.manager.worker_instances])
+        for inst_id in self.draining.keys():
+            inst = workers.get(inst_id)
+            if inst:
+                log.debug("Undraining instance {0}".format(inst.get_desc()))
+                for job_manager_svc in self._job_managers():
+                    job_manager_svc.undrain_node(inst.alias, self._address(inst))
+        num_draining = len(self.draining)
+        self.draining.clear()
+        return num_draining
+
+    def step(self, idle_instances, num_removable):
+        """
+        Advance the scale-down plan: terminate the draining instances that
+        have been confirmed idle and start draining the idle instances that
+        are about to cost the most to keep. No more than ``num_removable``
+        instances are removed or draining at any time.
+
+        :type idle_instances: list
+        :param idle_instances: Worker instances that are not running any jobs.
+
+        :rtype: int
+        :return: The number of instances whose termination was initiated.
+        """
+        now = self.clock.utcnow()
+        idle = dict([(i.id, i) for i in idle_instances])
+        for inst_id in self.idle_since.keys():
+            if inst_id not in idle:
+                del self.idle_since[inst_id]
+        for inst_id in idle:
+            self.idle_since.setdefault(inst_id, now)
+        workers = set([w.id for w in self.app.manager.worker_instances])
+        num_terminated = 0
+        for inst_id, started in sorted(self.draining.items(), key=lambda d: d[1]):
+            if inst_id not in workers:
+                del self.draining[inst_id]
+            elif inst_id in idle and num_terminated < num_removable and \
+                    total_seconds(now - max(started, self.idle_since[inst_id])) >= self.drain_grace:
+                log.info("Terminating drained instance {0}".format(idle[inst_id].get_desc()))
+                del self.draining[inst_id]
+                self.app.manager.remove_instance(inst_id)
+                num_terminated += 1
+        num_to_drain = num_removable - num_terminated - len(self.draining)
+        if num_to_drain <= 0:
+            return num_terminated
+        candidates = []
+        for inst_id, inst in idle.iteritems():
+            if inst_id in self.draining or \
+                    total_seconds(now - self.idle_since[inst_id]) < self.idle_grace:
+                continue
+            cost = self.cost_to_keep(inst, now)
+            if cost > 0:
+                candidates.append((-cost, self.idle_since[inst_id], inst_id))
+        for cost, idle_since, inst_id in sorted(candidates)[:num_to_drain]:
+            self.drain(idle[inst_id], now)
+        return num_terminated
@@ -0,0 +1,181 @@
+"""
+Scaling policies used by the ``Autoscale`` service to decide how many worker
+instances to add to the cluster in a single scaling decision.
+
+Each policy is given a snapshot of the cluster load (see ``ClusterLoad``) and
+returns the number of instances it would like added, irrespective of the
+autoscaling limits; the ``Autoscale`` service enforces ``as_min``/``as_max``.
+
+A policy is chosen via user data using the ``autoscale_policy`` key, either
+just by name or with its parameters, for example::
+
+    autoscale_policy: proportional
+
+    autoscale_policy:
+      name: step
+      steps: [[1, 1], [20, 2], [100, 5], [500, 20]]
+"""
+import math
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+
+class ClusterLoad(Bunch):
+    """
+    A snapshot of the demand for and the supply of job slots in the cluster.
+    The following fields are defined:
+
+        - ``pending_slots``: number of slots requested by the queued jobs
+        - ``running_slots``: number of slots used by the running jobs
+        - ``mean_runtime``: mean time (in seconds) the running jobs have been
+          running for, or ``0`` if there are no running jobs
+        - ``cpus_per_node``: number of CPUs (i.e., job slots) of a worker
+        - ``num_workers``: number of worker instances, including the ones
+          counted in ``num_in_flight``
+        - ``num_ready``: number of workers that are ready to run jobs
+        - ``num_in_flight``: number of workers that have been requested but are
+          not ready yet (e.g., pending instances, open spot requests)
+        - ``cpu_utilization``: mean CPU utilization (in percent) of the ready
+          workers over the last few minutes, or ``None`` if not known
+    """
+    def __init__(self, **kwargs):
+        defaults = dict(pending_slots=0, running_slots=0, mean_runtime=0,
+                        cpus_per_node=1, num_workers=0, num_ready=0,
+                        num_in_flight=0, cpu_utilization=None)
+        defaults.update(kwargs)
+        super(ClusterLoad, self).__init__(**defaults)
+
+
+class ScalingPolicy(object):
+    """
+    Base class for the scaling policies.
+
+    :type boot_time: int
+    :param boot_time: Expected number of seconds between requesting an
+                      instance and the instance being ready to run jobs.
+    """
+    name = None
+
+    def __init__(self, boot_time=300):
+        self.boot_time = boot_time
+
+    def __repr__(self):
+        return "{0}({1})".format(self.__class__.__name__, self.name)
+
+    def backlog(self, load):
+        """
+        Return the number of pending slots that will not be served by the
+        current or the in-flight workers. The slots free on the ready workers
+        (e.g., jobs that are about to be dispatched) and the jobs that the
+        busy slots are expected to get through during the time it takes to
+        boot a new instance are not counted. ``mean_runtime`` is how long the running
+        jobs have been running so far, not how long they take, so jobs are
+        assumed to take at least ``boot_time`` (i.e., each ready slot frees
+        up at most once while a new instance boots); otherwise, jobs that
+        have only just started would cancel out the whole backlog.
+        """
+        ready_slots = load.num_ready * load.cpus_per_node
+        idle_slots = max(0, ready_slots - load.running_slots)
+        slots = load.pending_slots - idle_slots
+        if load.mean_runtime > 0:
+            busy_slots = ready_slots - idle_slots
+            runtime = max(float(load.mean_runtime), self.boot_time)
+            slots -= int(busy_slots * self.boot_time / runtime)
+        slots -= load.num_in_flight * load.cpus_per_node
+        return max(0, slots)
+
+    def num_to_add(self, load):
+        """
+        Return the number of instances to add given ``load`` (a
+        ``ClusterLoad`` object).
+        """
+        raise NotImplementedError()
+
+
+class ProportionalPolicy(ScalingPolicy):
+    """
+    Add enough instances to run all the backlogged jobs at once, optionally
+    scaled by ``factor``.
+    """
+    name = 'proportional'
+
+    def __init__(self, factor=1.0, **kwargs):
+        super(ProportionalPolicy, self).__init__(**kwargs)
+        self.factor = float(factor)
+
+    def num_to_add(self, load):
+        return int(math.ceil(self.backlog(load) * self.factor /
+                             max(1, load.cpus_per_node)))
+
+
+class TargetUtilizationPolicy(ScalingPolicy):
+    """
+    Size the cluster so the demanded slots (running and pending) make up
+    ``target`` (a fraction) of the available slots.
+    """
+    name = 'target-utilization'
+
+    def __init__(self, target=0.8, **kwargs):
+        super(TargetUtilizationPolicy, self).__init__(**kwargs)
+        self.target = min(1.0, max(0.01, float(target)))
+
+    def num_to_add(self, load):
+        demand = load.running_slots + load.pending_slots
+        if load.pending_slots == 0:
+            return 0
+        wanted = int(math.ceil(demand / (max(1, load.cpus_per_node) * self.target)))
+        return max(0, wanted - load.num_workers)
+
+
+class StepPolicy(ScalingPolicy):
+    """
+    Add a fixed number of instances depending on the size of the backlog.
+    ``steps`` is a list of ``(backlog_slots, num_instances)`` pairs; the pair
+    with the largest ``backlog_slots`` not exceeding the current backlog wins.
+    """
+    name = 'step'
+    DEFAULT_STEPS = [(1, 1), (10, 2), (50, 5), (200, 10), (1000, 25)]
+
+    def __init__(self, steps=None, **kwargs):
+        super(StepPolicy, self).__init__(**kwargs)
+        self.steps = sorted([(int(s), int(n)) for s, n in (steps or self.DEFAULT_STEPS)])
+
+    def num_to_add(self, load):
+        backlog = self.backlog(load)
+        num = 0
+        for threshold, num_instances in self.steps:
+            if backlog >= threshold:
+                num = num_instances
+        return num
+
+
+POLICIES = dict([(p.name, p) for p in
+                 (ProportionalPolicy, TargetUtilizationPolicy, StepPolicy)])
+DEFAULT_POLICY = ProportionalPolicy.name
+
+
+def get_policy(config=None):
+    """
+    Return a policy object as described by ``config``: the name of a policy
+    or a dict with the policy ``name`` along with its parameters. Fall back on
+    the default policy if ``config`` is not set or is invalid.
+    """
+    if isinstance(config, dict):
+        params = dict(config)
+        name = params.pop('name', DEFAULT_POLICY)
+    else:
+        name, params = config or DEFAULT_POLICY, {}
+    policy_class = POLICIES.get(name)
+    if policy_class is None:
+        log.warning("Unknown autoscaling policy '{0}'; using '{1}'"
+                    .format(name, DEFAULT_POLICY))
+        policy_class, params = POLICIES[DEFAULT_POLICY], {}
+    try:
+        return policy_class(**params)
+    except (TypeError, ValueError), e:
+        log.warning("Invalid parameters for autoscaling policy '{0}' ({1}): {2}"
+                    .format(name, params, e))
+        return policy_class()
@@ -0,0 +1,446 @@
+"""
+Offline trace-replay simulator for the ``Autoscale`` service.
+
+The simulator drives an unmodified ``AutoscaleService`` with a virtual clock,
+a job manager that replays a job trace and a cloud that boots instances after
+a configurable latency. Because everything runs on virtual time, simulating a
+day long trace takes seconds and yields the same result every time, so changes
+to the scaling logic can be benchmarked in CI.
+
+A trace is a CSV file with a header and one job per line. Recognized columns
+are ``submit``, ``start``, ``end``, ``runtime`` and ``slots``; times are in
+seconds (absolute or relative to the first submission). If ``runtime`` is not
+given, it is computed as ``end - start``. For example::
+
+    submit,start,end,slots
+    0,0,600,1
+    5,610,1200,4
+
+Run the simulator from the command line as follows (see ``--help``)::
+
+    python scripts/simulate_autoscaling.py trace.csv --policy step --max 20
+"""
+import collections
+import csv
+import datetime
+import heapq
+import itertools
+import math
+import optparse
+
+from cm.clouds.dummy import DummyInterface
+from cm.services import ServiceRole, ServiceType
+from cm.services.autoscale import AutoscaleService
+from cm.services.registry import ServiceRegistry
+from cm.util import instance_lifecycle, instance_states
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+
+class VirtualClock(object):
+    """
+    A clock that only moves when told to. Provides the ``now`` and ``utcnow``
+    methods of ``datetime.datetime`` (both return the same value).
+    """
+    def __init__(self, start=datetime.datetime(2014, 1, 1)):
+        self.start = start
+        self.time = 0.0  # Seconds since ``self.start``
+
+    def now(self):
+        return self.start + datetime.timedelta(seconds=self.time)
+
+    utcnow = now
+
+    def advance_to(self, time):
+        self.time = max(self.time, time)
+
+
+class TraceJob(object):
+
+    def __init__(self, job_id, submit, runtime, slots=1):
+        self.job_id = job_id
+        self.submit = submit
+        self.runtime = runtime
+        self.slots = slots
+        self.start = None
+        self.end = None
+        self.node = None
+
+
+def load_trace(path):
+    """
+    Load the job trace from the CSV file at ``path`` and return a list of
+    ``TraceJob`` objects, ordered by submit time which starts at ``0``.
+    """
+    jobs = []
+    with open(path) as f:
+        for i, row in enumerate(csv.DictReader(f)):
+            submit = float(row['submit'])
+            if row.get('runtime'):
+                runtime = float(row['runtime'])
+            else:
+                runtime = float(row['end']) - float(row['start'])
+            jobs.append(TraceJob(i, submit, max(0.0, runtime), int(row.get('slots') or 1)))
+    jobs.sort(key=lambda j: (j.submit, j.job_id))
+    if jobs:
+        first = jobs[0].submit
+        for job in jobs:
+            job.submit -= first
+    return jobs
+
+
+class SimulatedInstance(object):
+    """
+    Stands in for ``cm.instance.Instance``.
+    """
+    def __init__(self, instance_id, num_cpus, clock):
+        self.id = instance_id
+        self.alias = 'w{0}'.format(instance_id)
+        self.local_hostname = self.alias
+        self.private_ip = None
+        self.num_cpus = num_cpus
+        self.lifecycle = instance_lifecycle.ONDEMAND
+        self.spot_state = None
+        self.m_state = instance_states.PENDING
+        self.worker_status = 'Pending'
+        self.launch_time = clock.time
+        self.launch_datetime = clock.now()
+        self.ready_time = None
+        self.terminate_time = None
+
+    def get_launch_time(self):
+        return self.launch_datetime
+
+    def is_spot(self):
+        return self.lifecycle == instance_lifecycle.SPOT
+
+    def spot_was_filled(self):
+        return False
+
+    def get_desc(self):
+        return self.alias
+
+
+class SimulatedJobManager(object):
+    """
+    Stands in for a job manager service (e.g., ``SGEService``): submits the
+    trace jobs as the virtual time passes and runs them first-come,
+    first-served on the ready worker instances.
+    """
+    def __init__(self, clock, trace, manager):
+        self.clock = clock
+        self.manager = manager
+        self.name = 'SimulatedJobManager'
+        self.svc_roles = [ServiceRole.JOB_MANAGER]
+        self.svc_type = ServiceType.APPLICATION
+        self.activated = True
+        self.unsubmitted = list(reversed(trace))
+        self.queued = collections.deque()
+        self.running = []  # Heap of (end time, job ID, job)
+        self.finished = []
+        self.free_slots = {}  # alias: number of free slots
+        self.total_slots = {}  # alias: number of slots
+        self.disabled = set()  # Aliases of the nodes not accepting new jobs
+
+    def next_event_time(self):
+        times = []
+        if self.unsubmitted:
+            times.append(self.unsubmitted[-1].submit)
+        if self.running:
+            times.append(self.running[0][0])
+        return min(times) if times else None
+
+    def done(self):
+        return not (self.unsubmitted or self.queued or self.running)
+
+    def step(self):
+        now = self.clock.time
+        while self.running and self.running[0][0] <= now:
+            job = heapq.heappop(self.running)[2]
+            if job.node in self.free_slots:
+                self.free_slots[job.node] += job.slots
+            self.finished.append(job)
+        while self.unsubmitted and self.unsubmitted[-1].submit <= now:
+            self.queued.append(self.unsubmitted.pop())
+        for inst in self.manager.worker_instances:
+            if inst.worker_status == 'Ready' and inst.alias not in self.free_slots:
+                self.free_slots[inst.alias] = self.total_slots[inst.alias] = inst.num_cpus
+        # Strict FIFO: stop at the first job that does not fit anywhere
+        while self.queued:
+            job = self.queued[0]
+            node = self._find_node(job.slots)
+            if node is None:
+                break
+            self.queued.popleft()
+            self.free_slots[node] -= job.slots
+            job.node, job.start, job.end = node, now, now + job.runtime
+            heapq.heappush(self.running, (job.end, job.job_id, job))
+
+    def _find_node(self, slots):
+        for alias in sorted(self.free_slots):
+            if alias not in self.disabled and self.free_slots[alias] >= slots:
+                return alias
+        return None
+
+    # Job manager interface used by the autoscaler and the manager
+    def jobs(self):
+        jobs = []
+        for end, job_id, job in self.running:
+            jobs.append({'job_state': 'running', 'job_slots': job.slots,
+                         'time_job_entered_state':
+                         self.clock.start + datetime.timedelta(seconds=job.start)})
+        for job in self.queued:
+            jobs.append({'job_state': 'pending', 'job_slots': job.slots,
+                         'time_job_entered_state':
+                         self.clock.start + datetime.timedelta(seconds=job.submit)})
+        return jobs
+
+    def idle_nodes(self):
+        return [alias for alias, free in self.free_slots.iteritems()
+                if free == self.total_slots[alias]]
+
+    def enable_node(self, alias, address):
+        self.disabled.discard(alias)
+        return True
+
+    def disable_node(self, alias, address, **kwargs):
+        self.disabled.add(alias)
+        return True
+
+    drain_node = disable_node
+    undrain_node = enable_node
+
+    def remove_node(self, instance):
+        self.free_slots.pop(instance.alias, None)
+        self.total_slots.pop(instance.alias, None)
+        self.disabled.discard(instance.alias)
+        return True
+
+
+class SimulatedCloud(DummyInterface):
+    """
+    A dummy cloud interface whose instances become ready to run jobs
+    ``boot_latency`` seconds after they were requested.
+    """
+    def __init__(self, app, clock, boot_latency=300, cpus_per_node=4):
+        super(SimulatedCloud, self).__init__(app)
+        self.clock = clock
+        self.boot_latency = boot_latency
+        self.cpus_per_node = cpus_per_node
+        self.user_data = {}
+        self.ids = itertools.count(1)
+        self.booting = []
+
+    def get_type(self):
+        return 'simulated'
+
+    def run_instances(self, num, instance_type, spot_price=None, **kwargs):
+        for i in range(num):
+            inst = SimulatedInstance(next(self.ids), self.cpus_per_node, self.clock)
+            inst.ready_time = self.clock.time + self.boot_latency
+            self.app.manager.worker_instances.append(inst)
+            self.booting.append(inst)
+            self.app.manager.launched.append(inst)
+
+    def next_event_time(self):
+        return min([i.ready_time for i in self.booting]) if self.booting else None
+
+    def step(self):
+        for inst in list(self.booting):
+            if inst.terminate_time is not None:
+                self.booting.remove(inst)
+            elif inst.ready_time <= self.clock.time:
+                inst.m_state = instance_states.RUNNING
+                inst.worker_status = 'Ready'
+                self.booting.remove(inst)
+
+
+class SimulatedManager(object):
+    """
+    Stands in for ``cm.master.ConsoleManager``, implementing the methods the
+    ``Autoscale`` service relies on.
+    """
+    def __init__(self, app, num_cpus=1):
+        self.app = app
+        self.num_cpus = num_cpus  # Of the master; the workers are alike
+        self.worker_instances = []
+        self.launched = []
+        self.terminated = []
+        self.service_registry = ServiceRegistry(app)
+
+    def get_idle_instances(self):
+        idle_instances = []
+        for job_manager_svc in self.service_registry.active(
+                service_role=ServiceRole.JOB_MANAGER):
+            idle_nodes = job_manager_svc.idle_nodes()
+            for w in self.worker_instances:
+                if w.alias in idle_nodes:
+                    idle_instances.append(w)
+        return idle_instances
+
+    def get_num_available_workers(self):
+        return len([w for w in self.worker_instances if w.worker_status == 'Ready'])
+
+    def add_instances(self, num_nodes, instance_type='', spot_price=None):
+        self.app.cloud_interface.run_instances(num=num_nodes, instance_type=instance_type,
+                                               spot_price=spot_price)
+
+    def remove_instances(self, num_nodes, force=False):
+        for inst in self.get_idle_instances()[:num_nodes]:
+            self.remove_instance(inst.id)
+
+    def remove_instance(self, instance_id=''):
+        for inst in list(self.worker_instances):
+            if inst.id == instance_id:
+                for job_manager_svc in self.service_registry.active(
+                        service_role=ServiceRole.JOB_MANAGER):
+                    job_manager_svc.remove_node(inst)
+                inst.worker_status = 'Stopping'
+                inst.m_state = instance_states.TERMINATED
+                inst.terminate_time = self.app.clock.time
+                self.worker_instances.remove(inst)
+                self.terminated.append(inst)
+
+
+class Simulation(object):
+    """
+    Replay ``trace`` (a list of ``TraceJob`` objects) on a simulated cluster
+    scaled by the ``Autoscale`` service.
+
+    :type policy: string or dict
+    :param policy: Scaling policy configuration, as accepted by the
+                   ``autoscale_policy`` user data key.
+
+    :type interval: int
+    :param interval: Number of seconds between two consecutive autoscaling
+                     decisions (i.e., calls to the service's ``status``).
+
+    :type drain_time: int
+    :param drain_time: Once all the jobs are done, keep simulating for up to
+                       this many seconds while the cluster shrinks back to
+                       ``as_min``.
+
+    :type max_time: int
+    :param max_time: Stop the simulation after this many (virtual) seconds
+                     even if not all the jobs have run.
+    """
+    def __init__(self, trace, policy=None, as_min=0, as_max=20, boot_latency=300,
+                 cpus_per_node=4, interval=10, drain_time=2 * 3600,
+                 max_time=30 * 24 * 3600, billing_granularity='hour'):
+        self.trace = trace
+        self.interval = interval
+        self.drain_time = drain_time
+        self.max_time = max_time
+        self.clock = VirtualClock()
+        self.app = Bunch(clock=self.clock, config={'autoscale_policy': policy,
+                                                   'billing_granularity': billing_granularity})
+        self.app.manager = SimulatedManager(self.app, cpus_per_node)
+        self.app.cloud_interface = SimulatedCloud(self.app, self.clock, boot_latency,
+                                                  cpus_per_node)
+        for job in trace:
+            if job.slots > cpus_per_node:
+                log.warning("Job {0} asks for {1} slots; capping at {2}"
+                            .format(job.job_id, job.slots, cpus_per_node))
+                job.slots = cpus_per_node
+        self.job_manager = SimulatedJobManager(self.clock, trace, self.app.manager)
+        self.app.manager.service_registry.register(self.job_manager)
+        self.autoscale = AutoscaleService(self.app, as_min=as_min, as_max=as_max,
+                                          instance_type='simulated', clock=self.clock)
+        self.autoscale.start()
+
+    def run(self):
+        """
+        Run the simulation to completion and return the report (see
+        ``report``).
+        """
+        next_decision = 0
+        finished_at = None
+        while True:
+            self.app.cloud_interface.step()
+            self.job_manager.step()
+            if self.clock.time >= next_decision:
+                self.autoscale.status()
+                # Newly requested instances and freed slots may change things
+                self.job_manager.step()
+                next_decision = self.clock.time + self.interval
+            if self.job_manager.done():
+                if finished_at is None:
+                    finished_at = self.clock.time
+                if len(self.app.manager.worker_instances) <= self.autoscale.as_min or \
+                        self.clock.time - finished_at >= self.drain_time:
+                    break
+            elif self.clock.time >= self.max_time:
+                log.warning("Simulation stopped after {0} seconds with {1} jobs not done"
+                            .format(self.max_time, len(self.trace) - len(self.job_manager.finished)))
+                break
+            times = [t for t in (self.app.cloud_interface.next_event_time(),
+                                 self.job_manager.next_event_time(), next_decision)
+                     if t is not None]
+            self.clock.advance_to(min(times))
+        return self.report()
+
+    def report(self):
+        """
+        Return a dict with the simulation results:
+
+            - ``makespan``: seconds from the first job submission until the
+              last job finished
+            - ``mean_queue_wait``: mean number of seconds jobs spent queued
+            - ``node_hours``: hours of instance time, from the request to the
+              termination of each instance
+            - ``billed_node_hours``: hours of instance time charged for, given
+              the billing granularity (see ``autoscale_planner``)
+            - ``churn``: number of instances launched plus terminated
+        """
+        jobs = self.job_manager.finished
+        manager = self.app.manager
+        end = self.clock.time
+        planner = self.autoscale.planner
+        node_seconds = billed_seconds = 0
+        for inst in manager.launched:
+            seconds = (inst.terminate_time if inst.terminate_time is not None else end) - \
+                inst.launch_time
+            node_seconds += seconds
+            billed_seconds += max(planner.min_billed,
+                                  math.ceil(seconds / float(planner.unit)) * planner.unit)
+        return {'policy': self.autoscale.policy.name,
+                'jobs': len(jobs),
+                'makespan': max([j.end for j in jobs]) if jobs else 0,
+                'mean_queue_wait': (sum([j.start - j.submit for j in jobs]) / len(jobs)
+                                    if jobs else 0),
+                'node_hours': round(node_seconds / 3600.0, 2),
+                'billed_node_hours': round(billed_seconds / 3600.0, 2),
+                'launched': len(manager.launched),
+                'terminated': len(manager.terminated),
+                'churn': len(manager.launched) + len(manager.terminated)}
+
+
+def main():
+    parser = optparse.OptionParser(usage="%prog [options] trace.csv")
+    parser.add_option('-p', '--policy', action='append', dest='policies',
+                      help="Scaling policy to simulate; can be given multiple "
+                           "times to compare policies (default: all)")
+    parser.add_option('--min', type='int', default=0, help="Autoscaling min")
+    parser.add_option('--max', type='int', default=20, help="Autoscaling max")
+    parser.add_option('--boot-latency', type='int', default=300,
+                      help="Seconds for an instance to become ready")
+    parser.add_option('--cpus', type='int', default=4, help="CPUs per instance")
+    parser.add_option('--interval', type='int', default=10,
+                      help="Seconds between autoscaling decisions")
+    parser.add_option('--billing', default='hour',
+                      help="Billing granularity: second, minute or hour")
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error("A trace file is required")
+    from cm.services.autoscale_policies import POLICIES
+    columns = ['policy', 'jobs', 'makespan', 'mean_queue_wait', 'node_hours',
+               'billed_node_hours', 'churn']
+    print '\t'.join(columns)
+    for policy in options.policies or sorted(POLICIES):
+        report = Simulation(load_trace(args[0]), policy=policy, as_min=options.min,
+                            as_max=options.max, boot_latency=options.boot_latency,
+                            cpus_per_node=options.cpus, interval=options.interval,
+                            billing_granularity=options.billing).run()
+        print '\t'.join([str(report[c]) for c in columns])
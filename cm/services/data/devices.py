@@ -0,0 +1,158 @@
+"""
+Host-wide bookkeeping of block devices, allowing multiple volumes to be
+attached at the same time.
+
+``DeviceWatcher`` keeps track of the block devices visible to the system by
+scanning ``/sys/block`` from a single thread, and lets any number of threads
+wait for a device to show up. ``DeviceAllocator`` hands out the device names
+to attach volumes as, making sure no two concurrent attachments pick the same
+name.
+"""
+import os
+import re
+import threading
+import time
+from glob import glob
+
+import logging
+log = logging.getLogger('cloudman')
+
+SYS_BLOCK = '/sys/block'
+# Matches the devices volumes get attached as (e.g., sdf, xvdg, vdc)
+DEVICE_NAME_RE = re.compile(r'^[a-z]*d[a-z]$')
+DEVICE_BASES = ['/dev/vd', '/dev/xvd', '/dev/sd']
+
+
+def device_suffix(device):
+    """
+    Return the letter identifying ``device`` irrespective of the naming
+    scheme (e.g., ``f`` for each of ``/dev/sdf``, ``/dev/xvdf`` and
+    ``/dev/vdf``).
+    """
+    return device[-1] if device else None
+
+
+class DeviceWatcher(object):
+    """
+    Watch the block devices present on the system.
+    """
+    def __init__(self, interval=0.5):
+        self.interval = interval
+        self.cond = threading.Condition()
+        self.current = self.scan()
+        self.num_waiters = 0
+        self.thread = None
+
+    def scan(self):
+        """
+        Return a ``frozenset`` of the device paths (e.g., ``/dev/xvdf``)
+        currently known to the kernel.
+        """
+        if os.path.isdir(SYS_BLOCK):
+            return frozenset(['/dev/' + d for d in os.listdir(SYS_BLOCK)
+                              if DEVICE_NAME_RE.match(d)])
+        return frozenset(glob('/dev/*d[a-z]'))
+
+    def devices(self):
+        """
+        Return the set of devices as of the latest scan, scanning now if
+        nobody is currently watching.
+        """
+        with self.cond:
+            if self.num_waiters == 0:
+                self.current = self.scan()
+            return self.current
+
+    def wait_for(self, condition, timeout):
+        """
+        Wait up to ``timeout`` seconds for ``condition``, a callable receiving
+        the current set of devices, to return a true value. Return the last
+        value returned by ``condition``.
+        """
+        end_time = time.time() + timeout
+        with self.cond:
+            self.num_waiters += 1
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='DeviceWatcher')
+                self.thread.daemon = True
+                self.thread.start()
+            self.cond.notify_all()
+            try:
+                while True:
+                    result = condition(self.current)
+                    remaining = end_time - time.time()
+                    if result or remaining <= 0:
+                        return result
+                    self.cond.wait(remaining)
+            finally:
+                self.num_waiters -= 1
+
+    def _run(self):
+        while True:
+            with self.cond:
+                while self.num_waiters == 0:
+                    self.cond.wait()
+                devices = self.scan()
+                if devices != self.current:
+                    log.debug("Block devices changed; added: {0}; removed: {1}"
+                              .format(', '.join(devices - self.current) or '-',
+                                      ', '.join(self.current - devices) or '-'))
+                    self.current = devices
+                self.cond.notify_all()
+            time.sleep(self.interval)
+
+
+class DeviceAllocator(object):
+    """
+    Allocate device names for volumes being attached.
+    """
+    def __init__(self, watcher):
+        self.watcher = watcher
+        self.lock = threading.Lock()
+        self.reserved = {}  # device suffix: owner
+
+    def _pseudo_devices(self, devices):
+        """
+        Return ``devices`` extended with reserved device names, expressed in
+        each naming scheme that is in use on the system.
+        """
+        bases = set([b for b in DEVICE_BASES for d in devices if d.startswith(b)])
+        reserved = set([b + s for b in bases for s in self.reserved])
+        return frozenset(devices | reserved)
+
+    def reserve(self, owner, next_devices):
+        """
+        Pick and reserve the devices ``owner`` should attempt to attach as.
+
+        :type next_devices: callable
+        :param next_devices: Given a set of the devices in use, return a tuple
+                             of candidate devices (see
+                             ``Volume._get_likely_next_devices``).
+        """
+        devices = self.watcher.devices()
+        with self.lock:
+            candidates = next_devices(self._pseudo_devices(devices))
+            for device in candidates or []:
+                self.reserved.setdefault(device_suffix(device), owner)
+        log.debug("Reserved devices {0} for {1}".format(candidates, owner))
+        return candidates
+
+    def release(self, owner):
+        with self.lock:
+            for suffix, o in self.reserved.items():
+                if o is owner:
+                    del self.reserved[suffix]
+
+    def claimed_by_others(self, owner, device):
+        """
+        Return ``True`` if ``device`` has been reserved by someone other than
+        ``owner``.
+        """
+        with self.lock:
+            o = self.reserved.get(device_suffix(device))
+            return o is not None and o is not owner
+
+
+# Devices are host-wide so share the watcher and allocator
+device_watcher = DeviceWatcher()
+device_allocator = DeviceAllocator(device_watcher)
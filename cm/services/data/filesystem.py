@@ -6,10 +6,12 @@ import os
 import shutil
 import commands
 import threading
+import time
 from datetime import datetime
 
 from boto.exception import EC2ResponseError
 
+from cm.util import bulk
 from cm.util import misc
 from cm.util.misc import run
 from cm.util.misc import flock
@@ -120,10 +122,19 @@ class Filesystem(DataService):
                 # be `added` and thus we know what `kind` a FS is. So, instead of
                 # iterating over all devices, just use `self.kind`-based if/else, right?
                 # See `nfs` case as an example
-                for vol in self.volumes:
-                    # Threading has some issues w/ race conditions over device IDs
-                    # threading.Thread(target=vol.add).start()
-                    vol.add()
+                # Device names are allocated centrally so the volumes can be
+                # created, attached and mounted concurrently
+                failed = bulk.run_concurrently(
+                    [("Adding volume {0} to file system {1}".format(
+                        vol.volume_id, self.get_full_name()),
+                      lambda vol=vol: self._add_volume(vol))
+                     for vol in self.volumes],
+                    max_workers=len(self.volumes))
+                if failed:
+                    log.error("Error adding {0} of the volumes of file system {1}"
+                              .format(len(failed), self.get_full_name()))
+                    self.state = service_states.ERROR
+                    return False
                 for b in self.buckets:
                     self.kind = 'bucket'
                     threading.Thread(target=b.mount).start()
@@ -153,6 +164,11 @@ class Filesystem(DataService):
                       .format(self.get_full_name(), service_states.UNSTARTED, self.state))
         return False
 
+    def _add_volume(self, vol):
+        if vol.add() is False:
+            raise Exception("Volume {0} could not be attached or mounted"
+                            .format(vol.volume_id))
+
     def remove(self, synchronous=False, delete_devices=False):
         """
         Initiate removal of this file system from the system; do it in a
@@ -317,6 +333,116 @@ class Filesystem(DataService):
         self.app.manager.activate_master_service(self)
         return snap_ids
 
+    def supports_online_snapshot(self):
+        """
+        Return ``True`` if this file system can be snapshotted while it stays
+        mounted and in use (see ``create_online_snapshot``). This requires the
+        file system to be composed of volumes only, the cloud to be able to
+        snapshot attached volumes and ``fsfreeze`` to be available.
+        """
+        return (self.app.cloud_type == 'ec2' and len(self.volumes) > 0 and
+                not (self.buckets or self.transient_storage or self.nfs_fs or
+                     self.gluster_fs) and
+                misc.which('fsfreeze') is not None)
+
+    def create_online_snapshot(self, snap_description=None, quiesce=None,
+                               wait=False, max_freeze=30):
+        """
+        Create a snapshot of this file system without taking it offline.
+
+        Pending writes are flushed and the file system is frozen only while
+        the volume snapshots are initiated; a cloud snapshot captures the state
+        of a volume at the time it was initiated so the file system is thawed
+        right after and the snapshots complete in the background (their
+        progress is tracked by the volumes, as with offline snapshots).
+
+        :type quiesce: callable
+        :param quiesce: Called before the file system is frozen (e.g., to have
+                        Postgres write a checkpoint).
+
+        :type wait: bool
+        :param wait: If set, return only once the snapshots have completed.
+
+        :type max_freeze: int
+        :param max_freeze: Number of seconds after which the file system is
+                           thawed even if the snapshots have not been
+                           initiated yet.
+
+        :rtype: list
+        :return: The IDs of the snapshots that were initiated or ``None`` if
+                 the file system could not be frozen or a snapshot of any of
+                 its volumes could not be initiated.
+        """
+        if quiesce:
+            try:
+                quiesce()
+            except Exception, e:
+                log.warning("Error quiescing {0} ahead of a snapshot: {1}"
+                            .format(self.get_full_name(), e))
+        fsfreeze = misc.which('fsfreeze')
+        # Flush while writes are still allowed to keep the freeze short
+        run('sync')
+        if not run('{0} -f {1}'.format(fsfreeze, self.mount_point),
+                   "Error freezing file system {0}".format(self.mount_point)):
+            return None
+        frozen_at = time.time()
+        thaw_lock = threading.Lock()
+        frozen = [True]
+
+        def _thaw():
+            with thaw_lock:
+                if frozen[0]:
+                    run('{0} -u {1}'.format(fsfreeze, self.mount_point),
+                        "Error thawing file system {0}".format(self.mount_point))
+                    frozen[0] = False
+                    log.info("File system {0} was frozen for {1:.2f} seconds"
+                             .format(self.mount_point, time.time() - frozen_at))
+        watchdog = threading.Timer(max_freeze, _thaw)
+        watchdog.daemon = True
+        watchdog.start()
+        snapshots = []
+        failed = False
+        try:
+            for vol in self.volumes:
+                try:
+                    snapshot = vol.start_snapshot(snap_description=snap_description)
+                except Exception, e:
+                    log.error("Error initiating a snapshot of volume {0}: {1}"
+                              .format(vol.volume_id, e))
+                    snapshot = None
+                if not snapshot:
+                    failed = True
+                    break
+                snapshots.append((vol, snapshot))
+        finally:
+            watchdog.cancel()
+            if not frozen[0]:
+                log.error("File system {0} was thawed after {1} seconds, before all "
+                          "its snapshots were initiated; the snapshots may not be "
+                          "consistent".format(self.mount_point, max_freeze))
+            _thaw()
+        if failed:
+            # An incomplete set of snapshots is of no use
+            for vol, snapshot in snapshots:
+                try:
+                    snapshot.delete()
+                except Exception, e:
+                    log.warning("Error deleting snapshot {0}: {1}".format(snapshot.id, e))
+            log.error("Could not snapshot all the volumes of file system {0} online"
+                      .format(self.get_full_name()))
+            return None
+        threads = []
+        for vol, snapshot in snapshots:
+            t = threading.Thread(target=vol.wait_for_snapshot, args=(snapshot,),
+                                 name='snapshot-{0}'.format(snapshot.id))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+        if wait:
+            for t in threads:
+                t.join()
+        return [str(snapshot.id) for vol, snapshot in snapshots]
+
     def _get_attach_device_from_device(self, device):
         """
         Get the device a volume is attached as from the volume itself (i.e.,
@@ -28,6 +28,7 @@ class TransientStorage(BlockStorage):
         self.app = self.fs.app
         self.device = None
         self.from_archive = from_archive
+        self.archive_extractor = None
         self.svc_roles = [ServiceRole.TRANSIENT_NFS]
         self.name = ServiceRole.to_string(ServiceRole.TRANSIENT_NFS)
 
@@ -43,6 +44,8 @@ class TransientStorage(BlockStorage):
         """
         details['DoT'] = "Yes"
         details['device'] = self.device
+        if self.archive_extractor and self.archive_extractor.is_alive():
+            details['archive_progress'] = self.archive_extractor.get_progress()
         # TODO: keep track of any errors
         details['err_msg'] = None if details.get(
             'err_msg', '') == '' else details['err_msg']
@@ -73,9 +76,11 @@ class TransientStorage(BlockStorage):
                 # Extract the FS archive in a separate thread
                 log.debug("Extracting transient FS {0} from an archive in a "
                           "dedicated thread.".format(self.get_full_name()))
-                ExtractArchive(self.from_archive['url'], self.fs.mount_point,
-                               self.from_archive['md5_sum'],
-                               callback=self.fs.nfs_share_and_set_state).start()
+                self.archive_extractor = ExtractArchive(
+                    self.from_archive['url'], self.fs.mount_point,
+                    self.from_archive['md5_sum'],
+                    callback=self.fs.nfs_share_and_set_state)
+                self.archive_extractor.start()
         else:
             self.fs.nfs_share_and_set_state()
 
@@ -8,15 +8,17 @@ import pwd
 import time
 import shutil
 import subprocess
-from glob import glob
 
 from boto.exception import EC2ResponseError
 
+from cm.clouds import ratelimit
+from cm.clouds.connections import is_throttling_error
 from cm.util.misc import run
 from cm.services import service_states
 from cm.services import ServiceRole
 from cm.services.data import BlockStorage
 from cm.services.data import volume_status
+from cm.services.data.devices import device_allocator, device_watcher
 from cm.util import ExtractArchive
 
 import logging
@@ -47,6 +49,7 @@ class Volume(BlockStorage):
         self.size = size
         self.from_snapshot_id = from_snapshot_id
         self.from_archive = from_archive
+        self.archive_extractor = None
         self.snapshot = None
         self.snapshots_created = []  # Snapshots that were created from this volume
         self.device = None
@@ -94,6 +97,8 @@ class Volume(BlockStorage):
         details['from_archive'] = "No" if not self.from_archive else self.from_archive['url']
         details['snapshot_progress'] = self.snapshot_progress
         details['snapshot_status'] = self.snapshot_status
+        if self.archive_extractor and self.archive_extractor.is_alive():
+            details['archive_progress'] = self.archive_extractor.get_progress()
         # TODO: keep track of any errors
         details['err_msg'] = None if details.get('err_msg', '') == '' else details['err_msg']
         details['snapshots_created'] = self.snapshots_created
@@ -192,28 +197,60 @@ class Volume(BlockStorage):
         """
         if not self.volume:
             # no volume active
-            status = volume_status.NONE
-        elif self._status and self._last_status_check >= time.time() - MIN_TIME_BETWEEN_STATUS_CHECKS:
+            return volume_status.NONE
+        elif self._has_fresh_status():
+            return self._status
+        monitor = self._status_monitor
+        if monitor:
+            # Refresh this volume along with all the other tracked ones
+            monitor.track(self)
+            monitor.refresh()
+            if self._has_fresh_status():
+                return self._status
+        try:
+            ratelimit.limiter.acquire('describe')
+            self.volume.update()
+            self.set_volume_status(self.volume)
             status = self._status
-        else:
-            try:
-                self.volume.update()
-                # Take only the first word of the status as openstack adds some extra info after a space
-                status = volume_status_map.get(self.volume.status.split(' ')[0], None)
-                if status == volume_status.IN_USE and self.volume.attachment_state() == 'attached':
-                    status = volume_status.ATTACHED
-                if not status:
-                    log.error("Unknown volume status: {0}. Setting status to volume_status.NONE"
-                              .format(self.volume.status))
-                    status = volume_status.NONE
-                self._status = status
-                self._last_status_check = time.time()
-            except EC2ResponseError as e:
+        except EC2ResponseError as e:
+            if is_throttling_error(e) and self._status:
+                log.debug("Throttled while retrieving volume {0} status; using "
+                          "the last known status {1}".format(self.volume_id, self._status))
+                status = self._status
+            else:
                 log.error(
                     'Cannot retrieve status of current volume. {0}'.format(e))
                 status = volume_status.NONE
         return status
 
+    def _has_fresh_status(self):
+        return self._status and self._last_status_check >= time.time() - MIN_TIME_BETWEEN_STATUS_CHECKS
+
+    @property
+    def _status_monitor(self):
+        """
+        The ``VolumeStatusMonitor`` refreshing volume status in batches, if
+        the current manager provides one.
+        """
+        return getattr(self.app.manager, 'volume_monitor', None)
+
+    def set_volume_status(self, vol):
+        """
+        Set the cached status of this volume from ``vol``, an up-to-date
+        boto object representing this volume.
+        """
+        # Take only the first word of the status as openstack adds some extra info after a space
+        status = volume_status_map.get(vol.status.split(' ')[0], None)
+        if status == volume_status.IN_USE and vol.attachment_state() == 'attached':
+            status = volume_status.ATTACHED
+        if not status:
+            log.error("Unknown volume status: {0}. Setting status to volume_status.NONE"
+                      .format(vol.status))
+            status = volume_status.NONE
+        self.volume = vol
+        self._status = status
+        self._last_status_check = time.time()
+
     def wait_for_status(self, status, timeout=-1):
         """
         Wait for ``timeout`` seconds, or until the volume reaches a desired status
@@ -224,36 +261,40 @@ class Volume(BlockStorage):
         if self.status == volume_status.NONE:
             log.debug('Attempted to wait for a status ({0}) on a non-existent volume'.format(status))
             return False  # no volume means not worth waiting
+        log.debug('Waiting for volume {0} (status "{1}"; {2}) to reach status "{3}" (timeout: {4})'
+                  .format(self.volume_id, self.status, self.fs.get_full_name(), status, timeout))
+
+        def reached():
+            return self.status == status or not self.volume_id
+        monitor = self._status_monitor
+        if monitor:
+            monitor.wait_for(self, reached, timeout)
         else:
-            start_time = time.time()
-            end_time = start_time + timeout
-            if timeout == -1:
-                checks = "infinite"
-                wait_time = 5
-                wait_forever = True
-            else:
-                checks = 10
-                wait_time = float(timeout) / checks
-                wait_forever = False
-            while wait_forever or time.time() <= end_time:
-                if self.status == status:
-                    log.debug("Volume {0} ({1}) has reached status '{2}'"
-                              .format(self.volume_id, self.fs.get_full_name(), status))
-                    return True
-                elif not self.volume_id:
-                    log.debug("No volume ID; not waiting for desired status ({0})"
-                              .format(status))
-                    return False
-                else:
-                    log.debug('Waiting for volume {0} (status "{1}"; {2}) to reach status "{3}". '
-                              'Remaining checks: {4}'.format(self.volume_id, self.status,
-                                                             self.fs.get_full_name(), status, checks))
-                    if timeout != -1:
-                        checks -= 1
-                    time.sleep(wait_time)
-            log.debug('Wait for volume {0} ({1}) to reach status {2} timed out. Current status {3}.'
-                      .format(self.volume_id, self.fs.get_full_name(), status, self.status))
+            self._poll_for(reached, timeout)
+        if self.status == status:
+            log.debug("Volume {0} ({1}) has reached status '{2}'"
+                      .format(self.volume_id, self.fs.get_full_name(), status))
+            return True
+        elif not self.volume_id:
+            log.debug("No volume ID; not waiting for desired status ({0})"
+                      .format(status))
             return False
+        log.debug('Wait for volume {0} ({1}) to reach status {2} timed out. Current status {3}.'
+                  .format(self.volume_id, self.fs.get_full_name(), status, self.status))
+        return False
+
+    def _poll_for(self, condition, timeout):
+        """
+        Check ``condition`` at regular intervals until it is ``True`` or
+        ``timeout`` expires; used when there is no status monitor.
+        """
+        end_time = time.time() + timeout
+        wait_time = 5 if timeout == -1 else float(timeout) / 10
+        while timeout == -1 or time.time() <= end_time:
+            if condition():
+                return True
+            time.sleep(wait_time)
+        return False
 
     def create(self, filesystem=None):
         """
@@ -318,6 +359,8 @@ class Volume(BlockStorage):
                 self.volume.delete()
                 log.debug("Deleted volume '%s'" % volume_id)
                 self.volume = None
+                if self._status_monitor:
+                    self._status_monitor.untrack(volume_id)
             else:
                 log.debug("No volume object so cannot delete it; ignoring.")
         except EC2ResponseError, e:
@@ -330,7 +373,7 @@ class Volume(BlockStorage):
         """
         Get a list of system devices as an iterable list of strings.
         """
-        return frozenset(glob('/dev/*d[a-z]'))
+        return device_watcher.devices()
 
     def _increment_device_id(self, device_id):
         """
@@ -374,8 +417,10 @@ class Volume(BlockStorage):
         If either ``/dev/vd?`` or ``/dev/xvd?`` devices exist, then we know to
         use the next of those. Otherwise, test ``/dev/sd?``, ``/dev/xvd?``, then ``/dev/vd?``.
 
-        **This is so totally not thread-safe.** If other devices get attached externally,
-        the device id may already be in use when we get there.
+        This is not thread-safe on its own; use it via ``device_allocator.reserve``
+        so devices reserved for other volumes being attached are accounted for.
+        If other devices get attached externally, the device id may already be
+        in use when we get there.
         """
         if not devices:
             devices = self._get_device_list()
@@ -462,42 +507,54 @@ class Volume(BlockStorage):
                     self.status))
                 return None
 
-        # attempt to attach
-        for attempted_device in self._get_likely_next_devices():
-            pre_devices = self._get_device_list()
-            log.debug(
-                'Before attach, devices = {0}'.format(' '.join(pre_devices)))
-            if self._do_attach(attempted_device):
-                if self.wait_for_status(volume_status.ATTACHED):
-                    time.sleep(10)  # give a few seconds for the device to show up in the OS
-                    post_devices = self._get_device_list()
-                    log.debug('After attach, devices = {0}'.format(
-                        ' '.join(post_devices)))
-                    new_devices = post_devices - pre_devices
-                    log.debug('New devices = {0}'.format(' '.join(new_devices)))
-                    if len(new_devices) == 0:
-                        log.debug('Could not find attached device for volume {0}. Attempted device = {1}'
-                                  .format(self.volume_id, attempted_device))
-                    elif attempted_device in new_devices:
-                        self.device = attempted_device
-                        return attempted_device
-                    elif len(new_devices) > 1:
-                        log.error("Multiple devices (%s) added to OS during process, "
-                                  "and none are the requested device. Can't determine "
-                                  "new device. Aborting" % ', '.join(new_devices))
-                        return None
-                    else:
-                        device = tuple(new_devices)[0]
-                        self.device = device
-                        log.debug("For {0}, set self.device to {1}".format(
-                                  self.fs.get_full_name(), device))
-                        return device
-                # requested device didn't attach, for whatever reason
-                if self.status != volume_status.AVAILABLE and attempted_device[-3:-1] != 'vd':
-                    self.detach()  # in case it attached invisibly
-                self.wait_for_status(volume_status.AVAILABLE, 60)
+        # attempt to attach; reserve the devices centrally so volumes being
+        # attached concurrently do not compete for the same device
+        candidates = device_allocator.reserve(self, self._get_likely_next_devices)
+        try:
+            for attempted_device in candidates or []:
+                pre_devices = device_watcher.devices()
+                log.debug(
+                    'Before attach, devices = {0}'.format(' '.join(pre_devices)))
+                if self._do_attach(attempted_device):
+                    if self.wait_for_status(volume_status.ATTACHED):
+                        device = self._wait_for_device(attempted_device, pre_devices)
+                        if device:
+                            self.device = device
+                            log.debug("For {0}, set self.device to {1}".format(
+                                      self.fs.get_full_name(), device))
+                            return device
+                    # requested device didn't attach, for whatever reason
+                    if self.status != volume_status.AVAILABLE and attempted_device[-3:-1] != 'vd':
+                        self.detach()  # in case it attached invisibly
+                    self.wait_for_status(volume_status.AVAILABLE, 60)
+        finally:
+            device_allocator.release(self)
         return None  # no device properly attached
 
+    def _wait_for_device(self, attempted_device, pre_devices, timeout=30):
+        """
+        Wait for the device this volume got attached as to show up in the OS.
+        Return the device, or ``None`` if it cannot be determined.
+        """
+        def new_devices(devices):
+            # Ignore devices showing up for other volumes being attached
+            return frozenset([d for d in devices - pre_devices
+                              if not device_allocator.claimed_by_others(self, d)])
+        new = device_watcher.wait_for(new_devices, timeout)
+        log.debug('New devices = {0}'.format(' '.join(new)))
+        if len(new) == 0:
+            log.debug('Could not find attached device for volume {0}. Attempted device = {1}'
+                      .format(self.volume_id, attempted_device))
+        elif attempted_device in new:
+            return attempted_device
+        elif len(new) > 1:
+            log.error("Multiple devices (%s) added to OS during process, "
+                      "and none are the requested device. Can't determine "
+                      "new device. Aborting" % ', '.join(new))
+        else:
+            return tuple(new)[0]
+        return None
+
     def detach(self):
         """
         Detach EBS volume from an instance.
@@ -535,6 +592,20 @@ class Volume(BlockStorage):
         Crete a point-in-time snapshot of the current volume, optionally specifying
         a description for the snapshot.
         """
+        snapshot = self.start_snapshot(snap_description)
+        if snapshot:
+            return self.wait_for_snapshot(snapshot)
+        else:
+            log.error(
+                "Could not create snapshot from volume '%s'" % self.volume_id)
+            return None
+
+    def start_snapshot(self, snap_description=None):
+        """
+        Initiate a snapshot of the current volume and return the boto snapshot
+        object without waiting for the snapshot to complete. The snapshot
+        captures the state of the volume at the time it was initiated.
+        """
         log.info("Initiating creation of a snapshot for the volume '%s'" %
                  self.volume_id)
         try:
@@ -545,35 +616,40 @@ class Volume(BlockStorage):
                       (self.volume_id, ex))
             raise
         if snapshot:
-            try:
-                while snapshot.status != 'completed':
-                    log.debug("Snapshot '%s' progress: '%s'; status: '%s'"
-                              % (snapshot.id, snapshot.progress, snapshot.status))
-                    self.snapshot_progress = snapshot.progress
-                    self.snapshot_status = snapshot.status
-                    time.sleep(6)
-                    snapshot.update()
-                log.info("Completed creation of a snapshot for the volume '%s', snap id: '%s'"
-                         % (self.volume_id, snapshot.id))
-            except SystemExit, exc:
-                # FIXME: this is an attempt at a 'patch' not to cripple a cluster
-                # (Paste will kill threads that run for more than 30 mins so
-                # catch an exception here and give back the control to a user)
-                log.error("SystemExit while creating snapshot {0}; ignoring: "
-                          "{1}".format(snapshot.id, exc))
-            self.app.cloud_interface.add_tag(snapshot, 'clusterName',
-                                             self.app.config['cluster_name'])
-            self.app.cloud_interface.add_tag(
-                self.volume, 'bucketName', self.app.config['bucket_cluster'])
-            self.app.cloud_interface.add_tag(self.volume, 'filesystem', self.fs.name)
-            self.snapshot_progress = None  # Reset because of the UI
-            self.snapshot_status = None  # Reset because of the UI
-            self.snapshots_created.append(snapshot.id)
-            return str(snapshot.id)
-        else:
-            log.error(
-                "Could not create snapshot from volume '%s'" % self.volume_id)
-            return None
+            self.snapshot_progress = snapshot.progress
+            self.snapshot_status = snapshot.status
+        return snapshot
+
+    def wait_for_snapshot(self, snapshot):
+        """
+        Wait for ``snapshot`` (see ``start_snapshot``) to complete, keeping
+        track of its progress, and tag it. Return the snapshot ID.
+        """
+        try:
+            while snapshot.status != 'completed':
+                log.debug("Snapshot '%s' progress: '%s'; status: '%s'"
+                          % (snapshot.id, snapshot.progress, snapshot.status))
+                self.snapshot_progress = snapshot.progress
+                self.snapshot_status = snapshot.status
+                time.sleep(6)
+                snapshot.update()
+            log.info("Completed creation of a snapshot for the volume '%s', snap id: '%s'"
+                     % (self.volume_id, snapshot.id))
+        except SystemExit, exc:
+            # FIXME: this is an attempt at a 'patch' not to cripple a cluster
+            # (Paste will kill threads that run for more than 30 mins so
+            # catch an exception here and give back the control to a user)
+            log.error("SystemExit while creating snapshot {0}; ignoring: "
+                      "{1}".format(snapshot.id, exc))
+        self.app.cloud_interface.add_tag(snapshot, 'clusterName',
+                                         self.app.config['cluster_name'])
+        self.app.cloud_interface.add_tag(
+            self.volume, 'bucketName', self.app.config['bucket_cluster'])
+        self.app.cloud_interface.add_tag(self.volume, 'filesystem', self.fs.name)
+        self.snapshot_progress = None  # Reset because of the UI
+        self.snapshot_status = None  # Reset because of the UI
+        self.snapshots_created.append(snapshot.id)
+        return str(snapshot.id)
 
     def get_from_snap_id(self):
         """
@@ -586,7 +662,8 @@ class Volume(BlockStorage):
         """
         Add this volume as a file system. This implies creating a volume (if
         it does not already exist), attaching it to the instance, and mounting
-        the file system.
+        the file system. Return ``False`` if the volume could not be attached
+        or mounted.
         """
         self.create(self.fs.name)
         # Mark a volume as 'static' if created from a snapshot
@@ -608,8 +685,11 @@ class Volume(BlockStorage):
                 self.fs.kind = 'snapshot'
         else:
             self.fs.kind = 'volume'
-        if self.attach():
-            self.mount(self.fs.mount_point)
+        if not self.attach():
+            log.error("Could not attach volume {0} for file system {1}"
+                      .format(self.volume_id, self.fs.get_full_name()))
+            return False
+        return self.mount(self.fs.mount_point) is not False
 
     def remove(self, mount_point, delete_vols=False, detach=True):
         """
@@ -749,9 +829,11 @@ class Volume(BlockStorage):
                     else:
                         self.fs.state = service_states.CONFIGURING
                         # Extract the FS archive in a separate thread
-                        ExtractArchive(self.from_archive['url'], mount_point,
-                                       self.from_archive['md5_sum'],
-                                       callback=self.fs.nfs_share_and_set_state).start()
+                        self.archive_extractor = ExtractArchive(
+                            self.from_archive['url'], mount_point,
+                            self.from_archive['md5_sum'],
+                            callback=self.fs.nfs_share_and_set_state)
+                        self.archive_extractor.start()
                 else:
                     self.fs.nfs_share_and_set_state()
                 return True
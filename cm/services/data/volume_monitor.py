@@ -0,0 +1,183 @@
+"""
+Batched status refresh for the volumes managed by CloudMan.
+
+Instead of each ``Volume`` object describing its own cloud volume whenever its
+cached status gets stale, all the tracked volumes are refreshed together, with
+a single ``get_all_volumes(volume_ids=[...])`` call per refresh interval.
+Threads waiting for a volume to reach a given status block on a condition
+variable that is signalled after each refresh.
+"""
+import re
+import threading
+import time
+
+from boto.exception import EC2ResponseError
+
+import logging
+log = logging.getLogger('cloudman')
+
+
+class VolumeStatusMonitor(object):
+
+    def __init__(self, app, interval=2):
+        """
+        :type interval: int
+        :param interval: Minimum number of seconds between two consecutive
+                         refreshes of the tracked volumes.
+        """
+        self.app = app
+        self.interval = interval
+        self.volumes = {}  # volume_id: cm.services.data.volume.Volume
+        self.last_refresh = 0
+        self.generation = 0  # Incremented with each completed refresh
+        self.num_waiters = 0
+        self.refresh_lock = threading.Lock()
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def track(self, volume):
+        """
+        Include ``volume`` (a ``cm.services.data.volume.Volume`` object) in
+        the batched status refreshes.
+        """
+        if volume.volume_id:
+            with self.cond:
+                self.volumes[volume.volume_id] = volume
+
+    def untrack(self, volume_id):
+        with self.cond:
+            self.volumes.pop(volume_id, None)
+
+    def refresh(self, force=False):
+        """
+        Refresh the status of all the tracked volumes with a single cloud call
+        unless the last refresh happened less than ``self.interval`` seconds
+        ago (and ``force`` is not set). Concurrent callers wait for the
+        refresh in progress instead of issuing their own.
+        """
+        started = time.time()
+        with self.refresh_lock:
+            if not force and self.last_refresh >= started - self.interval:
+                # Someone else refreshed while we were waiting for the lock
+                return True
+            with self.cond:
+                # Drop volumes that have since been deleted or replaced
+                for vol_id, vol in self.volumes.items():
+                    if vol.volume_id != vol_id:
+                        del self.volumes[vol_id]
+                tracked = dict(self.volumes)
+            if not tracked:
+                return True
+            try:
+                vols = self._describe(tracked)
+            except EC2ResponseError, e:
+                # Leave it to the individual volumes to update themselves
+                log.debug("Trouble refreshing the status of volumes {0}: {1}"
+                          .format(", ".join(tracked.keys()), e))
+                return False
+            for vol in vols or []:
+                if vol.id in tracked:
+                    tracked[vol.id].set_volume_status(vol)
+            self.last_refresh = time.time()
+        with self.cond:
+            self.generation += 1
+            self.cond.notify_all()
+        return True
+
+    def _describe(self, tracked):
+        """
+        Describe the ``tracked`` volumes (a dict of volume ID: ``Volume``).
+        A single volume that no longer exists fails the describe call for all
+        of them so volumes reported missing are no longer tracked (and left
+        to update themselves) and the call is made again without them.
+        """
+        while tracked:
+            try:
+                return self.app.cloud_interface.get_all_volumes(
+                    volume_ids=sorted(tracked.keys()))
+            except EC2ResponseError, e:
+                if e.error_code != 'InvalidVolume.NotFound':
+                    raise
+                missing = self._missing(e, tracked.keys())
+                if not missing:
+                    raise
+                log.debug("Volumes {0} no longer exist; not tracking them"
+                          .format(", ".join(missing)))
+                for vol_id in missing:
+                    tracked.pop(vol_id, None)
+                    self.untrack(vol_id)
+        return []
+
+    def _missing(self, e, vol_ids):
+        """
+        Return the IDs among ``vol_ids`` that the ``InvalidVolume.NotFound``
+        error ``e`` is about, querying each volume if the error does not name
+        any of them.
+        """
+        named = set(re.findall(r'vol-[0-9a-zA-Z]+', '{0} {1}'.format(e.error_message, e.body)))
+        missing = [vol_id for vol_id in vol_ids if vol_id in named]
+        if missing:
+            return missing
+        for vol_id in vol_ids:
+            try:
+                self.app.cloud_interface.get_all_volumes(volume_ids=[vol_id])
+            except EC2ResponseError, e:
+                if e.error_code == 'InvalidVolume.NotFound':
+                    missing.append(vol_id)
+        return missing
+
+    def wait_for(self, volume, condition, timeout=-1):
+        """
+        Block until the callable ``condition`` returns ``True`` or, unless
+        ``timeout`` is ``-1``, ``timeout`` seconds have passed. ``condition``
+        is re-evaluated after each refresh of the tracked volumes, which keep
+        happening while there are threads waiting.
+
+        :rtype: bool
+        :return: The value of ``condition`` at the time of returning.
+        """
+        self.track(volume)
+        end_time = time.time() + timeout
+        with self.cond:
+            self.num_waiters += 1
+            self._start()
+            self.cond.notify_all()
+        try:
+            while True:
+                with self.cond:
+                    generation = self.generation
+                if condition():
+                    return True
+                remaining = end_time - time.time()
+                if timeout != -1 and remaining <= 0:
+                    return False
+                with self.cond:
+                    if generation == self.generation:
+                        # Bound the wait so a stuck refresher cannot block us
+                        max_wait = 5 * self.interval
+                        self.cond.wait(max_wait if timeout == -1 else min(remaining, max_wait))
+        finally:
+            with self.cond:
+                self.num_waiters -= 1
+
+    def _start(self):
+        # Must be called while holding ``self.cond``
+        if self.thread is None or not self.thread.is_alive():
+            self.thread = threading.Thread(target=self._run, name='VolumeStatusMonitor')
+            self.thread.daemon = True
+            self.thread.start()
+
+    def _run(self):
+        """
+        Keep refreshing the tracked volumes, every ``self.interval`` seconds,
+        while there are threads waiting on a volume status.
+        """
+        while True:
+            with self.cond:
+                while self.num_waiters == 0:
+                    self.cond.wait()
+            try:
+                self.refresh()
+            except Exception, e:
+                log.error("Error refreshing volume status: {0}".format(e))
+            time.sleep(self.interval)
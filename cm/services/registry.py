@@ -1,8 +1,25 @@
-"""A Registry of CloudMan services"""
+"""
+A Registry of CloudMan services
+
+Service modules are discovered in `cm/services/` and described in a
+manifest (the module, service class, name, roles and type of each service),
+which is cached outside of CloudMan's home (which is replaced on every boot
+and clean restart; the modules extracted from the same CloudMan archive keep
+their modification times) and reused for as long as the modules'
+modification times and sizes do not change. Services described by the cached
+manifest are not imported or instantiated until they are first queried (see
+`ServiceRegistry.get`); until then they are neither active nor started, so
+iterating the registry only goes through the services loaded so far.
+"""
 import os
 import glob
 import importlib
+import json
 import pyclbr
+import re
+import threading
+
+from cm.util import paths
 
 import logging
 log = logging.getLogger('cloudman')
@@ -14,6 +31,16 @@ class ServiceRegistry(object):
         self.app = app
         self.services = {}
         self.directories = ['cm/services']
+        # Secondary indexes of the registered services, updated as services
+        # are registered, removed, activated and deactivated
+        self._by_role = {}  # Role name: {service name: service object}
+        self._by_type = {}  # Service type: {service name: service object}
+        self._active = {}  # Service name: service object
+        # Manifest entries of the services not loaded yet, by service name
+        self._lazy = {}
+        self.manifest_file = paths.SERVICE_MANIFEST_FILE
+        self._manifest = None  # Module path: manifest entry
+        self._load_lock = threading.RLock()
 
     def __repr__(self):
         return "ServiceRegistry"
@@ -33,7 +60,10 @@ class ServiceRegistry(object):
         `service_name`. If a service with the given name is not found,
         return `None`.
         """
-        return self.services.get(service_name, None)
+        service = self.services.get(service_name, None)
+        if service is None and service_name in self._lazy:
+            service = self._load_lazy(service_name)
+        return service
 
     def get_active(self, service_name):
         """
@@ -41,18 +71,25 @@ class ServiceRegistry(object):
         registry and if it is active. If so, return a handle to the service
         object. Otherwise, return `None`.
         """
-        if self.get(service_name) and self.is_active(service_name):
+        # Only loaded services can be active
+        if self.is_active(service_name):
             return self.get(service_name)
         return None
 
+    def names(self):
+        """
+        Return the names of all the services in the registry, loaded or not.
+        """
+        return self.services.keys() + self._lazy.keys()
+
     def all_active(self, names=False):
         """
         Return a list of currently active service objects or service names, if
         `names` is set.
         """
         if names:
-            return [service.name for service in self.active()]
-        return [service for service in self.active()]
+            return self._active.keys()
+        return self._active.values()
 
     def active(self, service_type=None, service_role=None):
         """
@@ -68,36 +105,72 @@ class ServiceRegistry(object):
         :param  service_role: If provided, filter only services having the
                               specified role.
         """
-        active = []
-        for service in self.itervalues():
-            if service.activated:
-                if service_role and service_role in service.svc_roles:
-                    active.append(service)
-                elif service_type and service_type == service.svc_type:
-                    active.append(service)
-                elif not service_role and not service_type:
-                    active.append(service)
+        if not service_role and not service_type:
+            return iter(self._active.values())
+        candidates = {}
+        if service_role:
+            candidates.update(self._by_role.get(service_role['name'], {}))
+        if service_type:
+            candidates.update(self._by_type.get(service_type, {}))
+        active = [s for n, s in candidates.iteritems() if n in self._active]
         # log.debug("Active services (filtered by type: {0}; role: {1}): {2}"
         #           .format(service_type, service_role, active))
         return iter(active)
 
+    def get_by_role(self, service_role):
+        """
+        Return a list of the service objects (active or not) having the
+        `service_role` role.
+        """
+        self._load_lazy_matching(lambda entry: service_role['name'] in entry['roles'])
+        return self._by_role.get(service_role['name'], {}).values()
+
+    def get_by_type(self, service_type):
+        """
+        Return a list of the service objects (active or not) of the
+        `service_type` type.
+        """
+        self._load_lazy_matching(lambda entry: entry['svc_type'] == service_type)
+        return self._by_type.get(service_type, {}).values()
+
     def is_active(self, service_name):
         """
         Indicate if the service with `service_name` is active.
         """
-        service = self.services.get(service_name, None)
-        if service and self.services[service_name].activated:
-            return True
-        return False
+        return service_name in self._active
+
+    def activation_changed(self, service):
+        """
+        Update the index of active services after `service` has been activated
+        or deactivated (see `Service.activated`).
+        """
+        name = getattr(service, 'name', None)
+        if name is None or self.services.get(name) is not service:
+            return  # Not (yet) registered
+        if service.activated:
+            self._active[name] = service
+        else:
+            self._active.pop(name, None)
+
+    def _add(self, service):
+        self.services[service.name] = service
+        for role in service.svc_roles or []:
+            self._by_role.setdefault(role['name'], {})[service.name] = service
+        self._by_type.setdefault(getattr(service, 'svc_type', None), {})[service.name] = service
+        self.activation_changed(service)
 
     def remove(self, service_name):
         """
         Remove the service object for the service with `service_name` from
         the registry.
         """
+        self._lazy.pop(service_name, None)
         if self.get(service_name):
             log.debug("Removing service {0} from the registry".format(service_name))
             del self.services[service_name]
+            self._active.pop(service_name, None)
+            for index in self._by_role.values() + self._by_type.values():
+                index.pop(service_name, None)
 
     def register(self, service_object):
         """
@@ -109,8 +182,8 @@ class ServiceRegistry(object):
             service_name = service_object.name
             log.debug("Registering service {0} with the registry".format(
                       service_name))
-            if service_name not in self.services:
-                self.services[service_name] = service_object
+            if service_name not in self.services and service_name not in self._lazy:
+                self._add(service_object)
                 return True
             else:
                 log.warning("Service {0} already exists in the registry."
@@ -120,54 +193,143 @@ class ServiceRegistry(object):
                       .format(service_object, e))
         return False
 
-    def load_service(self, service_path):
+    def _load_lazy(self, service_name):
+        with self._load_lock:
+            if service_name in self.services:
+                return self.services[service_name]
+            entry = self._lazy.get(service_name)
+            if not entry:
+                return None
+            log.debug("Loading service {0} on first use".format(service_name))
+            service = None
+            try:
+                service = self._instantiate(entry['module'], entry['class_name'])
+            except Exception, e:
+                log.warning("Exception loading service {0}: {1}".format(service_name, e))
+            self._lazy.pop(service_name, None)
+            if service:
+                self._add(service)
+            return service
+
+    def _load_lazy_matching(self, matches):
+        for name, entry in self._lazy.items():
+            if matches(entry):
+                self.get(name)
+
+    def _instantiate(self, module, service_class_name):
+        service_module = importlib.import_module(module)
+        return getattr(service_module, service_class_name)(self.app)
+
+    def load_service(self, service_path, service_class_name=None):
         """
-        Load the service class pointed to by `service_path` and return an
-        object of the service.
+        Load the service class pointed to by `service_path` (named
+        `service_class_name`, if known) and return an object of the service.
         """
         log.debug("Loading service class in module '{0}'".format(service_path))
         module_name = os.path.splitext(os.path.basename(service_path))[0]
         module_dir = os.path.dirname(service_path)
         module = (os.path.splitext(service_path)[0]).replace('/', '.')
-        # Figure out the class name for the service
-        module_classes = pyclbr.readmodule(module_name, [module_dir])
-        # log.debug("Module {0} classes: {1}".format(module_name, module_classes))
-        service_class_name = None
-        for c in module_classes.iterkeys():
-            if c.lower() == ('{0}service'.format(module_name)).lower():
-                service_class_name = c
-                break
+        if not service_class_name:
+            # Figure out the class name for the service
+            module_classes = pyclbr.readmodule(module_name, [module_dir])
+            # log.debug("Module {0} classes: {1}".format(module_name, module_classes))
+            for c in module_classes.iterkeys():
+                if c.lower() == ('{0}service'.format(module_name)).lower():
+                    service_class_name = c
+                    break
         # log.debug('service_class_name: %s' % service_class_name)
         # Import the service module and instantiate the service class
         service = None
         if service_class_name:
             log.debug("Importing service name {0} as module {1}".format(
                       service_class_name, module))
-            service_module = importlib.import_module(module)
-            service = getattr(service_module, service_class_name)(self.app)
+            service = self._instantiate(module, service_class_name)
         else:
             log.warning("Could not extract service class name from module at {0}"
                         .format(service_path))
         # log.debug("Loaded service {0}".format(service))
         return service
 
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_file) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def _write_manifest(self):
+        tmp_file = self.manifest_file + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(self.manifest_file)):
+                os.makedirs(os.path.dirname(self.manifest_file))
+            with open(tmp_file, 'w') as f:
+                json.dump(self._manifest, f, indent=1, sort_keys=True)
+            os.rename(tmp_file, self.manifest_file)
+        except (IOError, OSError), e:
+            log.debug("Could not write the service manifest {0}: {1}"
+                      .format(self.manifest_file, e))
+
+    def _manifest_entry(self, path):
+        """
+        Return the manifest entry for the module at `path`, describing it
+        afresh if the cached one is out of date.
+        """
+        if self._manifest is None:
+            self._manifest = self._read_manifest()
+        st = os.stat(path)
+        stamp = [st.st_mtime, st.st_size]
+        entry = self._manifest.get(path)
+        if not entry or entry.get('stamp') != stamp:
+            service_name = os.path.splitext(os.path.basename(path))[0]
+            with open(path) as f:
+                source = f.read()
+            # Look for a definition of the service class that matches the
+            # service file name
+            class_name = None
+            for name in re.findall(r'^class\s+(\w+)', source, re.MULTILINE):
+                if name.lower() == '{0}service'.format(service_name).lower():
+                    class_name = name
+                    break
+            entry = {'stamp': stamp, 'class_name': class_name, 'service': None}
+            self._manifest[path] = entry
+        return entry
+
     def load_services(self):
         """
         Load all service classes found in `cm/services/` into the service
-        registry. Return a dictionary of loaded services. Each element of the
-        dictionary contains the service name as the key and the service object
-        as the value.
+        registry. Services described by the cached manifest are registered
+        without being loaded (see `get`); the others are loaded and added to
+        the manifest. Return a dictionary of loaded services. Each element of
+        the dictionary contains the service name as the key and the service
+        object as the value.
 
         :rtype: dictionary
         :returns: loaded services
         """
         log.debug("Initiating loading of services")
+        changed = False
         for service_path in self.find_services():
+            entry = self._manifest_entry(service_path)
+            known = entry['service']
+            if known:
+                if known['name'] in self.services or known['name'] in self._lazy:
+                    log.warning('Service with name {0} already exists. Skipping.'
+                                .format(known['name']))
+                else:
+                    self._lazy[known['name']] = known
+                continue
             try:
-                service = self.load_service(service_path)
+                service = self.load_service(service_path, entry['class_name'])
                 if service and service.name not in self.services:
-                    self.services[service.name] = (service)
+                    self._add(service)
                     log.debug("Loaded service {0}".format(service.name))
+                    entry['service'] = {
+                        'name': service.name,
+                        'module': type(service).__module__,
+                        'class_name': type(service).__name__,
+                        'roles': [r['name'] for r in service.svc_roles or []],
+                        'svc_type': getattr(service, 'svc_type', None)}
+                    changed = True
                 elif service and service.name in self.services:
                     # Reload instead of skip?
                     log.warning('Service with name {0} already exists. Skipping.'
@@ -176,6 +338,10 @@ class ServiceRegistry(object):
                     log.warning('Could not load service at {0}'.format(service_path))
             except Exception, e:
                 log.warning('Exception loading service at {0}'.format(e))
+        if changed:
+            self._write_manifest()
+        log.debug("Services loaded: {0}; to be loaded on first use: {1}"
+                  .format(self.services.keys(), self._lazy.keys()))
         return self.services
 
     def find_services(self):
@@ -197,7 +363,9 @@ class ServiceRegistry(object):
 
     def is_service(self, service_path):
         """
-        Determines whether the given filesystem path contains a service class.
+        Determines whether the given filesystem path contains a service class,
+        i.e., a class named after the module (e.g., `GalaxyService` in
+        `galaxy.py`). The result is cached in the manifest.
 
         :type   service_path: string
         :param  service_path: relative filesystem path to the potential service
@@ -205,11 +373,4 @@ class ServiceRegistry(object):
         :rtype: bool
         :returns: `True` if the path contains a service; `False` otherwise
         """
-        service_name = os.path.splitext(os.path.basename(service_path))[0]
-        # Look for a definition of the service class that matches the service
-        # file name
-        if "class {0}service".format(service_name) in open(service_path).read().lower():
-            # log.debug("    4 {0} is in fact a service impl".format(service_path))
-            return True
-        # log.debug("    5 {0} is not a service impl".format(service_path))
-        return False
+        return self._manifest_entry(service_path)['class_name'] is not None
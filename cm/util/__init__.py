@@ -7,11 +7,12 @@ import hashlib
 import logging
 import threading
 import re
-import requests
 import os
+import subprocess
 import sys
 import tarfile
 
+from cm.util import fetch
 from cm.util import misc
 from cm.util.bunch import Bunch
 
@@ -171,16 +172,35 @@ class ExtractArchive(threading.Thread):
     This is intended to be invoked in a separate thread. After the thread
     finishes execution, `callback` method will be called.
 
+    The archive is fetched with `num_workers` concurrent range requests (see
+    `cm.util.fetch`) and extracted as it arrives; gzip-compressed archives are
+    decompressed by `pigz` in a separate process if it is available. Use
+    `get_progress` to check on the progress.
+
     Note: currently only tar files are supported for the archive.
     """
 
-    def __init__(self, archive_url, path, md5_sum=None, callback=None, num_retries=1):
+    def __init__(self, archive_url, path, md5_sum=None, callback=None, num_retries=1,
+                 num_workers=4):
         threading.Thread.__init__(self)
         self.archive_url = archive_url
         self.path = path
         self.md5_sum = md5_sum
         self.callback = callback
         self.num_retries = num_retries
+        self.num_workers = num_workers
+        self.fetch = None
+
+    def get_progress(self):
+        """Return a short, human-readable description of the progress."""
+        if self.fetch is None:
+            return "Starting"
+        p = self.fetch.get_progress()
+        if p.bytes_total:
+            return "{0}% ({1} of {2} at {3}/s)".format(
+                p.pct, misc.nice_size(p.bytes_read), misc.nice_size(p.bytes_total),
+                misc.nice_size(p.rate))
+        return "{0} at {1}/s".format(misc.nice_size(p.bytes_read), misc.nice_size(p.rate))
 
     def _md5_check_ok(self, digest):
         """Do the MD5 checksum. Return `True` if OK; `False` otherwise."""
@@ -193,6 +213,56 @@ class ExtractArchive(threading.Thread):
                      self.archive_url, self.md5_sum, digest))
         return True
 
+    def _extract_tar(self, archive):
+        """
+        Extract a tar `archive` opened in stream mode. Return the total size
+        of the extracted files.
+        """
+        archive.extractall(path=self.path)
+        extracted_size = sum(m.size for m in archive.getmembers())
+        archive.close()
+        return extracted_size
+
+    def _extract_pigz(self, pigz, stream):
+        """
+        Decompress the gzip `stream` with `pigz`, which is fed from a separate
+        thread, and extract the tar archive from its output.
+        """
+        proc = subprocess.Popen([pigz, '-dc'], stdin=subprocess.PIPE,
+                                stdout=subprocess.PIPE)
+        errors = []
+
+        def _feed():
+            try:
+                data = stream.read(fetch.READ_SIZE)
+                while data:
+                    proc.stdin.write(data)
+                    data = stream.read(fetch.READ_SIZE)
+            except Exception, e:
+                errors.append(e)
+            finally:
+                try:
+                    proc.stdin.close()
+                except IOError:
+                    pass
+        feeder = threading.Thread(target=_feed, name='pigz-feeder')
+        feeder.daemon = True
+        feeder.start()
+        try:
+            extracted_size = self._extract_tar(tarfile.open(fileobj=proc.stdout, mode='r|'))
+            # Consume the padding following the end of the tar archive
+            while proc.stdout.read(fetch.READ_SIZE):
+                pass
+        except Exception:
+            proc.kill()
+            raise
+        feeder.join()
+        if errors:
+            raise errors[0]
+        if proc.wait() != 0:
+            raise IOError("pigz exited with code {0}".format(proc.returncode))
+        return extracted_size
+
     def _extract(self):
         """
         Do the extraction of a tar archive from `archive_url` to a specified
@@ -200,23 +270,30 @@ class ExtractArchive(threading.Thread):
         """
         try:
             start = datetime.utcnow()
-            r = requests.get(self.archive_url, stream=True)
-            stream = MD5TransparentFilter(r.raw)
-            archive = tarfile.open(fileobj=stream, mode='r|*')
-            archive.extractall(path=self.path)
-            archive.close()
+            self.fetch = fetch.ParallelFetch(self.archive_url,
+                                             num_workers=self.num_workers).open()
+            pigz = misc.which('pigz') if self.fetch.peek(2) == '\x1f\x8b' else None
+            stream = MD5TransparentFilter(self.fetch)
+            if pigz:
+                extracted_size = self._extract_pigz(pigz, stream)
+            else:
+                extracted_size = self._extract_tar(tarfile.open(fileobj=stream, mode='r|*'))
+                # Make sure the checksum covers any data following the archive
+                while stream.read(fetch.READ_SIZE):
+                    pass
             hexdigest = stream.hexdigest()
-            head_response = requests.head(self.archive_url)
-            archive_size = head_response.headers.get('content-length', -1)
             log.debug(" (X) Completed extracting archive {0} ({1}) to {2} ({3}) in {4}"
-                      .format(self.archive_url, misc.nice_size(archive_size),
-                              self.path, misc.nice_size(misc.get_dir_size(self.path)),
+                      .format(self.archive_url, misc.nice_size(self.fetch.bytes_read),
+                              self.path, misc.nice_size(extracted_size),
                               datetime.utcnow() - start))
             return hexdigest
         except Exception, e:
             log.error(" (X) Exception extracting archive {0} to {1}: {2}".format(
                       self.archive_url, self.path, e))
             return None
+        finally:
+            if self.fetch:
+                self.fetch.close()
 
     def run(self):
         log.info(" (X) Extracting archive url {0} to {1}. This could take a while..."
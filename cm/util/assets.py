@@ -0,0 +1,183 @@
+"""
+Content-hashed URLs for CloudMan's static files.
+
+A file under the static directory (e.g., ``static/scripts/foo.js``) is
+addressed as ``/static/_/<hash>/scripts/foo.js``, where ``<hash>`` is derived
+from the content of all the static files. The URL hence changes whenever the
+file (or any other static file) does, so the responses can be cached by
+browsers for good. A single hash for all the files, rather than one per file,
+keeps the references relative to a file (e.g., ``url(base_bg.png)`` in a
+style sheet) under the same hashed prefix, which then correctly identifies
+the referenced files' content too. Nginx serves those URLs straight
+from disk (see ``nginx_default_locations.default``), along with the gzipped
+variants ``AssetManifest.build`` writes next to the compressible files (for
+``gzip_static``); ``CacheableStaticURLParser`` understands them too for when
+CloudMan runs standalone.
+"""
+import gzip
+import hashlib
+import os
+import shutil
+import threading
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Path segment introducing a content hash in a static file URL
+HASHED_DIR = '_'
+HASH_LENGTH = 12
+# Cache lifetime of the content-hashed files, in seconds
+FAR_FUTURE = 365 * 24 * 3600
+COMPRESSIBLE = ('.css', '.js', '.html', '.svg', '.txt', '.json', '.ttf', '.otf', '.eot')
+# Files smaller than this (in bytes) are not worth compressing
+MIN_COMPRESS_SIZE = 256
+
+
+def file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(65536), ''):
+            md5.update(chunk)
+    return md5.hexdigest()[:HASH_LENGTH]
+
+
+def compress(path):
+    """
+    Write a gzipped copy of the file at ``path`` to ``path.gz`` unless an up
+    to date one exists. The copy gets the modification time of the file, by
+    which it is then recognized as up to date. Return ``True`` if the copy
+    was (re)written.
+    """
+    gz_path = path + '.gz'
+    mtime = os.path.getmtime(path)
+    if os.path.exists(gz_path) and os.path.getmtime(gz_path) == mtime:
+        return False
+    tmp_path = gz_path + '.tmp'
+    with open(path, 'rb') as src:
+        gz = gzip.GzipFile(tmp_path, 'wb', 9, mtime=mtime)
+        try:
+            shutil.copyfileobj(src, gz)
+        finally:
+            gz.close()
+    os.utime(tmp_path, (mtime, mtime))
+    os.rename(tmp_path, gz_path)
+    return True
+
+
+class AssetManifest(object):
+
+    def __init__(self, static_dir):
+        self.static_dir = os.path.abspath(static_dir)
+        # Relative file path -> (mtime, hash)
+        self.hashes = {}
+        self._version = None  # Hash of all the files' hashes
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return "AssetManifest({0}, {1} files)".format(self.static_dir, len(self.hashes))
+
+    def build(self, precompress=True):
+        """
+        Hash all the files under the static directory and, if ``precompress``
+        is set, write the gzipped variants of the compressible ones. Return
+        the number of files hashed.
+        """
+        compressed = 0
+        for root, dirs, files in os.walk(self.static_dir):
+            for name in files:
+                if name.endswith('.gz') or name.endswith('.tmp'):
+                    continue
+                full = os.path.join(root, name)
+                self.digest(os.path.relpath(full, self.static_dir))
+                if not precompress or os.path.splitext(name)[1].lower() not in COMPRESSIBLE:
+                    continue
+                try:
+                    if os.path.getsize(full) >= MIN_COMPRESS_SIZE:
+                        if compress(full):
+                            compressed += 1
+                    elif os.path.exists(full + '.gz'):
+                        # Would otherwise be served in place of the file
+                        os.remove(full + '.gz')
+                except (IOError, OSError), e:
+                    log.debug("Could not compress {0}: {1}".format(full, e))
+        log.debug("Hashed {0} static files in {1} ({2} (re)compressed)"
+                  .format(len(self.hashes), self.static_dir, compressed))
+        return len(self.hashes)
+
+    def digest(self, rel_path):
+        """
+        Return the content hash of the file at ``rel_path`` (relative to the
+        static directory) or ``None`` if there is no such file. Hashes are
+        recomputed when a file's modification time changes.
+        """
+        full = os.path.join(self.static_dir, rel_path)
+        try:
+            mtime = os.path.getmtime(full)
+        except OSError:
+            return None
+        with self.lock:
+            cached = self.hashes.get(rel_path)
+            if cached and cached[0] == mtime:
+                return cached[1]
+        try:
+            digest = file_digest(full)
+        except IOError:
+            return None
+        with self.lock:
+            if not cached or cached[1] != digest:
+                self._version = None
+            self.hashes[rel_path] = (mtime, digest)
+        return digest
+
+    def version(self):
+        """
+        Return the hash identifying the content of all the files hashed so
+        far (see ``build``).
+        """
+        with self.lock:
+            if self._version is None:
+                md5 = hashlib.md5()
+                for rel_path, (mtime, digest) in sorted(self.hashes.iteritems()):
+                    md5.update('{0}\0{1}\n'.format(rel_path, digest))
+                self._version = md5.hexdigest()[:HASH_LENGTH]
+            return self._version
+
+    def url(self, path):
+        """
+        Return the content-hashed form of the static file ``path`` (e.g.,
+        ``/static/scripts/foo.js``), or ``path`` itself if the file is not
+        under the static directory. Only ``path`` is checked for changes so
+        changes to other files are picked up by the next ``build``.
+        """
+        rel_path = path.lstrip('/')
+        if rel_path.startswith('static/'):
+            rel_path = rel_path[len('static/'):]
+        if not self.digest(rel_path):
+            return path
+        return '/static/{0}/{1}/{2}'.format(HASHED_DIR, self.version(), rel_path)
+
+
+manifest = None
+
+
+def init(static_dir, precompress=True):
+    """
+    Set up the module's ``AssetManifest`` for ``static_dir`` and build it.
+    """
+    global manifest
+    manifest = AssetManifest(static_dir)
+    try:
+        manifest.build(precompress)
+    except OSError, e:
+        log.error("Could not build the static files manifest: {0}".format(e))
+    return manifest
+
+
+def static_url(path):
+    """
+    Return the content-hashed form of the static file ``path`` (see
+    ``AssetManifest.url``); ``path`` itself if the manifest is not set up.
+    """
+    if manifest is None:
+        return path
+    return manifest.url(path)
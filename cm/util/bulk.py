@@ -0,0 +1,169 @@
+"""
+Bulk operations on cloud resources.
+
+``run_concurrently`` runs a batch of independent calls (e.g., snapshot
+attribute changes) with a bounded number of threads and reports the ones that
+failed instead of aborting the batch.
+
+``BulkObjectOperations`` does the same for object copies and permission grants
+within an S3 bucket. Copies are done server-side. Grants are merged per key so
+that the ACL of each key is computed once and written with a single request,
+regardless of the number of users being given access.
+"""
+import functools
+import Queue
+import threading
+
+from boto.s3.acl import ACL, Grant, Policy
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+ALL_USERS = 'AllUsers'
+ALL_USERS_URI = 'http://acs.amazonaws.com/groups/global/AllUsers'
+
+
+def run_concurrently(tasks, max_workers=8):
+    """
+    Run ``tasks``, a list of ``(description, callable)`` pairs, using at most
+    ``max_workers`` threads. Return a dict mapping the description of each
+    task that failed to the exception it raised.
+    """
+    queue = Queue.Queue()
+    for task in tasks:
+        queue.put(task)
+    failed = {}
+    lock = threading.Lock()
+
+    def _worker():
+        while True:
+            try:
+                description, func = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                func()
+            except Exception, e:
+                log.error("{0} failed: {1}".format(description, e))
+                with lock:
+                    failed[description] = e
+    threads = [threading.Thread(target=_worker, name='bulk-{0}'.format(i))
+               for i in range(min(max_workers, len(tasks)))]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return failed
+
+
+class BulkObjectOperations(object):
+
+    def __init__(self, get_connection, bucket_name, max_workers=8):
+        """
+        Collect operations on the objects in bucket ``bucket_name`` and run
+        them all with ``run``.
+
+        :type get_connection: callable
+        :param get_connection: Returns an S3 connection; it is called from each
+                               of the worker threads (the cloud interfaces
+                               hand out a connection per thread).
+
+        :type max_workers: int
+        :param max_workers: Maximum number of requests in flight.
+        """
+        self.get_connection = get_connection
+        self.bucket_name = bucket_name
+        self.max_workers = max_workers
+        self.copies = []  # (source key name, destination key name, preserve ACL)
+        self.grants = {}  # Key name: set of (permission, grantee)
+
+    def copy(self, src_key_name, dest_key_name, preserve_acl=False):
+        """
+        Copy object ``src_key_name`` to ``dest_key_name``. The copy is done
+        before any ACLs are written.
+        """
+        self.copies.append((src_key_name, dest_key_name, preserve_acl))
+
+    def grant(self, key_name, permission, canonical_ids):
+        """
+        Give the users with ``canonical_ids`` ``permission`` (one of READ,
+        WRITE, READ_ACP, WRITE_ACP or FULL_CONTROL) on key ``key_name``.
+        """
+        self.grants.setdefault(key_name, set()).update(
+            [(permission, c_id) for c_id in canonical_ids])
+
+    def make_public(self, key_name):
+        """
+        Let anyone read key ``key_name``.
+        """
+        self.grants.setdefault(key_name, set()).add(('READ', ALL_USERS))
+
+    def _bucket(self):
+        return self.get_connection().get_bucket(self.bucket_name, validate=False)
+
+    def _copy(self, src_key_name, dest_key_name, preserve_acl):
+        log.debug("Copying '{0}/{1}' to '{0}/{2}'".format(
+                  self.bucket_name, src_key_name, dest_key_name))
+        self._bucket().copy_key(dest_key_name, self.bucket_name, src_key_name,
+                                preserve_acl=preserve_acl)
+
+    def _policy(self, owner, grants):
+        """
+        Return the ACL policy giving ``owner`` full control and ``grants``.
+        """
+        policy = Policy()
+        policy.owner = owner
+        policy.acl = ACL()
+        policy.acl.add_user_grant('FULL_CONTROL', owner.id, display_name=owner.display_name)
+        for permission, grantee in sorted(grants):
+            if grantee == ALL_USERS:
+                policy.acl.add_grant(Grant(permission=permission, type='Group',
+                                           uri=ALL_USERS_URI))
+            else:
+                policy.acl.add_user_grant(permission, grantee)
+        return policy
+
+    def _set_acl(self, key_name, policy):
+        log.debug("Setting the ACL of '{0}/{1}': {2}".format(
+                  self.bucket_name, key_name, policy.acl.grants))
+        self._bucket().set_acl(policy, key_name)
+
+    def run(self):
+        """
+        Run the copies and then write the ACLs of the keys with grants. The
+        ACL written to a key replaces the existing one so the grants of a key
+        should all be added before calling this method; the bucket owner
+        retains full control.
+
+        Return a ``Bunch`` with the number of operations that ``succeeded``
+        and a dict of the operations that ``failed``, mapping the description
+        of an operation to the reason it failed.
+        """
+        copy_tasks = {}
+        for src, dest, preserve_acl in self.copies:
+            copy_tasks[dest] = ("Copy of '{0}' to '{1}'".format(src, dest),
+                                functools.partial(self._copy, src, dest, preserve_acl))
+        failed = run_concurrently(copy_tasks.values(), self.max_workers)
+        num_ops = len(copy_tasks)
+        if self.grants:
+            num_ops += len(self.grants)
+            acl_tasks = []
+            try:
+                owner = self._bucket().get_acl().owner
+            except Exception, e:
+                log.error("Could not get the owner of bucket '{0}': {1}".format(
+                          self.bucket_name, e))
+                owner, owner_error = None, e
+            for key_name, grants in self.grants.iteritems():
+                description = "ACL update of '{0}'".format(key_name)
+                if owner is None:
+                    failed[description] = owner_error
+                elif key_name in copy_tasks and copy_tasks[key_name][0] in failed:
+                    failed[description] = 'The copy failed'
+                else:
+                    acl_tasks.append((description, functools.partial(
+                        self._set_acl, key_name, self._policy(owner, grants))))
+            failed.update(run_concurrently(acl_tasks, self.max_workers))
+        return Bunch(succeeded=num_ops - len(failed), failed=failed)
@@ -0,0 +1,187 @@
+"""
+Disk usage of directory trees.
+
+``DirectoryUsage`` computes the space used by a directory tree from the
+``lstat`` block counts of its files (like ``du``; symlinks are not followed)
+and caches the total of the files directly within each directory, keyed on
+the directory's modification time. A directory's modification time changes
+whenever entries are added to, removed from or renamed within it, so on
+subsequent calls only the directories that changed are listed again; the
+others cost a single ``lstat``. Note that files modified in place (e.g.,
+appended to) do not change the modification time of their directory; use
+``max_age`` to periodically discard the cache if that matters.
+
+For huge trees, ``estimate`` returns a size within a bounded amount of time,
+sampling the tree if it cannot be walked within the time allowed.
+"""
+import os
+import random
+import stat
+import threading
+import time
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
+class _OutOfTime(Exception):
+    pass
+
+
+def _entries(path):
+    """
+    Yield the name and ``lstat`` result of each entry of directory ``path``.
+    """
+    if scandir is not None:
+        for entry in scandir(path):
+            yield entry.name, entry.stat(follow_symlinks=False)
+    else:
+        for name in os.listdir(path):
+            yield name, os.lstat(os.path.join(path, name))
+
+
+class DirectoryUsage(object):
+
+    def __init__(self, max_age=None):
+        """
+        :type max_age: int
+        :param max_age: Number of seconds after which the cached listing of
+                        a directory is discarded even if the directory has
+                        not changed; by default, it is kept for as long as
+                        the directory does not change.
+        """
+        self.max_age = max_age
+        self.dirs = {}  # Directory path: Bunch describing the directory's files
+        self.lock = threading.Lock()
+
+    def _scan(self, path):
+        """
+        Return a ``Bunch`` with the number of bytes used by and the number of
+        the files directly within directory ``path`` along with the paths of
+        its subdirectories, using the cached listing if the directory has not
+        changed since.
+        """
+        st = os.lstat(path)
+        cached = self.dirs.get(path)
+        # A listing made within a second of the last modification is not
+        # trusted as the directory may have changed again without its
+        # modification time changing
+        if cached and cached.mtime == st.st_mtime and cached.ino == st.st_ino and \
+                cached.scanned - cached.mtime > 1 and \
+                (self.max_age is None or time.time() - cached.scanned < self.max_age):
+            return cached
+        size = st.st_blocks * 512
+        num_files = 0
+        subdirs = []
+        for name, entry_st in _entries(path):
+            if stat.S_ISDIR(entry_st.st_mode):
+                subdirs.append(os.path.join(path, name))
+            else:
+                size += entry_st.st_blocks * 512
+                num_files += 1
+        scanned = Bunch(mtime=st.st_mtime, ino=st.st_ino, scanned=time.time(),
+                        size=size, num_files=num_files, subdirs=subdirs)
+        with self.lock:
+            self.dirs[path] = scanned
+        return scanned
+
+    def _walk(self, path, deadline=None):
+        size, num_files = 0, 0
+        stack = [path]
+        while stack:
+            if deadline is not None and time.time() > deadline:
+                raise _OutOfTime()
+            try:
+                scanned = self._scan(stack.pop())
+            except OSError, e:
+                # The directory has been removed or cannot be read
+                log.debug("Cannot compute usage of {0}: {1}".format(e.filename, e))
+                continue
+            size += scanned.size
+            num_files += scanned.num_files
+            stack.extend(scanned.subdirs)
+        return size, num_files
+
+    def usage(self, path):
+        """
+        Return a ``Bunch`` with the number of bytes used by the directory tree
+        at ``path`` (``size``) and the number of files in it (``num_files``).
+        """
+        size, num_files = self._walk(os.path.abspath(path))
+        return Bunch(size=size, num_files=num_files, exact=True)
+
+    def size(self, path):
+        """
+        Return the number of bytes used by the directory tree at ``path``.
+        """
+        return self.usage(path).size
+
+    def estimate(self, path, time_limit=5):
+        """
+        Return the usage of the directory tree at ``path`` (see ``usage``),
+        spending no more than about ``time_limit`` seconds on it. If the tree
+        cannot be walked in time, estimate its usage by sampling random paths
+        from the root to a leaf directory (each sampled directory stands for
+        all its siblings), in which case the ``exact`` field of the returned
+        value is ``False``. The directories walked are cached so subsequent
+        calls get progressively closer to walking the whole tree.
+        """
+        path = os.path.abspath(path)
+        start = time.time()
+        deadline = start + time_limit
+        try:
+            # Leave half the time for sampling
+            size, num_files = self._walk(path, deadline=start + time_limit / 2.0)
+            return Bunch(size=size, num_files=num_files, exact=True)
+        except _OutOfTime:
+            pass
+        size_estimates, files_estimates = [], []
+        while not size_estimates or time.time() < deadline:
+            size, num_files, weight = 0, 0, 1
+            current = path
+            while current:
+                try:
+                    scanned = self._scan(current)
+                except OSError:
+                    break
+                size += weight * scanned.size
+                num_files += weight * scanned.num_files
+                weight *= len(scanned.subdirs)
+                current = random.choice(scanned.subdirs) if scanned.subdirs else None
+            size_estimates.append(size)
+            files_estimates.append(num_files)
+        num_samples = len(size_estimates)
+        log.debug("Estimated usage of {0} from {1} samples".format(path, num_samples))
+        return Bunch(size=sum(size_estimates) / num_samples,
+                     num_files=sum(files_estimates) / num_samples,
+                     exact=False)
+
+    def invalidate(self, path):
+        """
+        Discard the cached listings of directory ``path`` and its
+        subdirectories.
+        """
+        path = os.path.abspath(path)
+        prefix = os.path.join(path, '')
+        with self.lock:
+            for cached in self.dirs.keys():
+                if cached == path or cached.startswith(prefix):
+                    del self.dirs[cached]
+
+
+# Number of seconds after which the shared cache re-lists a directory so
+# that files changed in place are accounted for
+DIR_USAGE_MAX_AGE = 600
+
+# Directory usage is shared system-wide so the cache is too
+dir_usage = DirectoryUsage(max_age=DIR_USAGE_MAX_AGE)
@@ -0,0 +1,259 @@
+"""
+Fetch large files over HTTP(S) using concurrent range requests.
+
+``ParallelFetch`` is a read-only, file-like object: the file is split into
+chunks that a pool of worker threads downloads concurrently while ``read``
+returns the data in order, so the content can be piped straight into a
+decompressor or ``tarfile`` without first being written to disk. The workers
+stay at most ``max_ahead`` chunks ahead of the reader, which bounds the amount
+of memory used. If the transfer of a chunk is interrupted, it is resumed from
+the last byte received; the chunks received so far are kept.
+
+Servers that do not report the size of the file or do not support range
+requests are read with a single streaming request.
+"""
+import socket
+import threading
+import time
+
+import requests
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+CHUNK_SIZE = 16 * 1024 * 1024
+READ_SIZE = 256 * 1024
+
+
+class ParallelFetch(object):
+
+    def __init__(self, url, num_workers=4, chunk_size=CHUNK_SIZE, max_ahead=None,
+                 num_retries=5, timeout=60, backoff=1):
+        """
+        :type num_workers: int
+        :param num_workers: Number of chunks downloaded at the same time.
+
+        :type chunk_size: int
+        :param chunk_size: Size of a chunk (i.e., of a range request), in bytes.
+
+        :type max_ahead: int
+        :param max_ahead: Maximum number of chunks held in memory waiting to be
+                          read; defaults to twice ``num_workers``.
+
+        :type num_retries: int
+        :param num_retries: Number of consecutive attempts to resume a chunk
+                            that fail to make any progress before giving up.
+
+        :type backoff: float
+        :param backoff: Number of seconds to wait before the first retry; the
+                        wait doubles with each following retry.
+        """
+        self.url = url
+        self.num_workers = max(1, num_workers)
+        self.chunk_size = chunk_size
+        self.max_ahead = max(1, max_ahead or 2 * self.num_workers)
+        self.num_retries = num_retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.size = None  # Size of the file in bytes, if known
+        self.ranged = False  # Whether the file is fetched using range requests
+        self.bytes_read = 0
+        self.bytes_fetched = 0
+        self.num_resumed = 0
+        self.started = None
+        self._etag = None
+        self._chunks = []  # (first byte, last byte) of each chunk
+        self._fetched = {}  # Chunk index: data
+        self._next_chunk = 0  # Index of the next chunk to fetch
+        self._next_read = 0  # Index of the next chunk to read
+        self._buf = ''
+        self._pos = 0
+        self._error = None
+        self._closed = False
+        self._cond = threading.Condition()
+        self._window = threading.Semaphore(self.max_ahead)
+        self._response = None
+
+    def __repr__(self):
+        return "ParallelFetch({0})".format(self.url)
+
+    def open(self):
+        """
+        Find out the size of the file and whether the server supports range
+        requests, then start fetching. Return ``self``.
+        """
+        self.started = time.time()
+        try:
+            r = requests.head(self.url, allow_redirects=True, timeout=self.timeout,
+                              headers={'Accept-Encoding': 'identity'})
+            if r.status_code == 200:
+                size = int(r.headers.get('content-length', -1))
+                self.size = size if size >= 0 else None
+                self.ranged = r.headers.get('accept-ranges', '').lower() == 'bytes'
+                self._etag = r.headers.get('etag')
+                # Skip any redirects for the range requests
+                self.url = r.url
+        except (requests.RequestException, ValueError), e:
+            log.debug("HEAD request for {0} failed ({1}); fetching it in a "
+                      "single request".format(self.url, e))
+        if self.ranged and self.size:
+            self._chunks = [(start, min(start + self.chunk_size, self.size) - 1)
+                            for start in xrange(0, self.size, self.chunk_size)]
+            for i in range(min(self.num_workers, len(self._chunks))):
+                t = threading.Thread(target=self._worker, name='Fetch-{0}'.format(i))
+                t.daemon = True
+                t.start()
+        else:
+            self.ranged = False
+            self._response = requests.get(self.url, stream=True, timeout=self.timeout)
+            self._response.raise_for_status()
+        return self
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._fetched.clear()
+            self._cond.notify_all()
+        for i in range(self.num_workers):
+            self._window.release()
+        if self._response is not None:
+            self._response.close()
+
+    def get_progress(self):
+        """
+        Return a ``Bunch`` describing the progress of the transfer.
+        """
+        elapsed = time.time() - self.started if self.started else 0
+        return Bunch(bytes_total=self.size,
+                     bytes_read=self.bytes_read,
+                     bytes_fetched=self.bytes_fetched,
+                     pct=int(100 * self.bytes_read / self.size) if self.size else None,
+                     rate=self.bytes_fetched / elapsed if elapsed else 0,
+                     elapsed=elapsed,
+                     num_resumed=self.num_resumed)
+
+    def _add_fetched(self, num_bytes):
+        with self._cond:
+            self.bytes_fetched += num_bytes
+
+    def _fetch_chunk(self, session, first, last):
+        """
+        Fetch bytes ``first`` through ``last`` of the file, resuming from the
+        last byte received if the transfer is interrupted.
+        """
+        parts = []
+        length = last - first + 1
+        received = 0
+        failures = 0
+        while received < length:
+            headers = {'Range': 'bytes={0}-{1}'.format(first + received, last),
+                       'Accept-Encoding': 'identity'}
+            if self._etag:
+                # Fail rather than mix up the chunks if the file changes
+                headers['If-Range'] = self._etag
+            before = received
+            try:
+                r = session.get(self.url, headers=headers, stream=True, timeout=self.timeout)
+                try:
+                    if r.status_code != 206:
+                        raise IOError("Range request returned HTTP {0}".format(r.status_code))
+                    for data in r.iter_content(READ_SIZE):
+                        if self._closed:
+                            raise IOError("Fetch closed")
+                        data = data[:length - received]
+                        parts.append(data)
+                        received += len(data)
+                        self._add_fetched(len(data))
+                        if received >= length:
+                            break
+                finally:
+                    r.close()
+                if received < length:
+                    raise IOError("Connection closed after {0} of {1} bytes"
+                                  .format(received, length))
+            except (requests.RequestException, socket.error, IOError), e:
+                if self._closed:
+                    raise
+                failures = failures + 1 if received == before else 1
+                if failures > self.num_retries:
+                    raise
+                self.num_resumed += 1
+                log.debug("Resuming fetch of {0} from byte {1}: {2}".format(
+                          self.url, first + received, e))
+                time.sleep(self.backoff * 2 ** (failures - 1))
+        return ''.join(parts)
+
+    def _worker(self):
+        session = requests.Session()
+        while True:
+            self._window.acquire()
+            with self._cond:
+                if self._closed or self._error or self._next_chunk >= len(self._chunks):
+                    return
+                index = self._next_chunk
+                self._next_chunk += 1
+            try:
+                data = self._fetch_chunk(session, *self._chunks[index])
+            except Exception, e:
+                with self._cond:
+                    self._error = self._error or e
+                    self._cond.notify_all()
+                return
+            with self._cond:
+                if not self._closed:
+                    self._fetched[index] = data
+                self._cond.notify_all()
+
+    def _next_block(self):
+        """
+        Return the next block of the file's content or an empty string at
+        the end of the file.
+        """
+        if self._response is not None:
+            data = self._response.raw.read(READ_SIZE)
+            self._add_fetched(len(data))
+            return data
+        with self._cond:
+            if self._next_read >= len(self._chunks):
+                return ''
+            while self._next_read not in self._fetched:
+                if self._closed:
+                    raise IOError("Fetch of {0} closed".format(self.url))
+                if self._error is not None:
+                    raise IOError("Error fetching {0}: {1}".format(self.url, self._error))
+                self._cond.wait(1)
+            data = self._fetched.pop(self._next_read)
+            self._next_read += 1
+        self._window.release()
+        return data
+
+    def peek(self, size):
+        """
+        Return up to ``size`` bytes from the current position without
+        consuming them.
+        """
+        while len(self._buf) - self._pos < size:
+            block = self._next_block()
+            if not block:
+                break
+            self._buf, self._pos = self._buf[self._pos:] + block, 0
+        return self._buf[self._pos:self._pos + size]
+
+    def read(self, size=-1):
+        parts = []
+        wanted = size
+        while size < 0 or wanted > 0:
+            if self._pos >= len(self._buf):
+                self._buf, self._pos = self._next_block(), 0
+                if not self._buf:
+                    break
+            end = len(self._buf) if size < 0 else self._pos + wanted
+            part = self._buf[self._pos:end]
+            self._pos += len(part)
+            wanted -= len(part)
+            parts.append(part)
+        data = ''.join(parts)
+        self.bytes_read += len(data)
+        return data
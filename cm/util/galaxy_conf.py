@@ -1,5 +1,5 @@
 from os.path import join, exists
-from os import makedirs, symlink, chown, walk
+from os import makedirs, symlink, chown, walk, remove
 from shutil import copyfile, move
 
 from ConfigParser import SafeConfigParser
@@ -7,6 +7,8 @@ from pwd import getpwnam
 from grp import getgrnam
 
 from .misc import run
+from .reconcile import ensure_owner
+from .galaxy_topology import plan, process_counts
 
 import logging
 log = logging.getLogger('cloudman')
@@ -26,8 +28,17 @@ def attempt_chown_galaxy_if_exists(path):
 
 def attempt_chown_galaxy(path, recursive=False):
     """
-    Change owner of file at specified `path` to `galaxy`.
+    Change owner of file at specified `path` to `galaxy`. A `recursive`
+    change is skipped if the ownership of the tree has not drifted since it
+    was last changed (see `cm.util.reconcile`).
     """
+    if recursive:
+        ensure_owner(path, 'galaxy', 'galaxy', lambda: _chown_galaxy(path, True))
+    else:
+        _chown_galaxy(path)
+
+
+def _chown_galaxy(path, recursive=False):
     try:
         log.debug("Attemping to chown to galaxy for {0}".format(path))
         galaxy_uid = getpwnam("galaxy")[2]
@@ -40,7 +51,7 @@ def attempt_chown_galaxy(path, recursive=False):
                 for f in files:
                     chown(join(root, f), galaxy_uid, galaxy_gid)
     except BaseException:
-        run("chown galaxy:galaxy '%s'" % path)
+        return run("chown galaxy:galaxy '%s'" % path)
 
 
 def populate_admin_users(option_manager, admins_list=[]):
@@ -80,45 +91,39 @@ def populate_dynamic_options(option_manager):
 
 # High-level functions that utilize option_manager interface (defined below)
 # to configure Galaxy's options.
-def populate_process_options(option_manager):
+def populate_process_options(option_manager, topology=None, removed=()):
     """
     Use `option_manager` to populate process (handler, manager, web) sections
-    for Galaxy.
+    for Galaxy from `topology` (a `galaxy_topology.GalaxyTopology`, planned
+    from the configured or sized process counts if not given), removing the
+    sections of the `removed` processes.
     """
     app = option_manager.app
-    web_thread_count = int(app.config.web_thread_count)
-    handler_thread_count = int(app.config.get("handler_thread_count", 1))
-    # Setup web threads
-    [__add_server_process(option_manager, i, "web", 8080)
-     for i in range(web_thread_count)]
-    # Setup handler threads
-    handlers = [__add_server_process(option_manager, i, "handler", 9080)
-                for i in range(handler_thread_count)]
-    # Setup manager thread
-    __add_server_process(option_manager, 0, "manager", 8079)
-    process_properties = {"job_manager": "manager0",
-                          "job_handlers": ",".join(handlers)}
+    if topology is None:
+        topology = plan(*process_counts(app))
+    for process in topology.processes:
+        __add_server_process(option_manager, process)
+    for process in removed:
+        option_manager.remove_properties(section="server:%s" % process.name,
+                                         description="server_%s" % process.name)
+    process_properties = {"job_manager": topology.manager.name,
+                          "job_handlers": ",".join([h.name for h in topology.handlers])}
     option_manager.set_properties(process_properties)
+    return topology
 
 
-def __add_server_process(option_manager, index, prefix, initial_port):
+def __add_server_process(option_manager, process):
     app = option_manager.app
-    port = initial_port + index
     threads = app.config.get("threadpool_workers", "7")
     server_options = {"use": "egg:Paste#http",
-                      "port": port,
+                      "port": process.port,
                       "use_threadpool": True,
                       "threadpool_workers": threads
                       }
-    server_name = "%s%d" % (prefix, index)
-    if port == 8080:
-        # Special case, server on port 8080 must be called main unless we want
-        # to start deleting chunks of galaxy.ini.
-        server_name = "main"
     option_manager.set_properties(server_options,
-                                  section="server:%s" % server_name,
-                                  description="server_%s" % server_name)
-    return server_name
+                                  section="server:%s" % process.name,
+                                  description="server_%s" % process.name)
+    return process.name
 
 
 # Abstraction for interacting with Galaxy's options
@@ -132,15 +137,17 @@ def galaxy_option_manager(app):
     return option_manager
 
 
-def populate_galaxy_paths(option_manager):
+def populate_galaxy_paths(option_manager, database_port=None):
     """
     Turn ``path_resolver`` paths and configurations into Galaxy options using
-    specified ``option_manager``.
+    specified ``option_manager``. Galaxy connects to its database on
+    ``database_port`` (e.g., a connection pooler's), defaulting to
+    PostgreSQL's port.
     """
     properties = {}
     path_resolver = option_manager.app.path_resolver
     properties["database_connection"] = "postgres://galaxy@localhost:{0}/galaxy"\
-        .format(path_resolver.psql_db_port)
+        .format(database_port or path_resolver.psql_db_port)
     properties["use_pbkdf2"] = "False"  # Required for FTP
     properties["tool_data_path"] = path_resolver.galaxy_indices
     properties["len_file_path"] = join(path_resolver.galaxy_home, "tool-data", "len")
@@ -207,6 +214,24 @@ class FileGalaxyOptionManager(object):
         move(new_config_file_path, config_file_path)
         attempt_chown_galaxy(config_file_path)
 
+    def remove_properties(self, section, description=None, priority_offset=0):
+        """
+        Remove `section` from Galaxy's conf file `OPTIONS_FILE_NAME`.
+        """
+        galaxy_config_dir = self.app.path_resolver.galaxy_config_dir
+        config_file_path = join(galaxy_config_dir, OPTIONS_FILE_NAME)
+        if not exists(config_file_path):
+            return
+        parser = SafeConfigParser()
+        with open(config_file_path, 'rt') as configfile:
+            parser.readfp(configfile)
+        if parser.remove_section(section):
+            new_config_file_path = join(galaxy_config_dir, '{0}.new'.format(OPTIONS_FILE_NAME))
+            with open(new_config_file_path, 'wt') as output_file:
+                parser.write(output_file)
+            move(new_config_file_path, config_file_path)
+            attempt_chown_galaxy(config_file_path)
+
 
 class DirectoryGalaxyOptionManager(object):
     """
@@ -259,3 +284,14 @@ class DirectoryGalaxyOptionManager(object):
         props_str = "\n".join(
             ["%s=%s" % (k, v) for k, v in properties.iteritems()])
         open(conf_file, "w").write("[%s]\n%s" % (section, props_str))
+
+    def remove_properties(self, section, description=None, priority_offset=0):
+        """
+        Remove the override file written by `set_properties` for `section`
+        with the same `description` and `priority_offset`.
+        """
+        priority = int(self.app.config.get("galaxy_option_priority", "400")) + priority_offset
+        conf_file_name = "%s_cloudman_override_%s.ini" % (str(priority), description)
+        conf_file = join(self.conf_dir, conf_file_name)
+        if exists(conf_file):
+            remove(conf_file)
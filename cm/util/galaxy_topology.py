@@ -0,0 +1,189 @@
+"""
+The process topology of a Galaxy running multiple processes.
+
+``plan`` lays out the web, job handler and job manager processes and their
+ports; the resulting ``GalaxyTopology`` is the single model both Galaxy's
+server sections (see ``galaxy_conf.populate_process_options``) and Nginx's
+upstream servers are generated from. Unless set in user data, the number of
+processes is sized from the master's CPUs and memory (see
+``process_counts``). Ports come from a ``PortAllocator``, which hands out the
+first free port at or above a base port, and are kept by the processes
+across plans so a topology can be resized while Galaxy is running.
+"""
+import json
+import socket
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+WEB_BASE_PORT = 8080
+HANDLER_BASE_PORT = 9080
+MANAGER_BASE_PORT = 8079
+MAX_WEB_PROCESSES = 16
+MAX_HANDLER_PROCESSES = 8
+# Estimated memory used by a Galaxy process, in kB
+PROCESS_MEMORY = 1024 * 1024
+
+
+def port_is_free(port, host='127.0.0.1'):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    try:
+        sock.bind((host, port))
+        return True
+    except socket.error:
+        return False
+    finally:
+        sock.close()
+
+
+class PortAllocator(object):
+
+    def __init__(self, is_free=port_is_free):
+        self.is_free = is_free
+        self.taken = set()
+
+    def reserve(self, port):
+        self.taken.add(port)
+
+    def allocate(self, base):
+        """
+        Return the first port at or above ``base`` that is neither reserved
+        nor in use, and reserve it.
+        """
+        port = base
+        while port in self.taken or not self.is_free(port):
+            port += 1
+            if port > 65535:
+                raise ValueError("No free port above {0}".format(base))
+        self.taken.add(port)
+        return port
+
+
+def size_processes(num_cpus, total_memory):
+    """
+    Return the number of web and job handler processes suitable for a master
+    with ``num_cpus`` CPUs and ``total_memory`` kB of memory, as a tuple. Half
+    of the memory is left for the database, the job manager and jobs.
+    """
+    num_cpus = max(1, int(num_cpus))
+    web = max(1, min(num_cpus / 2, MAX_WEB_PROCESSES))
+    handlers = max(1, min(num_cpus / 4, MAX_HANDLER_PROCESSES))
+    # The job manager process takes one of the processes that fit
+    fit = max(3, total_memory / 2 / PROCESS_MEMORY) - 1
+    if web + handlers > fit:
+        web = max(1, fit * 2 / 3)
+        handlers = max(1, fit - web)
+    return web, handlers
+
+
+def process_counts(app):
+    """
+    Return the number of Galaxy web and job handler processes, as a tuple:
+    the ``web_thread_count`` and ``handler_thread_count`` user data options
+    if set, otherwise sized for the master instance.
+    """
+    web = app.config.get('web_thread_count')
+    handlers = app.config.get('handler_thread_count')
+    if web is None or handlers is None:
+        auto_web, auto_handlers = size_processes(app.manager.num_cpus,
+                                                 app.manager.total_memory)
+        web = auto_web if web is None else web
+        handlers = auto_handlers if handlers is None else handlers
+    return int(web), int(handlers)
+
+
+def num_processes(app):
+    """
+    Return the total number of Galaxy processes (e.g., for sizing database
+    connections).
+    """
+    if not app.config.multiple_processes:
+        return 1
+    web, handlers = process_counts(app)
+    return web + handlers + 1
+
+
+class GalaxyTopology(object):
+
+    def __init__(self, processes):
+        # A list of Bunches with a process' `name`, `kind` and `port`
+        self.processes = processes
+
+    def __repr__(self):
+        return "GalaxyTopology({0})".format(
+            ', '.join(['{0}:{1}'.format(p.name, p.port) for p in self.processes]))
+
+    def _of_kind(self, kind):
+        return [p for p in self.processes if p.kind == kind]
+
+    @property
+    def web(self):
+        return self._of_kind('web')
+
+    @property
+    def handlers(self):
+        return self._of_kind('handler')
+
+    @property
+    def manager(self):
+        return self._of_kind('manager')[0]
+
+    def get(self, name):
+        for p in self.processes:
+            if p.name == name:
+                return p
+        return None
+
+    def names(self):
+        return [p.name for p in self.processes]
+
+    def upstream_servers(self, host='127.0.0.1'):
+        """
+        Return the Nginx upstream server lines for the web processes.
+        """
+        return ['server {0}:{1};'.format(host, p.port) for p in self.web]
+
+    def to_dict(self):
+        return {'processes': [dict(p.items()) for p in self.processes]}
+
+    def dumps(self):
+        return json.dumps(self.to_dict())
+
+    @staticmethod
+    def loads(data):
+        return GalaxyTopology([Bunch(name=p['name'], kind=p['kind'], port=int(p['port']))
+                               for p in json.loads(data)['processes']])
+
+
+def _process_name(kind, index):
+    # Galaxy's default server section is `main` so the first web process
+    # must be called that
+    if kind == 'web' and index == 0:
+        return 'main'
+    return '{0}{1}'.format(kind, index)
+
+
+def plan(num_web, num_handlers, previous=None, allocator=None):
+    """
+    Return a ``GalaxyTopology`` with ``num_web`` web and ``num_handlers`` job
+    handler processes plus a job manager. Processes also in the ``previous``
+    topology keep their ports; the others are allocated ports with
+    ``allocator``.
+    """
+    allocator = allocator or PortAllocator()
+    if previous:
+        for p in previous.processes:
+            allocator.reserve(p.port)
+    processes = []
+    for kind, count, base in [('web', num_web, WEB_BASE_PORT),
+                              ('handler', num_handlers, HANDLER_BASE_PORT),
+                              ('manager', 1, MANAGER_BASE_PORT)]:
+        for i in range(max(1, count)):
+            name = _process_name(kind, i)
+            existing = previous.get(name) if previous else None
+            port = existing.port if existing else allocator.allocate(base)
+            processes.append(Bunch(name=name, kind=kind, port=port))
+    return GalaxyTopology(processes)
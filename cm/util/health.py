@@ -0,0 +1,199 @@
+"""
+Health probes for the processes CloudMan manages.
+
+HTTP and TCP checks are registered with the shared ``prober`` and run in the
+background, concurrently and with strict timeouts; the latest result of each
+probe is cached along with the time it was obtained. This keeps network I/O
+off the monitor thread: service ``status`` methods read the cached results
+(see ``HealthProber.is_up``) and only check inline, bounded by the probe's
+timeout, when there is no sufficiently recent result.
+"""
+import httplib
+import socket
+import threading
+import time
+import urlparse
+
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Age (in seconds) of the probe results accepted by service status checks
+STATUS_MAX_AGE = 30
+
+
+class Probe(object):
+
+    def __init__(self, name, check, description, interval, timeout):
+        self.name = name
+        self.check = check  # Callable returning (ok, detail)
+        self.description = description
+        self.interval = interval
+        self.timeout = timeout
+        self.result = None
+        self.last_started = 0
+        self.in_flight = False
+
+    def run(self):
+        started = time.time()
+        try:
+            ok, detail = self.check(self.timeout)
+        except Exception, e:
+            ok, detail = False, str(e) or e.__class__.__name__
+        result = Bunch(ok=ok, detail=detail, checked_at=time.time(),
+                       latency=time.time() - started)
+        self.result = result
+        return result
+
+
+def _http_check(url, method, ok_statuses):
+    parsed = urlparse.urlparse(url)
+    path = parsed.path or '/'
+    if parsed.query:
+        path += '?' + parsed.query
+    conn_class = httplib.HTTPSConnection if parsed.scheme == 'https' else httplib.HTTPConnection
+
+    def check(timeout):
+        conn = conn_class(parsed.hostname, parsed.port, timeout=timeout)
+        try:
+            conn.request(method, path)
+            status = conn.getresponse().status
+        finally:
+            conn.close()
+        return status < 400 or status in ok_statuses, status
+    return check
+
+
+def _tcp_check(host, port):
+    def check(timeout):
+        sock = socket.create_connection((host, port), timeout)
+        sock.close()
+        return True, 'connected'
+    return check
+
+
+class HealthProber(object):
+
+    def __init__(self, max_workers=8, tick=0.5):
+        """
+        :type max_workers: int
+        :param max_workers: Maximum number of probes running at the same time.
+
+        :type tick: float
+        :param tick: Number of seconds between checking which probes are due.
+        """
+        self.probes = {}  # Probe name: Probe
+        self.lock = threading.Lock()
+        self.workers = threading.BoundedSemaphore(max_workers)
+        self.tick = tick
+        self.thread = None
+
+    def http(self, name, url, method='HEAD', timeout=5, interval=10, ok_statuses=(403, 405)):
+        """
+        Register a probe named ``name`` that sends an HTTP ``method`` request
+        to ``url``. The target is deemed up if it responds within ``timeout``
+        seconds with a non-error status or one of ``ok_statuses``. Registering
+        a probe that already exists is a no-op. Return ``name``.
+        """
+        return self._register(name, _http_check(url, method, ok_statuses),
+                              '{0} {1}'.format(method, url), interval, timeout)
+
+    def tcp(self, name, host, port, timeout=2, interval=10):
+        """
+        Register a probe named ``name`` that checks if a connection to
+        ``host``:``port`` can be established within ``timeout`` seconds.
+        Registering a probe that already exists is a no-op. Return ``name``.
+        """
+        return self._register(name, _tcp_check(host, port),
+                              'tcp {0}:{1}'.format(host, port), interval, timeout)
+
+    def _register(self, name, check, description, interval, timeout):
+        with self.lock:
+            probe = self.probes.get(name)
+            if probe is None or probe.description != description:
+                self.probes[name] = Probe(name, check, description, interval, timeout)
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self._run, name='HealthProber')
+                self.thread.daemon = True
+                self.thread.start()
+        return name
+
+    def remove(self, name):
+        with self.lock:
+            self.probes.pop(name, None)
+
+    def result(self, name):
+        """
+        Return the latest result of the probe ``name`` as a ``Bunch`` with
+        ``ok``, ``detail``, ``checked_at``, ``latency`` and ``age`` fields, or
+        ``None`` if the probe has not completed yet.
+        """
+        probe = self.probes.get(name)
+        if probe is None or probe.result is None:
+            return None
+        result = Bunch(**probe.result.__dict__)
+        result.age = time.time() - result.checked_at
+        return result
+
+    def is_up(self, name, max_age=None):
+        """
+        Return ``True`` if the latest result of probe ``name`` was a success.
+        If there is no result yet or the result is older than ``max_age``
+        seconds, run the probe now (this blocks for up to the probe's
+        timeout).
+        """
+        probe = self.probes.get(name)
+        if probe is None:
+            raise KeyError("No health probe named '{0}'".format(name))
+        result = self.result(name)
+        if result is None or (max_age is not None and result.age > max_age):
+            result = probe.run()
+        return result.ok
+
+    def get_results(self):
+        """
+        Return a dict with the latest result of each probe.
+        """
+        results = {}
+        for name in self.probes.keys():
+            result = self.result(name)
+            results[name] = {'target': self.probes[name].description,
+                             'ok': result.ok if result else None,
+                             'detail': str(result.detail) if result else None,
+                             'age': round(result.age, 2) if result else None,
+                             'latency': round(result.latency, 4) if result else None}
+        return results
+
+    def _run_probe(self, probe):
+        try:
+            previous = probe.result
+            result = probe.run()
+            if previous is None or previous.ok != result.ok:
+                log.debug("Health probe {0} ({1}) is {2}: {3}".format(
+                          probe.name, probe.description,
+                          'up' if result.ok else 'down', result.detail))
+        finally:
+            probe.in_flight = False
+            self.workers.release()
+
+    def _run(self):
+        while True:
+            now = time.time()
+            with self.lock:
+                due = [p for p in self.probes.values()
+                       if not p.in_flight and p.last_started + p.interval <= now]
+                for probe in due:
+                    probe.in_flight = True
+                    probe.last_started = now
+            for probe in due:
+                self.workers.acquire()
+                t = threading.Thread(target=self._run_probe, args=(probe,),
+                                     name='HealthProbe-{0}'.format(probe.name))
+                t.daemon = True
+                t.start()
+            time.sleep(self.tick)
+
+
+# All the services share a single prober
+prober = HealthProber()
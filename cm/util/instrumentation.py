@@ -0,0 +1,231 @@
+"""
+Always-on, low-overhead instrumentation of CloudMan.
+
+Records:
+    - latency histograms for each web controller action and monitor step
+    - the number of forked processes (via ``misc.run``, ``misc.getoutput``
+      and the ``commands`` module) and their wall time per call site
+    - cloud API call counts and latencies (see ``cm.clouds.connections``)
+    - the latest health probe results (see ``cm.util.health``)
+
+The collected data is available as a dict (``get_stats``) and in the
+Prometheus text exposition format (``to_prometheus``).
+"""
+import commands
+import os
+import sys
+import threading
+import time
+
+# Upper bounds (in seconds) of the latency histogram buckets
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+_lock = threading.Lock()
+_request_latency = {}  # controller.action: Histogram
+_monitor_steps = {}  # step name: Histogram
+_subprocess_stats = {}  # (kind, call site): Histogram
+_original_getstatusoutput = commands.getstatusoutput
+# Frames from these files are skipped when looking up the call site
+_SKIP_FILES = set()
+
+
+class Histogram(object):
+    """
+    A cumulative histogram of durations, along with their count and sum.
+    """
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        # Called while holding ``_lock``
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def cumulative_counts(self):
+        counts, total = [], 0
+        for c in self.counts:
+            total += c
+            counts.append(total)
+        return counts
+
+    def to_dict(self):
+        return {'count': self.count,
+                'sum': round(self.sum, 4),
+                'mean': round(self.sum / self.count, 4) if self.count else 0,
+                'max': round(self.max, 4),
+                'buckets': dict(zip([str(b) for b in self.buckets], self.cumulative_counts()))}
+
+
+def _observe(registry, key, duration):
+    with _lock:
+        hist = registry.get(key)
+        if hist is None:
+            hist = registry[key] = Histogram()
+        hist.observe(duration)
+
+
+def record_request(controller, action, duration):
+    """
+    Record the time (in seconds) it took to handle a request for ``action``
+    of ``controller``.
+    """
+    _observe(_request_latency, "{0}.{1}".format(controller, action), duration)
+
+
+def record_monitor_step(step, duration):
+    """
+    Record the time (in seconds) it took the cluster monitor to complete
+    ``step`` (e.g., checking the status of a service).
+    """
+    _observe(_monitor_steps, step, duration)
+
+
+def call_site(depth=1):
+    """
+    Return a ``file:line (function)`` string identifying the caller, skipping
+    over the frames from the instrumented helper modules.
+    """
+    try:
+        frame = sys._getframe(depth)
+    except ValueError:
+        return 'unknown'
+    while frame and os.path.splitext(frame.f_code.co_filename)[0] in _SKIP_FILES:
+        frame = frame.f_back
+    if frame is None:
+        return 'unknown'
+    filename = frame.f_code.co_filename
+    idx = filename.rfind('/cm/')
+    if idx != -1:
+        filename = filename[idx + 1:]
+    return "{0}:{1} ({2})".format(filename, frame.f_lineno, frame.f_code.co_name)
+
+
+def skip_file(filename):
+    """
+    Do not attribute subprocess calls to frames from ``filename`` (a module's
+    ``__file__``) but to its callers.
+    """
+    _SKIP_FILES.add(os.path.splitext(filename)[0])
+
+
+def record_subprocess(kind, site, duration):
+    """
+    Record a forked process of ``kind`` (e.g., ``run``), started from
+    ``site``, that took ``duration`` seconds to complete.
+    """
+    _observe(_subprocess_stats, (kind, site), duration)
+
+
+def _getstatusoutput(cmd):
+    start = time.time()
+    try:
+        return _original_getstatusoutput(cmd)
+    finally:
+        record_subprocess('getoutput', call_site(), time.time() - start)
+
+
+def install():
+    """
+    Start recording processes forked via the ``commands`` module. Note that
+    ``commands.getoutput`` is implemented on top of ``getstatusoutput`` so
+    wrapping the latter covers both.
+    """
+    commands.getstatusoutput = _getstatusoutput
+
+
+skip_file(__file__)
+skip_file(commands.__file__)
+
+
+def reset():
+    with _lock:
+        _request_latency.clear()
+        _monitor_steps.clear()
+        _subprocess_stats.clear()
+
+
+def get_stats():
+    """
+    Return a dict with all the collected data.
+    """
+    from cm.clouds.connections import get_call_stats
+    from cm.util.health import prober
+    with _lock:
+        requests = dict([(k, h.to_dict()) for k, h in _request_latency.iteritems()])
+        steps = dict([(k, h.to_dict()) for k, h in _monitor_steps.iteritems()])
+        processes = [dict(kind=k[0], site=k[1], **h.to_dict())
+                     for k, h in _subprocess_stats.iteritems()]
+    processes.sort(key=lambda p: p['sum'], reverse=True)
+    return {'requests': requests,
+            'monitor_steps': steps,
+            'subprocesses': processes,
+            'cloud_calls': get_call_stats(),
+            'health_probes': prober.get_results()}
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    return ','.join(['{0}="{1}"'.format(k, _escape(v)) for k, v in labels])
+
+
+def _histogram_lines(name, labels, hist):
+    lines = []
+    for bound, count in zip(hist.buckets, hist.cumulative_counts()):
+        lines.append('{0}_bucket{{{1}}} {2}'.format(
+            name, _labels(labels + [('le', bound)]), count))
+    lines.append('{0}_bucket{{{1}}} {2}'.format(
+        name, _labels(labels + [('le', '+Inf')]), hist.count))
+    lines.append('{0}_sum{{{1}}} {2}'.format(name, _labels(labels), hist.sum))
+    lines.append('{0}_count{{{1}}} {2}'.format(name, _labels(labels), hist.count))
+    return lines
+
+
+def to_prometheus():
+    """
+    Return the collected data in the Prometheus text exposition format.
+    """
+    from cm.clouds.connections import get_call_stats
+    lines = ['# HELP cloudman_request_seconds Time spent handling web requests.',
+             '# TYPE cloudman_request_seconds histogram']
+    with _lock:
+        for key in sorted(_request_latency):
+            controller, action = key.split('.', 1)
+            lines.extend(_histogram_lines('cloudman_request_seconds',
+                                          [('controller', controller), ('action', action)],
+                                          _request_latency[key]))
+        lines.extend(['# HELP cloudman_monitor_step_seconds Time spent in cluster monitor steps.',
+                      '# TYPE cloudman_monitor_step_seconds histogram'])
+        for step in sorted(_monitor_steps):
+            lines.extend(_histogram_lines('cloudman_monitor_step_seconds', [('step', step)],
+                                          _monitor_steps[step]))
+        lines.extend(['# HELP cloudman_subprocess_seconds Wall time of forked processes.',
+                      '# TYPE cloudman_subprocess_seconds histogram'])
+        for kind, site in sorted(_subprocess_stats):
+            lines.extend(_histogram_lines('cloudman_subprocess_seconds',
+                                          [('kind', kind), ('site', site)],
+                                          _subprocess_stats[(kind, site)]))
+    cloud_stats = get_call_stats()
+    for metric, key, help in [('cloudman_cloud_calls_total', 'calls', 'Cloud API calls.'),
+                              ('cloudman_cloud_call_errors_total', 'errors', 'Failed cloud API calls.'),
+                              ('cloudman_cloud_call_throttled_total', 'throttled',
+                               'Throttled cloud API calls.'),
+                              ('cloudman_cloud_call_seconds_total', 'total_time',
+                               'Time spent in cloud API calls.')]:
+        lines.extend(['# HELP {0} {1}'.format(metric, help),
+                      '# TYPE {0} counter'.format(metric)])
+        for endpoint in sorted(cloud_stats):
+            lines.append('{0}{{{1}}} {2}'.format(
+                metric, _labels([('endpoint', endpoint)]), cloud_stats[endpoint][key]))
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,242 @@
+"""
+Node utilization metrics.
+
+Each node samples its own metrics (load, CPU and I/O wait, memory and disk
+usage) straight from ``/proc`` using a ``NodeSampler``; workers send them to
+the master with their ``NODE_STATUS`` messages. On the master, the samples
+are kept in the shared ``node_metrics`` store, which keeps a fixed amount of
+history for each metric of each node at several resolutions (see ``TIERS``):
+samples are averaged into fixed-size ring buffers so the memory used does
+not grow with time.
+"""
+import array
+import os
+import threading
+import time
+
+import logging
+log = logging.getLogger('cloudman')
+
+METRICS = ('load1', 'load5', 'load15', 'cpu', 'iowait', 'mem_used', 'disk_used')
+# Resolutions of the stored metrics: (name, seconds per point, number of points)
+TIERS = (('10s', 10, 360),  # 1 hour
+         ('1m', 60, 1440),  # 1 day
+         ('10m', 600, 1008))  # 1 week
+NAN = float('nan')
+
+
+class NodeSampler(object):
+
+    def __init__(self, disk_path='/', proc='/proc'):
+        """
+        Sample the metrics of the local node. CPU and I/O wait percentages
+        are computed over the time since the previous sample so they are not
+        included in the first one.
+
+        :type disk_path: string
+        :param disk_path: Path on the file system whose usage is reported.
+        """
+        self.disk_path = disk_path
+        self.proc = proc
+        self.prev_cpu = None
+
+    def _read(self, name):
+        with open(os.path.join(self.proc, name)) as f:
+            return f.read()
+
+    def _load(self, values):
+        load = self._read('loadavg').split()
+        values['load1'], values['load5'], values['load15'] = [float(l) for l in load[:3]]
+
+    def _cpu(self, values):
+        # cpu user nice system idle iowait irq softirq steal ...
+        fields = [int(v) for v in self._read('stat').split('\n', 1)[0].split()[1:9]]
+        total, idle, iowait = sum(fields), fields[3], fields[4]
+        if self.prev_cpu:
+            d_total = total - self.prev_cpu[0]
+            if d_total > 0:
+                values['cpu'] = 100.0 * (d_total - (idle + iowait - self.prev_cpu[1])) / d_total
+                values['iowait'] = 100.0 * (iowait - self.prev_cpu[2]) / d_total
+        self.prev_cpu = (total, idle + iowait, iowait)
+
+    def _memory(self, values):
+        meminfo = {}
+        for line in self._read('meminfo').splitlines():
+            name, value = line.split(':', 1)
+            meminfo[name] = int(value.split()[0])
+        available = meminfo.get('MemAvailable')
+        if available is None:
+            available = sum(meminfo.get(k, 0) for k in ('MemFree', 'Buffers', 'Cached'))
+        values['mem_used'] = 100.0 * (meminfo['MemTotal'] - available) / meminfo['MemTotal']
+
+    def _disk(self, values):
+        st = os.statvfs(self.disk_path)
+        if st.f_blocks:
+            values['disk_used'] = 100.0 * (st.f_blocks - st.f_bfree) / st.f_blocks
+
+    def read(self):
+        """
+        Return a dict with the current value of each of the ``METRICS`` that
+        could be read.
+        """
+        values = {}
+        for reader in (self._load, self._cpu, self._memory, self._disk):
+            try:
+                reader(values)
+            except (IOError, OSError, ValueError, KeyError, IndexError), e:
+                log.debug("Error reading node metrics ({0}): {1}".format(reader.__name__, e))
+        return values
+
+
+def load_string(values):
+    """
+    Return the load averages in ``values`` in the ``/proc/loadavg`` format
+    (e.g., ``0.00 0.02 0.39``), as reported by the workers.
+    """
+    return ' '.join(['{0:.2f}'.format(values.get(m, 0)) for m in ('load1', 'load5', 'load15')])
+
+
+def encode(values):
+    """
+    Encode ``values`` (as returned by ``NodeSampler.read``) for a message.
+    """
+    return ','.join(['{0}={1:.2f}'.format(k, v) for k, v in sorted(values.items())])
+
+
+def decode(text):
+    """
+    Decode metrics encoded with ``encode``, skipping any invalid values.
+    """
+    values = {}
+    for item in text.split(','):
+        name, sep, value = item.partition('=')
+        try:
+            values[name.strip()] = float(value)
+        except ValueError:
+            pass
+    return values
+
+
+class _Series(object):
+    """
+    The values of a metric at one resolution, kept in a ring buffer. The
+    samples within each ``step`` seconds are averaged into a single value.
+    """
+    __slots__ = ('step', 'values', 'last', 'bucket', 'total', 'count')
+
+    def __init__(self, step, size):
+        self.step = step
+        self.values = array.array('f', [NAN]) * size
+        self.last = None  # Number of the newest bucket written to values
+        self.bucket = None  # Number of the bucket being filled
+        self.total = 0.0
+        self.count = 0
+
+    def _flush(self):
+        if self.bucket is None or not self.count:
+            return
+        size = len(self.values)
+        if self.last is not None:
+            # Mark the buckets with no samples as such
+            for b in xrange(max(self.last + 1, self.bucket - size + 1), self.bucket):
+                self.values[b % size] = NAN
+        self.values[self.bucket % size] = self.total / self.count
+        self.last = self.bucket
+
+    def add(self, t, value):
+        bucket = int(t // self.step)
+        if self.bucket is not None and bucket < self.bucket:
+            return  # Out of order
+        if bucket != self.bucket:
+            self._flush()
+            self.bucket, self.total, self.count = bucket, 0.0, 0
+        self.total += value
+        self.count += 1
+
+    def points(self, since=None):
+        """
+        Return the ``(timestamp, value)`` pairs, oldest first, including the
+        (partial) value of the current bucket.
+        """
+        points = []
+        if self.last is not None:
+            size = len(self.values)
+            for b in xrange(self.last - size + 1, self.last + 1):
+                value = self.values[b % size]
+                if value == value and (since is None or b * self.step >= since):
+                    points.append((b * self.step, value))
+        if self.count and self.bucket != self.last:
+            points.append((self.bucket * self.step, self.total / self.count))
+        return points
+
+
+class MetricsStore(object):
+
+    def __init__(self, tiers=TIERS):
+        self.tiers = tiers
+        self.series = {}  # (node, metric): {resolution: _Series}
+        self.lock = threading.Lock()
+
+    def add(self, node, values, t=None):
+        """
+        Record the metric ``values`` (a dict) of ``node`` (e.g., an instance
+        ID) sampled at time ``t`` (defaults to now).
+        """
+        t = t or time.time()
+        with self.lock:
+            for metric, value in values.iteritems():
+                if value is None:
+                    continue
+                series = self.series.get((node, metric))
+                if series is None:
+                    series = dict([(name, _Series(step, size)) for name, step, size in self.tiers])
+                    self.series[(node, metric)] = series
+                for s in series.itervalues():
+                    s.add(t, float(value))
+
+    def remove(self, node):
+        with self.lock:
+            for key in self.series.keys():
+                if key[0] == node:
+                    del self.series[key]
+
+    def nodes(self):
+        return sorted(set([node for node, metric in self.series.keys()]))
+
+    def query(self, node, metric, resolution='10s', window=None):
+        """
+        Return the values of ``metric`` for ``node`` at ``resolution`` (one of
+        the ``TIERS``) as a list of ``(timestamp, value)`` pairs, oldest
+        first, optionally only for the last ``window`` seconds.
+        """
+        since = time.time() - window if window else None
+        with self.lock:
+            series = self.series.get((node, metric))
+            if series is None or resolution not in series:
+                return []
+            return series[resolution].points(since)
+
+    def mean(self, node, metric, window, resolution='10s'):
+        """
+        Return the mean value of ``metric`` for ``node`` over the last
+        ``window`` seconds or ``None`` if there are no values.
+        """
+        points = self.query(node, metric, resolution, window)
+        if not points:
+            return None
+        return sum([v for t, v in points]) / len(points)
+
+    def to_dict(self, node, resolution='1m', window=None):
+        """
+        Return the metrics of ``node`` at ``resolution`` as a dict suitable
+        for JSON encoding (e.g., to draw sparklines).
+        """
+        return {'node': node,
+                'resolution': resolution,
+                'metrics': dict([(metric, [[t, round(v, 2)] for t, v in
+                                           self.query(node, metric, resolution, window)])
+                                 for metric in METRICS])}
+
+
+# The master keeps the metrics of all the nodes in a single store
+node_metrics = MetricsStore()
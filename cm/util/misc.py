@@ -24,8 +24,12 @@ from boto.s3.key import Key
 from tempfile import mkstemp, NamedTemporaryFile
 
 from cm.services import ServiceRole
+from cm.util import instrumentation
+from cm.util.du import dir_usage
 
 log = logging.getLogger('cloudman')
+# Attribute the processes forked by the helpers here to their callers
+instrumentation.skip_file(__file__)
 
 
 def load_yaml_file(filename):
@@ -831,9 +835,11 @@ def run(cmd, err=None, ok=None, quiet=False, user=None):
         ok = "'%s' command OK" % cmd
     if user:
         cmd = '/bin/su - {0} -c "{1}"'.format(user, cmd)
+    start = time.time()
     process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE,
                                stderr=subprocess.PIPE, cwd=None)
     stdout, stderr = process.communicate()
+    instrumentation.record_subprocess('run', instrumentation.call_site(), time.time() - start)
     if process.returncode == 0:
         if not quiet:
             log.debug(ok)
@@ -1143,14 +1149,14 @@ def meminfo():
 
 def get_dir_size(path):
     """
-    Return the size of directory at `path` (and it's subdirectories), in bytes.
+    Return the disk space used by directory at `path` (and it's subdirectories),
+    in bytes, as allocated on disk (i.e., block counts, like ``du``, rather
+    than the files' apparent sizes; symlinks are not followed). Directory
+    listings are cached (see ``cm.util.du``) so repeated calls only list the
+    directories that changed; files changed in place without their directory
+    changing may go unnoticed for up to ``du.DIR_USAGE_MAX_AGE`` seconds.
     """
-    total_size = 0
-    for dirpath, dirnames, filenames in os.walk(path):
-        for f in filenames:
-            fp = os.path.join(dirpath, f)
-            total_size += os.path.getsize(fp)
-    return total_size
+    return dir_usage.size(path)
 
 
 def nice_size(size):
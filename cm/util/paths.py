@@ -20,6 +20,10 @@ P_LN = "/bin/ln"
 C_PSQL_PORT = "5930"
 USER_DATA_FILE = "userData.yaml"
 SYSTEM_MESSAGES_FILE = '/mnt/cm/sysmsg.txt'
+# Kept outside of CloudMan's home, which is replaced on restarts
+INSTANCE_METADATA_FILE = '/var/lib/cloudman/instance_metadata.json'
+SETUP_FINGERPRINTS_FILE = '/var/lib/cloudman/setup_fingerprints.json'
+SERVICE_MANIFEST_FILE = '/var/lib/cloudman/service_manifest.json'
 LOGIN_SHELL_SCRIPT = "/etc/bash.bashrc"
 GALAXY_USER_NAME = 'galaxy'
 
@@ -59,6 +63,13 @@ P_ETC_TRANSIENT_PATH = "/mnt/transient_nfs/hosts"
 P_HTCONDOR_CONFIG_PATH = "/etc/condor/condor_config"
 P_HTCONDOR_HOME = "/etc/init.d"
 
+# # PgBouncer
+P_PGBOUNCER_DIR = "/etc/pgbouncer"
+P_PGBOUNCER_RUN_DIR = "/var/run/pgbouncer"
+
+# # Nginx
+P_NGINX_CACHE_DIR = "/var/cache/nginx/cloudman"
+
 try:
     # Get only the first 3 chars of the version since that's all that's used
     # for dir name
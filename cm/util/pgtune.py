@@ -0,0 +1,126 @@
+"""
+PostgreSQL tuning for the size of the master instance.
+
+``tune`` derives memory, connection, WAL/checkpoint and parallelism settings
+from the master's memory, CPUs and the number of Galaxy processes using the
+database; ``apply`` writes them to an include file next to
+``postgresql.conf`` (which includes it), so ``postgresql.conf`` itself is
+left as ``initdb`` created it and the settings are simply regenerated (e.g.,
+when the cluster is restarted on a different instance type).
+"""
+import os
+
+import logging
+log = logging.getLogger('cloudman')
+
+INCLUDE_FILE_NAME = 'cloudman_tuning.conf'
+INCLUDE_LINE = "include '{0}'".format(INCLUDE_FILE_NAME)
+# Connections each Galaxy process may hold (SQLAlchemy's default pool size
+# plus overflow)
+CONNECTIONS_PER_PROCESS = 15
+# Connections left over for the reports app, psql sessions, the FTP server
+# and superusers
+SPARE_CONNECTIONS = 30
+MB = 1024  # In kB
+
+
+def _mb(kb):
+    return '{0}MB'.format(max(1, int(kb / MB)))
+
+
+def _clamp(value, low, high):
+    return max(low, min(value, high))
+
+
+def parse_version(version):
+    """
+    Return PostgreSQL version string ``version`` (e.g., ``9.3`` or ``10``)
+    as a tuple of ints.
+    """
+    return tuple([int(v) for v in version.strip().split('.')[:2] if v.isdigit()])
+
+
+def tune(total_memory, num_cpus, num_processes, version=(9, 3)):
+    """
+    Return a list of ``(name, value)`` PostgreSQL settings for an instance
+    with ``total_memory`` kB of memory and ``num_cpus`` CPUs serving
+    ``num_processes`` Galaxy processes, for PostgreSQL ``version`` (a tuple).
+
+    The master also runs Galaxy (and possibly jobs) so PostgreSQL is given a
+    smaller share of memory than on a dedicated database server.
+    """
+    num_cpus = max(1, int(num_cpus))
+    max_connections = _clamp(num_processes * CONNECTIONS_PER_PROCESS + SPARE_CONNECTIONS,
+                             100, 1000)
+    shared_buffers = _clamp(total_memory / 8, 32 * MB, 8 * 1024 * MB)
+    maintenance_work_mem = _clamp(total_memory / 16, 64 * MB, 1024 * MB)
+    # Each query may use several sorts or hashes, hence the factor of 3
+    work_mem = _clamp((total_memory - shared_buffers) / (max_connections * 3), 4 * MB, 64 * MB)
+    settings = [('max_connections', max_connections)]
+    # Before 9.3, shared memory is limited by the kernel's SHMMAX
+    if version >= (9, 3):
+        settings.append(('shared_buffers', _mb(shared_buffers)))
+    settings.extend([('effective_cache_size', _mb(total_memory / 2)),
+                     ('work_mem', _mb(work_mem)),
+                     ('maintenance_work_mem', _mb(maintenance_work_mem)),
+                     ('checkpoint_completion_target', 0.9),
+                     ('random_page_cost', 1.1)])
+    if version >= (9, 5):
+        settings.extend([('min_wal_size', '512MB'),
+                         ('max_wal_size', '2GB')])
+    else:
+        settings.append(('checkpoint_segments', 32))
+    if version >= (9, 4):
+        settings.append(('max_worker_processes', max(8, num_cpus)))
+    if version >= (9, 6):
+        settings.append(('max_parallel_workers_per_gather', _clamp(num_cpus / 2, 0, 4)))
+    if version >= (10,):
+        settings.append(('max_parallel_workers', num_cpus))
+    return settings
+
+
+def render(settings, comment=None):
+    lines = ['# Generated by CloudMan; changes to this file will be overwritten.']
+    if comment:
+        lines.append('# {0}'.format(comment))
+    for name, value in settings:
+        if isinstance(value, basestring):
+            value = "'{0}'".format(value)
+        lines.append('{0} = {1}'.format(name, value))
+    return '\n'.join(lines) + '\n'
+
+
+def apply(data_dir, settings, comment=None):
+    """
+    Write ``settings`` to the include file in PostgreSQL data directory
+    ``data_dir`` and make sure ``postgresql.conf`` includes it. Files are
+    only written if their content changes.
+
+    :rtype: bool
+    :return: ``True`` if anything was changed (i.e., PostgreSQL needs to be
+             restarted for the settings to take effect).
+    """
+    changed = False
+    include_file = os.path.join(data_dir, INCLUDE_FILE_NAME)
+    content = render(settings, comment)
+    current = None
+    if os.path.exists(include_file):
+        with open(include_file) as f:
+            current = f.read()
+    if current != content:
+        with open(include_file, 'w') as f:
+            f.write(content)
+        changed = True
+    conf_file = os.path.join(data_dir, 'postgresql.conf')
+    with open(conf_file) as f:
+        conf = f.read()
+    if INCLUDE_LINE not in [line.strip() for line in conf.splitlines()]:
+        # Appended so the included settings take precedence
+        with open(conf_file, 'a') as f:
+            if conf and not conf.endswith('\n'):
+                f.write('\n')
+            f.write(INCLUDE_LINE + '\n')
+        changed = True
+    if changed:
+        log.debug("Updated PostgreSQL tuning in {0}: {1}".format(include_file, settings))
+    return changed
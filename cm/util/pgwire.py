@@ -0,0 +1,205 @@
+"""
+A minimal PostgreSQL client speaking the frontend/backend protocol (3.0).
+
+It supports just what CloudMan needs to monitor its own PostgreSQL server:
+connecting over the local Unix socket (or TCP), trust, password and MD5
+authentication, and simple queries returning rows of text values. Keeping a
+``Connection`` open makes checking on the server a single round trip instead
+of a login shell, a ``psql`` process and a new backend per check.
+"""
+import hashlib
+import os
+import socket
+import struct
+
+import logging
+log = logging.getLogger('cloudman')
+
+PROTOCOL_VERSION = 196608  # 3.0
+# Directories the server's Unix socket is looked for in
+SOCKET_DIRS = ('/var/run/postgresql', '/tmp')
+# SQLSTATE codes of authentication failures
+AUTH_ERRORS = ('28000', '28P01')
+
+
+class PGError(Exception):
+
+    def __init__(self, message, code=None, severity=None):
+        super(PGError, self).__init__(message)
+        self.code = code
+        self.severity = severity
+
+    def is_auth_error(self):
+        return self.code in AUTH_ERRORS
+
+
+def _cstring(value):
+    return value.encode('utf-8') + '\x00' if isinstance(value, unicode) else value + '\x00'
+
+
+def _error(body):
+    fields = {}
+    for field in body.split('\x00'):
+        if field:
+            fields[field[0]] = field[1:]
+    return PGError(fields.get('M', 'Unknown error'), fields.get('C'), fields.get('S'))
+
+
+class Connection(object):
+
+    def __init__(self, port=5432, user='postgres', database='postgres',
+                 password=None, host=None, socket_dirs=SOCKET_DIRS, timeout=5):
+        """
+        A connection to the PostgreSQL server listening on ``port``, made
+        as ``user`` to ``database``. Unless ``host`` is given, the server's
+        Unix socket is looked for in ``socket_dirs``, falling back to TCP on
+        localhost. The connection is opened on first use.
+        """
+        self.port = int(port)
+        self.user = user
+        self.database = database
+        self.password = password
+        self.host = host
+        self.socket_dirs = socket_dirs
+        self.timeout = timeout
+        self.sock = None
+        self.parameters = {}  # Server parameters reported at startup
+        self.columns = []  # Column names of the last query's result
+
+    def _socket(self):
+        if not self.host:
+            for socket_dir in self.socket_dirs:
+                path = os.path.join(socket_dir, '.s.PGSQL.{0}'.format(self.port))
+                if os.path.exists(path):
+                    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                    sock.settimeout(self.timeout)
+                    try:
+                        sock.connect(path)
+                        return sock
+                    except socket.error:
+                        sock.close()
+        return socket.create_connection((self.host or '127.0.0.1', self.port), self.timeout)
+
+    def _send(self, msg_type, body):
+        self.sock.sendall(msg_type + struct.pack('!i', len(body) + 4) + body)
+
+    def _recv_exactly(self, size):
+        chunks = []
+        while size > 0:
+            chunk = self.sock.recv(size)
+            if not chunk:
+                raise socket.error("Connection closed by the server")
+            chunks.append(chunk)
+            size -= len(chunk)
+        return ''.join(chunks)
+
+    def _recv(self):
+        header = self._recv_exactly(5)
+        length = struct.unpack('!i', header[1:])[0]
+        return header[0], self._recv_exactly(length - 4)
+
+    def _authenticate(self, body):
+        code = struct.unpack('!i', body[:4])[0]
+        if code == 0:
+            return
+        if code not in (3, 5):
+            raise PGError("Unsupported authentication method ({0})".format(code), '28000')
+        if self.password is None:
+            raise PGError("The server requested a password", '28P01')
+        if code == 3:
+            password = self.password
+        else:
+            inner = hashlib.md5(self.password + self.user).hexdigest()
+            password = 'md5' + hashlib.md5(inner + body[4:8]).hexdigest()
+        self._send('p', _cstring(password))
+
+    def connect(self):
+        """
+        Open the connection (a no-op if it is open already).
+        """
+        if self.sock is not None:
+            return
+        self.sock = self._socket()
+        try:
+            params = ''.join([_cstring(k) + _cstring(v) for k, v in
+                              (('user', self.user), ('database', self.database),
+                               ('application_name', 'cloudman'))])
+            body = struct.pack('!i', PROTOCOL_VERSION) + params + '\x00'
+            self.sock.sendall(struct.pack('!i', len(body) + 4) + body)
+            while True:
+                msg_type, body = self._recv()
+                if msg_type == 'R':
+                    self._authenticate(body)
+                elif msg_type == 'S':
+                    name, value = body.split('\x00')[:2]
+                    self.parameters[name] = value
+                elif msg_type == 'E':
+                    raise _error(body)
+                elif msg_type == 'Z':
+                    break
+        except:
+            self.close()
+            raise
+
+    def query(self, sql):
+        """
+        Run ``sql`` (a simple query) and return the rows of the last
+        statement's result as a list of tuples of strings (``None`` for
+        NULLs). Raise ``PGError`` if the query fails and ``socket.error`` if
+        the server cannot be reached, in which case the connection is closed
+        and reopened on next use.
+        """
+        self.connect()
+        rows, error = [], None
+        try:
+            self._send('Q', _cstring(sql))
+            while True:
+                msg_type, body = self._recv()
+                if msg_type == 'T':
+                    rows, self.columns = [], []
+                    pos = 2
+                    for i in range(struct.unpack('!h', body[:2])[0]):
+                        end = body.index('\x00', pos)
+                        self.columns.append(body[pos:end])
+                        pos = end + 19  # Skip the column's type information
+                elif msg_type == 'D':
+                    num_values = struct.unpack('!h', body[:2])[0]
+                    row, pos = [], 2
+                    for i in range(num_values):
+                        size = struct.unpack('!i', body[pos:pos + 4])[0]
+                        pos += 4
+                        if size < 0:
+                            row.append(None)
+                        else:
+                            row.append(body[pos:pos + size])
+                            pos += size
+                    rows.append(tuple(row))
+                elif msg_type == 'E':
+                    error = _error(body)
+                elif msg_type == 'Z':
+                    break
+        except (socket.error, struct.error), e:
+            self.close()
+            raise socket.error(str(e))
+        if error:
+            raise error
+        return rows
+
+    def query_dicts(self, sql):
+        """
+        Like ``query`` but return each row as a dict keyed by column name.
+        """
+        rows = self.query(sql)
+        return [dict(zip(self.columns, row)) for row in rows]
+
+    def close(self):
+        if self.sock is not None:
+            try:
+                self._send('X', '')
+            except socket.error:
+                pass
+            self.sock.close()
+            self.sock = None
+
+    def is_open(self):
+        return self.sock is not None
@@ -0,0 +1,148 @@
+"""
+Skip setup steps whose result is still in place.
+
+Some setup steps (e.g., recursively changing the owner of the Postgres data
+directory or patching Galaxy's ``run.sh``) are repeated on every start of a
+service even though their result rarely changes. ``reconcile`` records a
+fingerprint of what a step set up once it succeeds and, on the next start,
+skips the step unless the fingerprint no longer matches (i.e., the setup has
+drifted). Fingerprints are kept on the instance's root file system, outside of
+CloudMan's home, so they survive CloudMan restarts.
+
+Fingerprints are cheap to compute so they only cover what usually drifts:
+ownership fingerprints (see ``owner_fingerprint``) cover a directory and its
+direct entries, not the whole tree below it.
+"""
+import hashlib
+import json
+import os
+import threading
+from grp import getgrnam
+from pwd import getpwnam
+
+from cm.util import paths
+
+import logging
+log = logging.getLogger('cloudman')
+
+
+class Fingerprints(object):
+
+    def __init__(self, store_file):
+        self.store_file = store_file
+        self._fingerprints = None  # Key: fingerprint
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "Fingerprints({0})".format(self.store_file)
+
+    def _load(self):
+        if self._fingerprints is None:
+            try:
+                with open(self.store_file) as f:
+                    self._fingerprints = json.load(f)
+            except (IOError, ValueError):
+                self._fingerprints = {}
+        return self._fingerprints
+
+    def _save(self):
+        tmp_file = self.store_file + '.tmp'
+        try:
+            if not os.path.isdir(os.path.dirname(self.store_file)):
+                os.makedirs(os.path.dirname(self.store_file))
+            with open(tmp_file, 'w') as f:
+                json.dump(self._fingerprints, f, indent=1, sort_keys=True)
+            os.rename(tmp_file, self.store_file)
+        except (IOError, OSError), e:
+            log.warning("Could not save setup fingerprints to {0}: {1}"
+                        .format(self.store_file, e))
+
+    def matches(self, key, fingerprint):
+        with self._lock:
+            return fingerprint is not None and self._load().get(key) == fingerprint
+
+    def record(self, key, fingerprint):
+        with self._lock:
+            if self._load().get(key) != fingerprint:
+                self._fingerprints[key] = fingerprint
+                self._save()
+
+    def forget(self, key):
+        with self._lock:
+            if self._load().pop(key, None) is not None:
+                self._save()
+
+
+fingerprints = Fingerprints(paths.SETUP_FINGERPRINTS_FILE)
+
+
+def owner_fingerprint(path, user, group=None):
+    """
+    Return a fingerprint of the ownership of the directory (or file) at
+    ``path``: its device and inode plus the owners of it and its direct
+    entries. Return ``None`` if ``path`` does not exist or is not owned by
+    ``user`` and ``group`` (defaults to ``user``).
+    """
+    try:
+        uid = getpwnam(user)[2]
+        gid = getgrnam(group or user)[2]
+        st = os.lstat(path)
+        if (st.st_uid, st.st_gid) != (uid, gid):
+            return None
+        owners = set([(st.st_uid, st.st_gid)])
+        if os.path.isdir(path) and not os.path.islink(path):
+            for name in os.listdir(path):
+                try:
+                    entry_st = os.lstat(os.path.join(path, name))
+                except OSError:
+                    continue  # Removed since listed
+                owners.add((entry_st.st_uid, entry_st.st_gid))
+    except (KeyError, OSError):
+        return None
+    return [st.st_dev, st.st_ino, sorted(list(o) for o in owners)]
+
+
+def file_fingerprint(path):
+    """
+    Return a hash of the contents of the file at ``path`` or ``None`` if
+    it cannot be read.
+    """
+    try:
+        with open(path) as f:
+            return hashlib.md5(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def reconcile(key, fingerprint, setup, store=None):
+    """
+    Run the ``setup`` callable unless the fingerprint recorded under ``key``
+    after it last succeeded still matches. ``fingerprint`` is a callable
+    returning the current fingerprint. ``setup`` is considered to have
+    succeeded unless it returns ``False``.
+
+    Return ``True`` if the setup was in place or ``setup`` succeeded.
+    """
+    store = store or fingerprints
+    if store.matches(key, fingerprint()):
+        log.debug("Setup step {0} is in place; skipping it".format(key))
+        return True
+    if setup() is False:
+        store.forget(key)
+        return False
+    current = fingerprint()
+    if current is None:
+        store.forget(key)
+    else:
+        store.record(key, current)
+    return True
+
+
+def ensure_owner(path, user, group, chown, store=None):
+    """
+    Make sure the tree at ``path`` is owned by ``user`` and ``group`` by
+    calling ``chown`` (e.g., a recursive ``chown``), unless the tree's
+    ownership has not drifted since the last time ``chown`` succeeded.
+    """
+    return reconcile('owner:{0}'.format(path),
+                     lambda: owner_fingerprint(path, user, group), chown, store)
@@ -0,0 +1,275 @@
+"""
+Copy large directory trees in parallel and resumably.
+
+``TreeCopy`` splits the source tree into units: each directory down to
+``split_depth`` levels (its files and symlinks only) and each subtree below
+that level. A pool of worker threads copies the units, preserving ownership,
+permissions, modification times and symlinks (which are copied as symlinks,
+not followed). Each completed unit is recorded in a checkpoint file so that an
+interrupted copy is resumed with the units still outstanding; within a unit,
+files whose copy already matches the source by size and modification time are
+skipped. Once all the units are done, the copy is verified the same way and
+the checkpoint file removed.
+"""
+import errno
+import os
+import shutil
+import stat
+import threading
+import time
+
+from cm.util import bulk
+from cm.util.bunch import Bunch
+
+import logging
+log = logging.getLogger('cloudman')
+
+# Unit kinds: a single directory level or a whole subtree
+DIR = 'dir'
+TREE = 'tree'
+
+
+def _same_file(src_st, dst_path):
+    """
+    Return ``True`` if the regular file at ``dst_path`` has the size and
+    (whole seconds of the) modification time of ``src_st``.
+    """
+    try:
+        dst_st = os.lstat(dst_path)
+    except OSError:
+        return False
+    return (stat.S_ISREG(dst_st.st_mode) and dst_st.st_size == src_st.st_size and
+            int(dst_st.st_mtime) == int(src_st.st_mtime))
+
+
+def _same_link(src_path, dst_path):
+    return os.path.islink(dst_path) and os.readlink(dst_path) == os.readlink(src_path)
+
+
+def _chown(path, st):
+    dst_st = os.lstat(path)
+    if (dst_st.st_uid, dst_st.st_gid) != (st.st_uid, st.st_gid):
+        os.lchown(path, st.st_uid, st.st_gid)
+
+
+def _make_dir(path):
+    try:
+        os.makedirs(path)
+    except OSError, e:
+        if e.errno != errno.EEXIST:
+            raise
+
+
+def _set_dir_attributes(path, st):
+    _chown(path, st)
+    os.chmod(path, stat.S_IMODE(st.st_mode))
+    os.utime(path, (st.st_atime, st.st_mtime))
+
+
+class TreeCopy(object):
+
+    def __init__(self, source, target, num_workers=4, split_depth=2, checkpoint_file=None):
+        """
+        :type split_depth: int
+        :param split_depth: Number of directory levels split into separate
+                            units; the subtrees below are each one unit.
+
+        :type checkpoint_file: string
+        :param checkpoint_file: Path of the file recording the completed
+                                units; defaults to ``<target>.copy-checkpoint``.
+        """
+        self.source = os.path.abspath(source)
+        self.target = os.path.abspath(target)
+        self.num_workers = max(1, num_workers)
+        self.split_depth = max(1, split_depth)
+        self.checkpoint_file = (checkpoint_file or
+                                self.target.rstrip('/') + '.copy-checkpoint')
+        self.units = []  # (kind, path relative to the source)
+        self.done = set()
+        self.files_copied = 0
+        self.files_skipped = 0
+        self.bytes_copied = 0
+        self.started = None
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "TreeCopy({0} -> {1})".format(self.source, self.target)
+
+    def in_progress(self):
+        """
+        Indicate if a copy to the target was started but not completed.
+        """
+        return os.path.exists(self.checkpoint_file)
+
+    def _plan(self):
+        units = []
+
+        def _split(rel_path, depth):
+            units.append((DIR, rel_path))
+            full = os.path.join(self.source, rel_path)
+            for name in sorted(os.listdir(full)):
+                path = os.path.join(full, name)
+                if os.path.isdir(path) and not os.path.islink(path):
+                    if depth < self.split_depth:
+                        _split(os.path.join(rel_path, name), depth + 1)
+                    else:
+                        units.append((TREE, os.path.join(rel_path, name)))
+        _split('', 1)
+        return units
+
+    def _load_checkpoint(self):
+        done = set()
+        if os.path.exists(self.checkpoint_file):
+            with open(self.checkpoint_file) as f:
+                for line in f:
+                    kind, sep, rel_path = line.rstrip('\n').partition(' ')
+                    if sep:
+                        done.add((kind, rel_path))
+        return done
+
+    def _record(self, unit):
+        with self._lock:
+            self.done.add(unit)
+            with open(self.checkpoint_file, 'a') as f:
+                f.write('{0} {1}\n'.format(*unit))
+                f.flush()
+                os.fsync(f.fileno())
+            log.debug("Copied {0} ({1} of {2} parts of {3})".format(
+                os.path.join(self.source, unit[1]), len(self.done), len(self.units), self.source))
+
+    def _copy_entry(self, src_path, dst_path):
+        """
+        Copy the file or symlink at ``src_path`` unless ``dst_path`` already
+        matches it.
+        """
+        st = os.lstat(src_path)
+        if stat.S_ISLNK(st.st_mode):
+            if _same_link(src_path, dst_path):
+                return
+            if os.path.lexists(dst_path):
+                os.remove(dst_path)
+            os.symlink(os.readlink(src_path), dst_path)
+            _chown(dst_path, st)
+        elif stat.S_ISREG(st.st_mode):
+            if _same_file(st, dst_path):
+                with self._lock:
+                    self.files_skipped += 1
+                return
+            if os.path.islink(dst_path):
+                os.remove(dst_path)
+            shutil.copyfile(src_path, dst_path)
+            _chown(dst_path, st)
+            os.chmod(dst_path, stat.S_IMODE(st.st_mode))
+            os.utime(dst_path, (st.st_atime, st.st_mtime))
+            with self._lock:
+                self.files_copied += 1
+                self.bytes_copied += st.st_size
+        else:
+            log.debug("Not copying special file {0}".format(src_path))
+
+    def _copy_unit(self, unit):
+        kind, rel_path = unit
+        src_dir = os.path.join(self.source, rel_path)
+        dst_dir = os.path.join(self.target, rel_path)
+        _make_dir(dst_dir)
+        if kind == DIR:
+            for name in os.listdir(src_dir):
+                src_path = os.path.join(src_dir, name)
+                if not os.path.isdir(src_path) or os.path.islink(src_path):
+                    self._copy_entry(src_path, os.path.join(dst_dir, name))
+        else:
+            dirs = []
+            for root, dirnames, filenames in os.walk(src_dir):
+                dst_root = os.path.join(dst_dir, os.path.relpath(root, src_dir))
+                _make_dir(dst_root)
+                dirs.append((root, dst_root))
+                for name in list(dirnames):
+                    # Symlinks to directories are copied as symlinks
+                    if os.path.islink(os.path.join(root, name)):
+                        dirnames.remove(name)
+                        filenames.append(name)
+                for name in filenames:
+                    self._copy_entry(os.path.join(root, name), os.path.join(dst_root, name))
+            # Creating the entries changes the directories' times, so set
+            # them last, deepest first
+            for src_path, dst_path in reversed(dirs):
+                _set_dir_attributes(dst_path, os.lstat(src_path))
+        self._record(unit)
+
+    def run(self):
+        """
+        Copy the source tree to the target, resuming a previous, interrupted
+        copy if there is one, then verify the copy. Return ``True`` if all
+        the files were copied and verified.
+        """
+        self.started = time.time()
+        self.units = self._plan()
+        self.done = self._load_checkpoint()
+        if self.done:
+            log.info("Resuming copy of {0} to {1}: {2} of {3} parts already copied"
+                     .format(self.source, self.target, len(self.done), len(self.units)))
+        _make_dir(os.path.dirname(self.checkpoint_file))
+        # Mark the copy as started
+        open(self.checkpoint_file, 'a').close()
+        _make_dir(self.target)
+        tasks = [('Copying {0}'.format(os.path.join(self.source, rel_path)),
+                  lambda unit=(kind, rel_path): self._copy_unit(unit))
+                 for kind, rel_path in self.units if (kind, rel_path) not in self.done]
+        failed = bulk.run_concurrently(tasks, max_workers=self.num_workers)
+        if failed:
+            log.error("Failed to copy {0} parts of {1}; run the copy again to resume it"
+                      .format(len(failed), self.source))
+            return False
+        # The single directory levels are set last as all the units change them
+        for kind, rel_path in reversed(self.units):
+            if kind == DIR:
+                _set_dir_attributes(os.path.join(self.target, rel_path),
+                                    os.lstat(os.path.join(self.source, rel_path)))
+        mismatched = self.verify()
+        if mismatched:
+            log.error("{0} files differ between {1} and {2} after copying, e.g., {3}"
+                      .format(len(mismatched), self.source, self.target, mismatched[:5]))
+            return False
+        os.remove(self.checkpoint_file)
+        progress = self.get_progress()
+        log.info("Copied {0} to {1}: {2} files ({3} bytes) in {4:.0f} seconds; {5} "
+                 "already there".format(self.source, self.target, progress.files_copied,
+                                        progress.bytes_copied, progress.elapsed,
+                                        progress.files_skipped))
+        return True
+
+    def verify(self):
+        """
+        Compare the target with the source by file size and modification time
+        (and symlink targets). Return the list of the paths (relative to the
+        source) that are missing from the target or differ.
+        """
+        mismatched = []
+        for root, dirnames, filenames in os.walk(self.source):
+            rel_root = os.path.relpath(root, self.source)
+            for name in dirnames + filenames:
+                src_path = os.path.join(root, name)
+                dst_path = os.path.join(self.target, rel_root, name)
+                st = os.lstat(src_path)
+                if stat.S_ISLNK(st.st_mode):
+                    ok = _same_link(src_path, dst_path)
+                elif stat.S_ISREG(st.st_mode):
+                    ok = _same_file(st, dst_path)
+                elif stat.S_ISDIR(st.st_mode):
+                    ok = os.path.isdir(dst_path) and not os.path.islink(dst_path)
+                else:
+                    continue
+                if not ok:
+                    mismatched.append(os.path.normpath(os.path.join(rel_root, name)))
+        return mismatched
+
+    def get_progress(self):
+        """
+        Return a ``Bunch`` describing the progress of the copy.
+        """
+        return Bunch(units_total=len(self.units),
+                     units_done=len(self.done),
+                     files_copied=self.files_copied,
+                     files_skipped=self.files_skipped,
+                     bytes_copied=self.bytes_copied,
+                     elapsed=time.time() - self.started if self.started else 0)
@@ -18,7 +18,7 @@ from cm.services.apps.hadoop import HadoopService
 from cm.services.apps.htcondor import HTCondorService
 from cm.services.apps.pss import PSSService
 from cm.services.data.filesystem import Filesystem
-from cm.util import comm, misc, paths
+from cm.util import comm, metrics, misc, paths
 from cm.util.bunch import Bunch
 from cm.util.decorators import TestFlag
 from cm.util.manager import BaseConsoleManager
@@ -381,6 +381,7 @@ class ConsoleMonitor(object):
         self.running = True
         # Helper for interruptible sleep
         self.sleeper = misc.Sleeper()
+        self.node_sampler = metrics.NodeSampler()
         self.conn = comm.CMWorkerComm(self.app.cloud_interface.get_instance_id(
         ), self.app.config['master_ip'])
         if not self.app.TESTFLAG:
@@ -455,11 +456,11 @@ class ConsoleMonitor(object):
         self.conn.send(msg_body)
 
     def send_node_status(self):
+        node_metrics = self.node_sampler.read()
         # Get the system load in the following format:
         # "0.00 0.02 0.39" for the past 1, 5, and 15 minutes, respectivley
-        self.app.manager.load = (
-            commands.getoutput("cat /proc/loadavg | cut -d' ' -f1-3")).strip()
-        msg_body = "NODE_STATUS | %s | %s | %s | %s | %s | %s | %s | %s | %s | %s" \
+        self.app.manager.load = metrics.load_string(node_metrics)
+        msg_body = "NODE_STATUS | %s | %s | %s | %s | %s | %s | %s | %s | %s | %s | %s" \
             % (self.app.manager.nfs_data,
                self.app.manager.nfs_tools,
                self.app.manager.nfs_indices,
@@ -469,7 +470,8 @@ class ConsoleMonitor(object):
                self.app.manager.load,
                self.app.manager.worker_status,
                self.app.manager.nfs_tfs,
-               self.app.manager.slurmd_status)
+               self.app.manager.slurmd_status,
+               metrics.encode(node_metrics))
         # log.debug("Sending message '%s'" % msg_body)
         self.conn.send(msg_body)
 
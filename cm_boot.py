@@ -293,6 +293,7 @@ def _fix_nginx_upload(ud):
             'client_max_body_size is already defined in {0}'.format(nginx_conf_path)
     else:
         log.error('{0} not found to update'.format(nginx_conf_path))
+_s3_connections = {}
 
 def _get_s3connection(ud):
     access_key = ud['access_key']
@@ -323,10 +324,14 @@ def _get_s3connection(ud):
         port = ud['s3_port']
         calling_format = OrdinaryCallingFormat()
         path = ud['s3_conn_path']
+    conn_key = (access_key, secret_key, is_secure, host, port, path)
+    if (conn_key in _s3_connections):
+        return _s3_connections[conn_key]
     s3_conn = None
     try:
         s3_conn = S3Connection(aws_access_key_id=access_key, aws_secret_access_key=secret_key, is_secure=is_secure, port=port, host=host, path=path, calling_format=calling_format)
         log.debug(('Got boto S3 connection: %s' % s3_conn))
+        _s3_connections[conn_key] = s3_conn
     except BotoServerError as e:
         log.error('Exception getting S3 connection; {0}'.format(e))
     return s3_conn
@@ -0,0 +1,18 @@
+"""
+Replay a job trace on a simulated cluster scaled by the ``Autoscale`` service
+and report how each scaling policy fared (see ``cm.services.autoscale_simulator``).
+
+Run from CloudMan's top level directory, for example:
+
+    python scripts/simulate_autoscaling.py trace.csv --policy step --max 20
+"""
+import os
+import sys
+
+sys.path.insert(0, os.getcwd())
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.autoscale_simulator import main
+
+if __name__ == '__main__':
+    main()
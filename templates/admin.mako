@@ -373,10 +373,17 @@
             <meter id="fs-meter-<%= name %>" class="space_usage" min="0" max="100" value="<%= size_pct %>" high="85">
                 <%= size_used %>/<%= size %> (<%= size_pct %>%)
             </meter>
+            <% if (typeof(snapshot_status) != "undefined" && snapshot_status != "" && snapshot_status != null) { %>
+                <br/>Snapshot status: <%= snapshot_status %>; progress: <%= snapshot_progress %>
+            <% } %>
         <% } else if (kind == "Volume" && status === "Configuring") { %>
             <% if (snapshot_status != "" && snapshot_status != null) { %>
                 Snapshot status: <%= snapshot_status %>; progress: <%= snapshot_progress %>
+            <% } else if (typeof(archive_progress) != "undefined") { %>
+                Extracting archive: <%= archive_progress %>
             <% } %></td>
+        <% } else if (status === "Configuring" && typeof(archive_progress) != "undefined") { %>
+            Extracting archive: <%= archive_progress %>
         <% } %></td>
         <td class="fs-td-15pct">
             <!-- // Enable removal while a file system is 'Available' or 'Error' -->
@@ -445,12 +452,12 @@
         </div>
     </%text>
     </script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/jquery.form.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/jquery.form.js')}"></script>
     <script src="//ajax.googleapis.com/ajax/libs/jqueryui/1.8.23/jquery-ui.min.js"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/jquery.tipsy.js')}"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/underscore-min.js')}"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/backbone-min.js')}"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/backbone.marionette.js')}"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/Backbone.ModalDialog.js')}"></script>
-    <script type='text/javascript' src="${h.url_for('/static/scripts/admin.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/jquery.tipsy.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/underscore-min.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/backbone-min.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/backbone.marionette.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/Backbone.ModalDialog.js')}"></script>
+    <script type='text/javascript' src="${h.static_url('/static/scripts/admin.js')}"></script>
 </%def>
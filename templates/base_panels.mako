@@ -16,9 +16,9 @@ from routes import url_for
 
 ## Default stylesheets
 <%def name="stylesheets()">
-  <link href="${h.url_for('/static/style/base.css')}" rel="stylesheet" type="text/css" />
-  <link href="${h.url_for('/static/style/masthead.css')}" rel="stylesheet" type="text/css" />
-  <link href="${h.url_for('/static/style/font-awesome.min.css')}" rel="stylesheet" type="text/css" />
+  <link href="${h.static_url('/static/style/base.css')}" rel="stylesheet" type="text/css" />
+  <link href="${h.static_url('/static/style/masthead.css')}" rel="stylesheet" type="text/css" />
+  <link href="${h.static_url('/static/style/font-awesome.min.css')}" rel="stylesheet" type="text/css" />
 </%def>
 
 ## Default javascripts
@@ -28,9 +28,9 @@ from routes import url_for
   <script type='text/javascript' src="/static/scripts/IE8.js"></script>
   <script type='text/javascript' src="/static/scripts/ie7-recalc.js"></script>
   <![endif]-->
-  <script type='text/javascript' src="${h.url_for('/static/scripts/jquery-1.7.1.min.js')}"></script>
-  <script type='text/javascript' src="${h.url_for('/static/scripts/jquery-ui-1.8.10.custom.min.js')}"></script>
-  <script type='text/javascript' src="${h.url_for('/static/scripts/livevalidation_standalone.compressed.js')}"></script>
+  <script type='text/javascript' src="${h.static_url('/static/scripts/jquery-1.7.1.min.js')}"></script>
+  <script type='text/javascript' src="${h.static_url('/static/scripts/jquery-ui-1.8.10.custom.min.js')}"></script>
+  <script type='text/javascript' src="${h.static_url('/static/scripts/livevalidation_standalone.compressed.js')}"></script>
 </%def>
 
 ## Default late-load javascripts
@@ -43,7 +43,7 @@ from routes import url_for
     <tr valign="middle">
       <td width="26px">
         <a href="${h.url_for(controller='root', action='index')}">
-        <img border="0" style="height: 29px;" src="${h.url_for('/static/images/cloudmanIcon_noText.png')}"></a>
+        <img border="0" style="height: 29px;" src="${h.static_url('/static/images/cloudmanIcon_noText.png')}"></a>
       </td>
       <td align="left" valign="middle">
         <div class="pageTitle">
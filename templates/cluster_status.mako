@@ -11,8 +11,8 @@
 
 	<p id="status">Status:<br/></p>
 	<hr/>
-	<script type='text/javascript' src="${h.url_for('/static/scripts/jQuery-1.4.2.js')}"></script>
-	<script type='text/javascript' src="${h.url_for('/static/scripts/cluster_canvas.js')}">	</script>
+	<script type='text/javascript' src="${h.static_url('/static/scripts/jQuery-1.4.2.js')}"></script>
+	<script type='text/javascript' src="${h.static_url('/static/scripts/cluster_canvas.js')}">	</script>
 	<!-- Number of Instances: ${len(instances)}
 	<table cellspacing='5'>
 	<%
@@ -30,10 +30,10 @@ vertical-align: top;
                 <a id="stop-button" original-title="Terminate Cluster" class="action-button left-button">Terminate cluster</a>
             </li>
             <li style='display:inline;width:150px;'>
-                <a class="action-button" original-title="Add Nodes..." id="scale_up_button">Add nodes <img src="/cloud/static/images/downarrow.png"></a>
+                <a class="action-button" original-title="Add Nodes..." id="scale_up_button">Add nodes <img src="${h.static_url('/static/images/downarrow.png')}"></a>
             </li>
             <li style='display:inline;width:150px;'>
-                <a class="action-button" original-title="Remove Nodes..." id="scale_down_button">Remove nodes <img src="/cloud/static/images/downarrow.png"></a>
+                <a class="action-button" original-title="Remove Nodes..." id="scale_down_button">Remove nodes <img src="${h.static_url('/static/images/downarrow.png')}"></a>
             </li>
             <li style='display:inline;width:150px;'>
                 <a id='dns' href='' original-title="Access Galaxy" class="action-button right-button">Access Galaxy</a>
@@ -474,10 +474,10 @@ $(function() {
 });
 </script>
 
-<script type='text/javascript' src="${h.url_for('/static/scripts/jquery.tipsy.js')}"></script>
-<script type='text/javascript' src="${h.url_for('/static/scripts/jquery.form.js')}"></script>
-<script type='text/javascript' src="${h.url_for('/static/scripts/cluster_canvas.js')}"> </script>
-<script type='text/javascript' src="${h.url_for('/static/scripts/jquery.stopwatch.js')}"> </script>
+<script type='text/javascript' src="${h.static_url('/static/scripts/jquery.tipsy.js')}"></script>
+<script type='text/javascript' src="${h.static_url('/static/scripts/jquery.form.js')}"></script>
+<script type='text/javascript' src="${h.static_url('/static/scripts/cluster_canvas.js')}"> </script>
+<script type='text/javascript' src="${h.static_url('/static/scripts/jquery.stopwatch.js')}"> </script>
 <script type="text/javascript">
 
 function hidebox(){
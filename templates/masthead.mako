@@ -3,15 +3,15 @@
   <head>
     <title>Galaxy</title>
     <meta http-equiv="Content-Type" content="text/html; charset=utf-8" />
-    <link href="${h.url_for('/static/style/base.css')}" rel="stylesheet" type="text/css" />
-    <link href="${h.url_for('/static/style/masthead.css')}" rel="stylesheet" type="text/css" />
+    <link href="${h.static_url('/static/style/base.css')}" rel="stylesheet" type="text/css" />
+    <link href="${h.static_url('/static/style/masthead.css')}" rel="stylesheet" type="text/css" />
   </head>
   <body class="mastheadPage">
     <table width="100%" cellspacing="0" border="0">
       <tr valign="middle">
         <td width="26px">
           <a target="_blank" href="${wiki_url}">
-          <img border="0" src="${h.url_for('/static/images/cloudmanIcon_noText.png')}"></a>
+          <img border="0" src="${h.static_url('/static/images/cloudmanIcon_noText.png')}"></a>
         </td>
         <td align="left" valign="middle"><div class="pageTitle">Galaxy${brand}</div></td>
         <td align="right" valign="middle">
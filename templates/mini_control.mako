@@ -6,7 +6,7 @@
 
 ## Default stylesheets
 <%def name="stylesheets()">
-  <link href="${h.url_for('/static/style/minibar.css')}" rel="stylesheet" type="text/css" />
+  <link href="${h.static_url('/static/style/minibar.css')}" rel="stylesheet" type="text/css" />
 </%def>
 
 ## Default javascripts
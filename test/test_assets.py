@@ -0,0 +1,72 @@
+import gzip
+import os
+import shutil
+import tempfile
+
+from paste.fixture import TestApp
+
+from cm.framework.middleware.static import CacheableStaticURLParser
+from cm.util import assets
+
+
+def _write(path, content):
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_hashed_urls_and_precompression():
+    static_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(static_dir, 'scripts'))
+        script = os.path.join(static_dir, 'scripts', 'app.js')
+        _write(script, 'var x = 1;\n' * 100)
+        _write(os.path.join(static_dir, 'tiny.css'), 'a {}')
+        manifest = assets.AssetManifest(static_dir)
+        assert manifest.build() == 2
+        gz = gzip.open(script + '.gz')
+        assert gz.read() == 'var x = 1;\n' * 100
+        gz.close()
+        # Small files are not worth compressing
+        assert not os.path.exists(os.path.join(static_dir, 'tiny.css.gz'))
+        url = manifest.url('/static/scripts/app.js')
+        assert url.startswith('/static/_/') and url.endswith('/scripts/app.js')
+        assert manifest.url('scripts/app.js') == url
+        assert manifest.url('/static/missing.js') == '/static/missing.js'
+        # A changed file gets a new URL
+        _write(script, 'var x = 2;\n')
+        os.utime(script, (1, 1))
+        assert manifest.url('/static/scripts/app.js') != url
+        _write(os.path.join(static_dir, 'tiny.css'), 'a { color: red; }\n' * 20)
+        manifest.build()
+        assert os.path.exists(os.path.join(static_dir, 'tiny.css.gz'))
+        # A stale compressed copy is not left behind
+        assert not os.path.exists(script + '.gz')
+        # The hashed URLs are also served (with far-future caching) standalone
+        app = TestApp(CacheableStaticURLParser(static_dir, 360))
+        response = app.get(manifest.url('/static/scripts/app.js')[len('/static'):])
+        assert response.body == 'var x = 2;\n'
+        assert 'max-age={0}'.format(assets.FAR_FUTURE) in response.header('Cache-Control')
+        response = app.get('/scripts/app.js')
+        assert 'max-age=360' in response.header('Cache-Control')
+    finally:
+        shutil.rmtree(static_dir)
+
+
+def test_relative_references_are_versioned():
+    static_dir = tempfile.mkdtemp()
+    try:
+        os.mkdir(os.path.join(static_dir, 'style'))
+        _write(os.path.join(static_dir, 'style', 'base.css'), 'a { background: url(bg.png); }')
+        _write(os.path.join(static_dir, 'style', 'bg.png'), 'png')
+        manifest = assets.AssetManifest(static_dir)
+        manifest.build()
+        css_url = manifest.url('/static/style/base.css')
+        # The image referenced by the style sheet is under the same prefix
+        assert manifest.url('/static/style/bg.png') == css_url.replace('base.css', 'bg.png')
+        # A changed image changes the style sheet's URL too
+        _write(os.path.join(static_dir, 'style', 'bg.png'), 'new png')
+        os.utime(os.path.join(static_dir, 'style', 'bg.png'), (1, 1))
+        manifest.build()
+        assert manifest.url('/static/style/base.css') != css_url
+    finally:
+        shutil.rmtree(static_dir)
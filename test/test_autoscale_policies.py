@@ -0,0 +1,69 @@
+import cm.util  # Must be imported ahead of cm.services
+from cm.services import autoscale_policies
+from cm.services.autoscale_policies import ClusterLoad
+
+
+def test_proportional_sizes_from_pending_slots():
+    policy = autoscale_policies.get_policy('proportional')
+    load = ClusterLoad(pending_slots=5000, cpus_per_node=8)
+    assert policy.num_to_add(load) == 625
+
+
+def test_in_flight_instances_are_counted():
+    policy = autoscale_policies.get_policy('proportional')
+    load = ClusterLoad(pending_slots=64, cpus_per_node=8, num_workers=8,
+                       num_in_flight=8)
+    assert policy.num_to_add(load) == 0
+
+
+def test_long_running_jobs_are_drained_by_ready_workers():
+    policy = autoscale_policies.get_policy({'name': 'proportional', 'boot_time': 300})
+    # 4 ready nodes with 4 slots each get through (at most) 16 jobs while a
+    # new node boots
+    load = ClusterLoad(pending_slots=200, mean_runtime=120, running_slots=16,
+                       cpus_per_node=4, num_workers=4, num_ready=4)
+    assert policy.num_to_add(load) == 46
+    # Jobs that have been running for 30 minutes do not all finish by then
+    load = ClusterLoad(pending_slots=200, mean_runtime=1800, running_slots=16,
+                       cpus_per_node=4, num_workers=4, num_ready=4)
+    assert policy.num_to_add(load) == 50
+
+
+def test_just_started_jobs_do_not_suppress_scaling():
+    policy = autoscale_policies.get_policy({'name': 'proportional', 'boot_time': 300})
+    # The running jobs have only been running for 5 seconds; that says
+    # nothing about how soon they will finish
+    load = ClusterLoad(pending_slots=100, mean_runtime=5, running_slots=16,
+                       cpus_per_node=4, num_workers=4, num_ready=4)
+    assert policy.num_to_add(load) == 21
+
+
+def test_idle_slots_serve_pending_jobs():
+    # Jobs queued for a moment before being dispatched to idle workers
+    load = ClusterLoad(pending_slots=8, running_slots=0, mean_runtime=0,
+                       cpus_per_node=4, num_workers=4, num_ready=4)
+    assert autoscale_policies.get_policy('proportional').num_to_add(load) == 0
+    assert autoscale_policies.get_policy('step').num_to_add(load) == 0
+    # Only the pending slots beyond the free ones need new instances
+    load = ClusterLoad(pending_slots=24, running_slots=8, mean_runtime=0,
+                       cpus_per_node=4, num_workers=4, num_ready=4)
+    assert autoscale_policies.get_policy('proportional').num_to_add(load) == 4
+
+
+def test_target_utilization():
+    policy = autoscale_policies.get_policy({'name': 'target-utilization', 'target': 0.5})
+    load = ClusterLoad(pending_slots=8, running_slots=8, cpus_per_node=4,
+                       num_workers=2, num_ready=2)
+    assert policy.num_to_add(load) == 6
+
+
+def test_step():
+    policy = autoscale_policies.get_policy({'name': 'step', 'steps': [[1, 1], [100, 5]]})
+    assert policy.num_to_add(ClusterLoad(pending_slots=0)) == 0
+    assert policy.num_to_add(ClusterLoad(pending_slots=99)) == 1
+    assert policy.num_to_add(ClusterLoad(pending_slots=150)) == 5
+
+
+def test_unknown_policy():
+    policy = autoscale_policies.get_policy('nonexistent')
+    assert policy.name == autoscale_policies.DEFAULT_POLICY
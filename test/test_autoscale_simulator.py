@@ -0,0 +1,52 @@
+import os
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.autoscale_simulator import Simulation, load_trace
+
+from test_utils import temp_dir
+
+
+def _burst_trace(directory, num_jobs=200, runtime=1200):
+    path = os.path.join(directory, 'trace.csv')
+    with open(path, 'w') as f:
+        f.write('submit,start,end,slots\n')
+        for i in range(num_jobs):
+            f.write('{0},{1},{2},1\n'.format(1000 + i, 0, runtime))
+    return path
+
+
+def test_load_trace():
+    with temp_dir() as directory:
+        jobs = load_trace(_burst_trace(directory, num_jobs=3))
+    assert [j.submit for j in jobs] == [0, 1, 2]
+    assert all(j.runtime == 1200 for j in jobs)
+
+
+def test_burst_scales_out_in_one_decision():
+    with temp_dir() as directory:
+        trace = load_trace(_burst_trace(directory))
+    report = Simulation(trace, policy='proportional', as_min=0, as_max=20,
+                        boot_latency=300, cpus_per_node=4).run()
+    assert report['jobs'] == 200
+    # All 20 instances are requested early on rather than one per boot cycle
+    assert report['launched'] == 20
+    assert report['makespan'] < 5 * (1200 + 300)
+
+
+def test_simulation_is_reproducible():
+    with temp_dir() as directory:
+        path = _burst_trace(directory, num_jobs=50)
+        reports = [Simulation(load_trace(path), policy='step').run() for i in range(2)]
+    assert reports[0] == reports[1]
+
+
+def test_scale_down_follows_billing_periods():
+    with temp_dir() as directory:
+        trace = load_trace(_burst_trace(directory))
+    simulation = Simulation(trace, policy='proportional', billing_granularity='hour')
+    report = simulation.run()
+    assert report['terminated'] == report['launched']
+    # Idle instances are kept while their hour is paid for and removed close
+    # to the end of it, so little of the billed time goes unused
+    for inst in simulation.app.manager.terminated:
+        assert (inst.terminate_time - inst.launch_time) % 3600 > 3600 - 600
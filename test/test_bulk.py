@@ -0,0 +1,78 @@
+import threading
+
+from boto.exception import S3ResponseError
+from boto.s3.acl import Policy
+from boto.s3.user import User
+
+from cm.util import bulk
+
+
+class DummyBucket(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.copies = []
+        self.acls = {}
+        self.fail_copies = set()
+
+    def get_acl(self):
+        policy = Policy()
+        policy.owner = User(id='owner-id', display_name='owner')
+        return policy
+
+    def copy_key(self, new_key_name, src_bucket_name, src_key_name, preserve_acl=False):
+        if src_key_name in self.fail_copies:
+            raise S3ResponseError(404, 'Not Found')
+        with self.lock:
+            self.copies.append((src_key_name, new_key_name))
+
+    def set_acl(self, policy, key_name=''):
+        with self.lock:
+            assert key_name not in self.acls
+            self.acls[key_name] = policy
+
+
+class DummyConnection(object):
+
+    def __init__(self, bucket):
+        self.bucket = bucket
+
+    def get_bucket(self, bucket_name, validate=True):
+        return self.bucket
+
+
+def _grantees(policy):
+    return sorted((g.permission, g.id or g.uri) for g in policy.acl.grants)
+
+
+def test_acl_written_once_per_key():
+    bucket = DummyBucket()
+    ops = bulk.BulkObjectOperations(lambda: DummyConnection(bucket), 'b', max_workers=4)
+    for i in range(10):
+        ops.copy('conf-{0}'.format(i), 'shared/conf-{0}'.format(i))
+        ops.grant('shared/conf-{0}'.format(i), 'READ', ['user-1'])
+        ops.grant('shared/conf-{0}'.format(i), 'READ', ['user-2', 'user-3'])
+    ops.make_public('shared/list')
+    result = ops.run()
+    assert result.failed == {}
+    assert result.succeeded == 21
+    assert len(bucket.copies) == 10
+    assert _grantees(bucket.acls['shared/conf-0']) == [
+        ('FULL_CONTROL', 'owner-id'), ('READ', 'user-1'), ('READ', 'user-2'),
+        ('READ', 'user-3')]
+    assert _grantees(bucket.acls['shared/list']) == [
+        ('FULL_CONTROL', 'owner-id'), ('READ', bulk.ALL_USERS_URI)]
+
+
+def test_failures_do_not_abort_the_batch():
+    bucket = DummyBucket()
+    bucket.fail_copies.add('conf-1')
+    ops = bulk.BulkObjectOperations(lambda: DummyConnection(bucket), 'b')
+    for i in range(3):
+        ops.copy('conf-{0}'.format(i), 'shared/conf-{0}'.format(i))
+        ops.grant('shared/conf-{0}'.format(i), 'READ', ['user-1'])
+    result = ops.run()
+    assert result.succeeded == 4
+    assert sorted(result.failed) == ["ACL update of 'shared/conf-1'",
+                                     "Copy of 'conf-1' to 'shared/conf-1'"]
+    assert sorted(bucket.acls) == ['shared/conf-0', 'shared/conf-2']
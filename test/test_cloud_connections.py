@@ -0,0 +1,125 @@
+import threading
+import time
+
+from boto.exception import EC2ResponseError
+
+from cm.clouds import connections, ratelimit
+from cm.clouds.connections import ConnectionPool
+
+
+class DummyConnection(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.failures = []
+
+    def describe(self):
+        self.calls += 1
+        if self.failures:
+            raise self.failures.pop(0)
+        return self.calls
+
+
+def _throttled():
+    return EC2ResponseError(503, 'Service Unavailable',
+                            '<Response><Errors><Error><Code>RequestLimitExceeded</Code>'
+                            '</Error></Errors></Response>')
+
+
+def test_connection_reused_per_thread():
+    created = []
+
+    def factory():
+        created.append(DummyConnection())
+        return created[-1]
+    pool = ConnectionPool('test', factory)
+    assert pool.get() is pool.get()
+    other = []
+    t = threading.Thread(target=lambda: other.append(pool.get()))
+    t.start()
+    t.join()
+    assert other[0] is not pool.get()
+    assert len(created) == 2
+
+
+def test_validation_runs_once():
+    validated = []
+    pool = ConnectionPool('test', DummyConnection,
+                          lambda conn: validated.append(conn))
+    pool.get()
+    pool.get()
+    assert len(validated) == 1
+
+
+def test_invalid_credentials():
+    def validator(conn):
+        raise EC2ResponseError(401, 'Unauthorized')
+    pool = ConnectionPool('test', DummyConnection, validator)
+    assert pool.get() is None
+    assert pool.valid is False
+
+
+def test_transient_validation_errors_are_retried():
+    errors = [EC2ResponseError(500, 'Internal Server Error',
+                               '<Response><Errors><Error><Code>InternalError</Code>'
+                               '</Error></Errors></Response>')]
+
+    def validator(conn):
+        if errors:
+            raise errors.pop()
+    pool = ConnectionPool('test', DummyConnection, validator)
+    pool.get()
+    assert pool.valid is None
+    assert pool.get() is not None
+    assert pool.valid is True
+
+
+def test_throttled_calls_are_retried():
+    connections.reset_call_stats()
+    pool = ConnectionPool('test', DummyConnection, backoff=0.001)
+    conn = pool.get()
+    conn._conn.failures = [_throttled(), _throttled()]
+    assert conn.describe() == 3
+    stats = connections.get_call_stats()['test.describe']
+    assert stats['calls'] == 3
+    assert stats['throttled'] == 2
+
+
+def test_identical_describe_calls_coalesced():
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def describe():
+        calls.append(1)
+        started.set()
+        release.wait()
+        return 'result'
+    coalescer = ratelimit.Coalescer()
+    results = []
+    owner = threading.Thread(target=lambda: results.append(coalescer.call('k', describe)))
+    owner.start()
+    started.wait()
+    waiter = threading.Thread(target=lambda: results.append(coalescer.call('k', describe)))
+    waiter.start()
+    time.sleep(0.1)  # Let the waiter block on the in-flight call
+    release.set()
+    owner.join()
+    waiter.join()
+    assert results == ['result', 'result']
+    assert len(calls) == 1
+
+
+def test_token_bucket():
+    bucket = ratelimit.TokenBucket(rate=1, burst=2)
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() == 0
+    assert bucket.try_acquire() > 0
+
+
+def test_call_family():
+    assert ratelimit.call_family('get_all_volumes') == 'describe'
+    assert ratelimit.call_family('run_instances') == 'instances'
+    assert ratelimit.call_family('create_tags') == 'tags'
+    assert ratelimit.call_family('attach_volume') == 'default'
+    assert ratelimit.call_family('get_bucket', 'object_store') == 'object_store'
@@ -0,0 +1,31 @@
+from cm.services.data.devices import DeviceAllocator, device_suffix
+
+
+class TestWatcher(object):
+
+    def __init__(self, devices):
+        self.current = frozenset(devices)
+
+    def devices(self):
+        return self.current
+
+
+def _next_device(devices):
+    # Simplified ``Volume._get_likely_next_devices``
+    last = sorted(d for d in devices if d.startswith('/dev/xvd'))[-1]
+    return (last[:-1] + chr(ord(last[-1]) + 1),)
+
+
+def test_device_suffix():
+    assert device_suffix('/dev/sdf') == device_suffix('/dev/xvdf') == 'f'
+
+
+def test_concurrent_reservations_do_not_collide():
+    allocator = DeviceAllocator(TestWatcher(['/dev/xvda', '/dev/xvdb']))
+    first, second = object(), object()
+    assert allocator.reserve(first, _next_device) == ('/dev/xvdc',)
+    assert allocator.reserve(second, _next_device) == ('/dev/xvdd',)
+    assert allocator.claimed_by_others(first, '/dev/sdd')
+    assert not allocator.claimed_by_others(first, '/dev/xvdc')
+    allocator.release(first)
+    assert not allocator.claimed_by_others(second, '/dev/xvdc')
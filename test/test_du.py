@@ -0,0 +1,88 @@
+import os
+import shutil
+import tempfile
+import time
+
+from cm.util import du
+
+
+def _tree(root, depth, fanout=3):
+    with open(os.path.join(root, 'data'), 'w') as f:
+        f.write('x' * 10000)
+    if depth > 0:
+        for i in range(fanout):
+            os.mkdir(os.path.join(root, str(i)))
+            _tree(os.path.join(root, str(i)), depth - 1, fanout)
+
+
+def _age(root):
+    # Make the directories look like they were last modified a while ago
+    past = time.time() - 60
+    for dirpath, dirnames, filenames in os.walk(root):
+        os.utime(dirpath, (past, past))
+
+
+def _du(root):
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(root):
+        total += os.lstat(dirpath).st_blocks * 512
+        for name in filenames:
+            total += os.lstat(os.path.join(dirpath, name)).st_blocks * 512
+    return total
+
+
+def test_only_changed_directories_are_listed():
+    root = tempfile.mkdtemp()
+    listed = []
+    orig_entries = du._entries
+    du._entries = lambda path: listed.append(path) or orig_entries(path)
+    try:
+        _tree(root, 2)
+        _age(root)
+        usage = du.DirectoryUsage()
+        assert usage.usage(root).num_files == 13
+        assert usage.size(root) == _du(root)
+        assert len(listed) == 13
+        del listed[:]
+        with open(os.path.join(root, '1', '2', 'more'), 'w') as f:
+            f.write('y' * 10000)
+        _age(os.path.join(root, '1', '2'))
+        assert usage.size(root) == _du(root)
+        assert listed == [os.path.join(root, '1', '2')]
+    finally:
+        du._entries = orig_entries
+        shutil.rmtree(root)
+
+
+def test_estimate():
+    root = tempfile.mkdtemp()
+    try:
+        _tree(root, 3)
+        _age(root)
+        assert du.DirectoryUsage().estimate(root).exact
+        # A uniform tree is estimated exactly from any sample
+        estimate = du.DirectoryUsage().estimate(root, time_limit=0)
+        assert not estimate.exact
+        assert estimate.size == _du(root)
+        assert estimate.num_files == 40
+    finally:
+        shutil.rmtree(root)
+
+
+def test_files_changed_in_place_are_seen_after_max_age():
+    root = tempfile.mkdtemp()
+    try:
+        _tree(root, 0)
+        _age(root)
+        usage = du.DirectoryUsage(max_age=60)
+        size = usage.size(root)
+        with open(os.path.join(root, 'data'), 'a') as f:
+            f.write('y' * 100000)
+        # The directory did not change so its cached listing is used...
+        assert usage.size(root) == size
+        # ...until it is too old
+        usage.dirs[root].scanned -= 60
+        assert usage.size(root) == _du(root) > size
+        assert du.dir_usage.max_age == du.DIR_USAGE_MAX_AGE
+    finally:
+        shutil.rmtree(root)
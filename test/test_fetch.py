@@ -0,0 +1,104 @@
+import BaseHTTPServer
+import hashlib
+import io
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.util import ExtractArchive
+from cm.util.fetch import ParallelFetch
+
+CONTENT = os.urandom(100 * 1024 + 17)
+
+
+class RangeHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    content = CONTENT
+    truncate = []  # Byte counts to cut the next responses short at
+
+    def _send(self, body_only):
+        size = len(self.content)
+        first, last = 0, size - 1
+        if 'Range' in self.headers:
+            first, last = self.headers['Range'].split('=')[1].split('-')
+            first, last = int(first), min(int(last), size - 1)
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {0}-{1}/{2}'.format(first, last, size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if body_only:
+            body = self.content[first:last + 1]
+            if self.truncate:
+                body = body[:self.truncate.pop()]
+            self.wfile.write(body)
+
+    def do_HEAD(self):
+        self._send(False)
+
+    def do_GET(self):
+        self._send(True)
+
+    def log_message(self, *args):
+        pass
+
+
+def _serve(content=CONTENT):
+    RangeHandler.content = content
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), RangeHandler)
+    t = threading.Thread(target=server.serve_forever)
+    t.daemon = True
+    t.start()
+    return server, 'http://127.0.0.1:{0}/archive'.format(server.server_port)
+
+
+def test_chunks_are_read_in_order():
+    server, url = _serve()
+    try:
+        f = ParallelFetch(url, num_workers=4, chunk_size=4096).open()
+        assert f.ranged
+        data = ''.join(iter(lambda: f.read(1000), ''))
+        f.close()
+        assert data == CONTENT
+        assert f.get_progress().pct == 100
+    finally:
+        server.shutdown()
+
+
+def test_interrupted_chunk_is_resumed():
+    server, url = _serve()
+    RangeHandler.truncate = [1000]
+    try:
+        f = ParallelFetch(url, num_workers=1, chunk_size=64 * 1024, backoff=0).open()
+        data = f.read()
+        f.close()
+        assert data == CONTENT
+        assert f.num_resumed == 1
+        assert f.bytes_fetched == len(CONTENT)
+    finally:
+        RangeHandler.truncate = []
+        server.shutdown()
+
+
+def test_extract_archive():
+    buf = io.BytesIO()
+    archive = tarfile.open(fileobj=buf, mode='w:gz')
+    info = tarfile.TarInfo('data/content')
+    info.size = len(CONTENT)
+    archive.addfile(info, io.BytesIO(CONTENT))
+    archive.close()
+    server, url = _serve(buf.getvalue())
+    path = tempfile.mkdtemp()
+    try:
+        extractor = ExtractArchive(url, path, hashlib.md5(buf.getvalue()).hexdigest(),
+                                   num_retries=0)
+        assert extractor._md5_check_ok(extractor._extract())
+        with open(os.path.join(path, 'data', 'content'), 'rb') as f:
+            assert f.read() == CONTENT
+    finally:
+        server.shutdown()
+        shutil.rmtree(path)
@@ -0,0 +1,36 @@
+from cm.util import galaxy_topology
+from cm.util.galaxy_topology import PortAllocator, plan, size_processes
+
+GB = 1024 * 1024  # In kB
+
+
+def test_sizing():
+    assert size_processes(1, 2 * GB) == (1, 1)
+    assert size_processes(8, 30 * GB) == (4, 2)
+    # Limited by memory
+    assert size_processes(32, 8 * GB) == (2, 1)
+    assert size_processes(64, 500 * GB) == (16, 8)
+
+
+def test_plan_and_resize():
+    in_use = set([8081, 8079])
+    allocator = PortAllocator(is_free=lambda port: port not in in_use)
+    topology = plan(12, 2, allocator=allocator)
+    assert [p.name for p in topology.web][:3] == ['main', 'web1', 'web2']
+    # Ports are not limited to 808x and skip those in use
+    assert [p.port for p in topology.web] == [8080] + range(8082, 8093)
+    assert [p.port for p in topology.handlers] == [9080, 9081]
+    assert topology.manager.name == 'manager0'
+    assert topology.manager.port == 8093
+    assert topology.upstream_servers()[1] == 'server 127.0.0.1:8082;'
+    assert galaxy_topology.GalaxyTopology.loads(topology.dumps()).names() == topology.names()
+    # Existing processes keep their ports; new ones get free ones
+    in_use.update([8080, 8093])
+    resized = plan(3, 3, previous=topology, allocator=PortAllocator(lambda port: port not in in_use))
+    assert [p.port for p in resized.web] == [8080, 8082, 8083]
+    assert [p.port for p in resized.handlers] == [9080, 9081, 9082]
+    assert resized.manager.port == 8093
+    # Planning again on restart keeps the layout, even with the ports still held
+    in_use.update(p.port for p in resized.processes)
+    restarted = plan(3, 3, previous=resized, allocator=PortAllocator(lambda port: port not in in_use))
+    assert restarted.dumps() == resized.dumps()
@@ -0,0 +1,68 @@
+import socket
+import threading
+import time
+
+from cm.util.health import HealthProber
+
+
+def _listener():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.bind(('127.0.0.1', 0))
+    sock.listen(5)
+    return sock
+
+
+def _settle(prober, name):
+    # Wait for the initial background run of the probe to complete
+    probe = prober.probes[name]
+    while probe.in_flight or not probe.last_started:
+        time.sleep(0.01)
+
+
+def test_tcp_probe():
+    sock = _listener()
+    port = sock.getsockname()[1]
+    prober = HealthProber()
+    name = prober.tcp('test', '127.0.0.1', port, interval=60)
+    _settle(prober, name)
+    assert prober.is_up(name, max_age=0)
+    sock.close()
+    # A cached result is used while fresh enough
+    assert prober.is_up(name, max_age=60)
+    assert not prober.is_up(name, max_age=0)
+
+
+def test_http_probe_times_out():
+    # Accepts connections but never responds
+    sock = _listener()
+    port = sock.getsockname()[1]
+    prober = HealthProber()
+    name = prober.http('test', 'http://127.0.0.1:{0}/'.format(port), timeout=0.2,
+                       interval=60)
+    started = time.time()
+    assert not prober.is_up(name, max_age=0)
+    assert time.time() - started < 2
+    sock.close()
+
+
+def test_http_probe():
+    import BaseHTTPServer
+
+    class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_HEAD(self):
+            self.send_response(403)
+            self.end_headers()
+
+        def log_message(self, *args):
+            pass
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), Handler)
+    t = threading.Thread(target=server.serve_forever)
+    t.start()
+    prober = HealthProber()
+    name = prober.http('test', 'http://127.0.0.1:{0}/'.format(server.server_port),
+                       interval=60)
+    assert prober.is_up(name, max_age=0)
+    assert prober.get_results()['test']['ok'] is True
+    server.shutdown()
+    t.join()
+    server.server_close()
@@ -0,0 +1,84 @@
+import BaseHTTPServer
+import os
+import shutil
+import tempfile
+import threading
+
+from cm.clouds import metadata
+from cm.clouds.metadata import InstanceMetadata
+
+METADATA = {
+    'instance-id': 'i-1234',
+    'ami-id': 'ami-abcd',
+    'placement/availability-zone': 'us-east-1a',
+    'public-keys': '0=cloudman_key_pair',
+    'security-groups': 'CloudMan',
+    'mac': '0e:00:00:00:00:01',
+    'instance-type': 'm3.large',
+    'local-ipv4': '10.0.0.1',
+    'public-ipv4': '54.0.0.1',
+    'local-hostname': 'ip-10-0-0-1.ec2.internal',
+    'public-hostname': 'ec2-54-0-0-1.compute-1.amazonaws.com',
+    'network/interfaces/macs/0e:00:00:00:00:01/security-group-ids': 'sg-1\nsg-2',
+}
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    requested = []
+
+    def do_GET(self):
+        key = self.path[len('/latest/meta-data/'):]
+        self.requested.append(key)
+        if key in METADATA:
+            self.send_response(200)
+            self.end_headers()
+            self.wfile.write(METADATA[key])
+        else:
+            self.send_error(404)
+
+    def log_message(self, *args):
+        pass
+
+
+def test_cached_across_restarts():
+    server = BaseHTTPServer.HTTPServer(('127.0.0.1', 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    tmp = tempfile.mkdtemp()
+    base_url = 'http://127.0.0.1:{0}/latest/meta-data/'.format(server.server_port)
+    cache_file = os.path.join(tmp, 'cloudman', 'instance_metadata.json')
+    requested = _Handler.requested
+    try:
+        md = InstanceMetadata(cache_file, base_url=base_url)
+        assert md.get('ami-id') == 'ami-abcd'
+        assert md.get_interface('security-group-ids') == 'sg-1\nsg-2'
+        # Not in a VPC
+        assert md.get_interface('vpc-id') is None
+        md.remember('region', {'name': 'us-east-1'})
+        assert len(requested) == len(METADATA) + 2
+        assert os.path.exists(cache_file)
+        # On restart, only the instance ID is fetched
+        del requested[:]
+        md = InstanceMetadata(cache_file, base_url=base_url)
+        assert md.get('instance-type') == 'm3.large'
+        assert md.get_interface('vpc-id') is None
+        assert md.recall('region') == {'name': 'us-east-1'}
+        assert requested == ['instance-id']
+        # After a reboot (e.g., a stop and start), values that may have changed are fetched again
+        del requested[:]
+        md = InstanceMetadata(cache_file, base_url=base_url)
+        md.boot_id = 'another boot'
+        assert md.get('public-ipv4') == '54.0.0.1'
+        assert md.get('ami-id') == 'ami-abcd'
+        assert sorted(requested) == sorted(['instance-id'] + metadata.BOOT_KEYS)
+        # The metadata of other instances (e.g., one an image was made from) is ignored
+        METADATA['instance-id'] = 'i-5678'
+        del requested[:]
+        md = InstanceMetadata(cache_file, base_url=base_url)
+        assert md.recall('region') is None
+        assert len(requested) == len(METADATA) + 2
+    finally:
+        METADATA['instance-id'] = 'i-1234'
+        server.shutdown()
+        shutil.rmtree(tmp)
@@ -0,0 +1,29 @@
+import commands
+
+from cm.util import instrumentation
+from cm.util import misc
+
+
+def test_request_histogram():
+    instrumentation.reset()
+    instrumentation.record_request('root', 'full_update', 0.02)
+    instrumentation.record_request('root', 'full_update', 3)
+    stats = instrumentation.get_stats()['requests']['root.full_update']
+    assert stats['count'] == 2
+    assert stats['buckets']['0.025'] == 1
+    assert stats['buckets']['5'] == 2
+    text = instrumentation.to_prometheus()
+    assert 'cloudman_request_seconds_count{controller="root",action="full_update"} 2' in text
+
+
+def test_subprocess_call_sites():
+    instrumentation.reset()
+    instrumentation.install()
+    misc.run('true', quiet=True)
+    commands.getoutput('true')
+    processes = instrumentation.get_stats()['subprocesses']
+    assert sorted(p['kind'] for p in processes) == ['getoutput', 'run']
+    for p in processes:
+        assert p['site'].startswith('test_instrumentation.py') or \
+            'test/test_instrumentation.py' in p['site'], p['site']
+        assert p['count'] == 1
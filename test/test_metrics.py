@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+from cm.util import metrics
+from cm.util.metrics import MetricsStore, NodeSampler
+
+
+def test_downsampling():
+    store = MetricsStore(tiers=(('10s', 10, 6), ('1m', 60, 3)))
+    for t in range(0, 120, 5):
+        store.add('i-1', {'cpu': t}, t=1200000 + t)
+    points = store.query('i-1', 'cpu', '10s')
+    # Only the newest 6 buckets are kept, plus the one being filled
+    assert len(points) == 7
+    assert points[-2] == (1200100, 102.5)
+    assert [v for t, v in store.query('i-1', 'cpu', '1m')] == [27.5, 87.5]
+
+
+def test_gaps_and_wrap_around():
+    store = MetricsStore(tiers=(('10s', 10, 4),))
+    store.add('i-1', {'load1': 1}, t=1000)
+    store.add('i-1', {'load1': 2}, t=1010)
+    store.add('i-1', {'load1': 3}, t=1100)
+    store.add('i-1', {'load1': 4}, t=1110)
+    assert store.query('i-1', 'load1') == [(1100, 3), (1110, 4)]
+    assert store.query('i-2', 'load1') == []
+    store.remove('i-1')
+    assert store.nodes() == []
+
+
+def test_sampler():
+    proc = tempfile.mkdtemp()
+
+    def _write(name, content):
+        with open(os.path.join(proc, name), 'w') as f:
+            f.write(content)
+    try:
+        _write('loadavg', '0.50 0.25 0.10 1/100 1234\n')
+        _write('meminfo', 'MemTotal: 1000 kB\nMemFree: 100 kB\nMemAvailable: 250 kB\n')
+        _write('stat', 'cpu  100 0 100 700 100 0 0 0 0 0\ncpu0 1 2 3\n')
+        sampler = NodeSampler(disk_path=proc, proc=proc)
+        values = sampler.read()
+        assert 'cpu' not in values
+        assert values['mem_used'] == 75.0
+        assert metrics.load_string(values) == '0.50 0.25 0.10'
+        _write('stat', 'cpu  150 0 150 750 150 0 0 0 0 0\n')
+        values = sampler.read()
+        assert values['cpu'] == 50.0
+        assert values['iowait'] == 25.0
+        decoded = metrics.decode(metrics.encode(values))
+        assert sorted(decoded) == sorted(values)
+        assert decoded['cpu'] == 50.0
+    finally:
+        shutil.rmtree(proc)
@@ -0,0 +1,55 @@
+import os
+import shutil
+import tempfile
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.apps import nginx
+from cm.services.apps.nginx import NginxService
+from cm.util.bunch import Bunch
+
+
+def test_reload_only_on_valid_changes():
+    conf_dir = tempfile.mkdtemp()
+    conf_file = os.path.join(conf_dir, 'nginx.conf')
+    server_file = os.path.join(conf_dir, 'sites-enabled', 'default.server')
+    commands = []
+    config_ok = [True]
+    running = [True]
+
+    def _run(cmd, *args):
+        commands.append(cmd)
+        if ' -t ' in cmd:
+            return config_ok[0]
+        return running[0]
+    orig_run = nginx.misc.run
+    nginx.misc.run = _run
+    try:
+        app = Bunch(path_resolver=Bunch(nginx_executable='/usr/sbin/nginx',
+                                        nginx_conf_dir=conf_dir, nginx_conf_file=conf_file))
+        service = NginxService(app)
+        files = {conf_file: 'http {}\n', server_file: 'server {}\n'}
+        assert service._apply_config(files, [])
+        assert [c.split()[1] for c in commands] == ['-t', '-c']
+        # Nothing changed so nothing is written or reloaded
+        del commands[:]
+        assert not service._apply_config(dict(files), [])
+        assert commands == []
+        # A change that fails the test is reverted
+        config_ok[0] = False
+        assert not service._apply_config({conf_file: 'http { bad }\n'}, [server_file])
+        assert len(commands) == 1
+        with open(conf_file) as f:
+            assert f.read() == 'http {}\n'
+        assert os.path.exists(server_file)
+        # A valid change is kept even if Nginx is not running to be reloaded
+        config_ok[0] = True
+        running[0] = False
+        del commands[:]
+        assert not service._apply_config({conf_file: 'http { new }\n'}, [server_file])
+        assert [c.split()[1] for c in commands] == ['-t', '-c']
+        with open(conf_file) as f:
+            assert f.read() == 'http { new }\n'
+        assert not os.path.exists(server_file)
+    finally:
+        nginx.misc.run = orig_run
+        shutil.rmtree(conf_dir)
@@ -0,0 +1,57 @@
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.data import filesystem
+from cm.services.data.filesystem import Filesystem
+from cm.util.bunch import Bunch
+
+
+class TestVolume(object):
+
+    def __init__(self, volume_id, events, fail=False):
+        self.volume_id = volume_id
+        self.events = events
+        self.fail = fail
+
+    def start_snapshot(self, snap_description=None):
+        self.events.append('start {0}'.format(self.volume_id))
+        if self.fail:
+            raise Exception("Snapshot limit exceeded")
+        snap_id = 'snap-{0}'.format(self.volume_id)
+        return Bunch(id=snap_id, delete=lambda: self.events.append('delete ' + snap_id))
+
+    def wait_for_snapshot(self, snapshot):
+        self.events.append('wait {0}'.format(snapshot.id))
+        return snapshot.id
+
+
+def test_frozen_only_while_snapshots_are_initiated():
+    events = []
+    orig_run, orig_which = filesystem.run, filesystem.misc.which
+    filesystem.run = lambda cmd, *args, **kwargs: events.append(cmd) or True
+    filesystem.misc.which = lambda program, *args: '/sbin/' + program
+    try:
+        fs = Filesystem(Bunch(cloud_type='ec2'), 'galaxy', mount_point='/mnt/galaxy')
+        fs.volumes = [TestVolume('vol-1', events), TestVolume('vol-2', events)]
+        assert fs.supports_online_snapshot()
+        snap_ids = fs.create_online_snapshot(quiesce=lambda: events.append('checkpoint'),
+                                             wait=True)
+    finally:
+        filesystem.run, filesystem.misc.which = orig_run, orig_which
+    assert snap_ids == ['snap-vol-1', 'snap-vol-2']
+    assert events[:6] == ['checkpoint', 'sync', '/sbin/fsfreeze -f /mnt/galaxy',
+                          'start vol-1', 'start vol-2', '/sbin/fsfreeze -u /mnt/galaxy']
+    assert sorted(events[6:]) == ['wait snap-vol-1', 'wait snap-vol-2']
+
+
+def test_no_partial_snapshot_sets():
+    events = []
+    orig_run, orig_which = filesystem.run, filesystem.misc.which
+    filesystem.run = lambda cmd, *args, **kwargs: events.append(cmd) or True
+    filesystem.misc.which = lambda program, *args: '/sbin/' + program
+    try:
+        fs = Filesystem(Bunch(cloud_type='ec2'), 'galaxy', mount_point='/mnt/galaxy')
+        fs.volumes = [TestVolume('vol-1', events), TestVolume('vol-2', events, fail=True)]
+        assert fs.create_online_snapshot(wait=True) is None
+    finally:
+        filesystem.run, filesystem.misc.which = orig_run, orig_which
+    assert events == ['sync', '/sbin/fsfreeze -f /mnt/galaxy', 'start vol-1',
+                          'start vol-2', '/sbin/fsfreeze -u /mnt/galaxy', 'delete snap-vol-1']
@@ -0,0 +1,32 @@
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.apps.pgbouncer import PgBouncerService
+from cm.util.bunch import Bunch
+
+
+class TestConsole(object):
+
+    def __init__(self, pools):
+        self.pools = pools
+        self.queries = []
+
+    def query_dicts(self, sql):
+        self.queries.append(sql)
+        return self.pools
+
+
+def test_pool_saturation():
+    app = Bunch(config={'db_pool_size': 10}, manager=None)
+    service = PgBouncerService(app)
+    service.console = TestConsole([
+        {'database': 'galaxy', 'user': 'galaxy', 'cl_active': '42', 'cl_waiting': '3',
+         'sv_active': '8', 'sv_idle': '2', 'maxwait': '1'},
+        {'database': 'pgbouncer', 'user': 'pgbouncer', 'cl_active': '1', 'cl_waiting': '0',
+         'sv_active': '0', 'sv_idle': '0', 'maxwait': '0'}])
+    stats = service.get_stats()
+    assert service.console.queries == ['SHOW POOLS']
+    assert stats['clients_active'] == 42
+    assert stats['clients_waiting'] == 3
+    assert stats['servers_active'] == 8
+    assert stats['saturation'] == 0.8
+    assert stats['saturated']
+    assert stats['max_wait'] == 1
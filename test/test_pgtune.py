@@ -0,0 +1,44 @@
+import os
+import shutil
+import tempfile
+
+from cm.util import pgtune
+
+GB = 1024 * 1024  # In kB
+
+
+def test_settings_scale_with_instance():
+    small = dict(pgtune.tune(4 * GB, 2, 5, (9, 3)))
+    large = dict(pgtune.tune(244 * GB, 32, 20, (10,)))
+    assert small['shared_buffers'] == '512MB'
+    assert small['max_connections'] == 105
+    assert small['checkpoint_segments'] == 32
+    assert 'max_wal_size' not in small
+    assert 'max_parallel_workers' not in small
+    assert large['shared_buffers'] == '8192MB'
+    assert large['max_connections'] == 330
+    assert large['maintenance_work_mem'] == '1024MB'
+    assert large['max_parallel_workers_per_gather'] == 4
+    assert large['max_parallel_workers'] == 32
+    assert 'shared_buffers' not in dict(pgtune.tune(4 * GB, 2, 5, pgtune.parse_version('9.1')))
+
+
+def test_apply_is_idempotent():
+    data_dir = tempfile.mkdtemp()
+    conf_file = os.path.join(data_dir, 'postgresql.conf')
+    try:
+        with open(conf_file, 'w') as f:
+            f.write('port = 5930')
+        settings = pgtune.tune(4 * GB, 2, 5)
+        assert pgtune.apply(data_dir, settings, 'm3.medium')
+        assert not pgtune.apply(data_dir, settings, 'm3.medium')
+        with open(conf_file) as f:
+            assert f.read() == "port = 5930\ninclude 'cloudman_tuning.conf'\n"
+        # A different instance type changes only the include file
+        assert pgtune.apply(data_dir, pgtune.tune(16 * GB, 4, 5), 'm3.xlarge')
+        with open(os.path.join(data_dir, pgtune.INCLUDE_FILE_NAME)) as f:
+            assert "shared_buffers = '2048MB'" in f.read()
+        with open(conf_file) as f:
+            assert f.read().count('include') == 1
+    finally:
+        shutil.rmtree(data_dir)
@@ -0,0 +1,72 @@
+import hashlib
+import socket
+import struct
+import threading
+
+from cm.util import pgwire
+
+
+def _msg(msg_type, body):
+    return msg_type + struct.pack('!i', len(body) + 4) + body
+
+
+def _recv(conn, size):
+    data = ''
+    while len(data) < size:
+        data += conn.recv(size - len(data))
+    return data
+
+
+def _serve(listener, received):
+    conn, addr = listener.accept()
+    length = struct.unpack('!i', _recv(conn, 4))[0]
+    received.append(_recv(conn, length - 4))
+    conn.sendall(_msg('R', struct.pack('!i', 5) + 'salt'))
+    msg_type, length = struct.unpack('!ci', _recv(conn, 5))
+    received.append(_recv(conn, length - 4))
+    conn.sendall(_msg('R', struct.pack('!i', 0)) +
+                 _msg('S', 'server_version\x009.5.3\x00') + _msg('Z', 'I'))
+    while True:
+        msg_type, length = struct.unpack('!ci', _recv(conn, 5))
+        body = _recv(conn, length - 4)
+        if msg_type == 'X':
+            break
+        received.append(body)
+        if body.startswith('SELECT'):
+            conn.sendall(_msg('T', struct.pack('!h', 2) + ('x\x00' + '\x00' * 18) * 2) +
+                         _msg('D', struct.pack('!hi', 2, 6) + 'galaxy' + struct.pack('!i', -1)) +
+                         _msg('C', 'SELECT 1\x00') + _msg('Z', 'I'))
+        else:
+            conn.sendall(_msg('E', 'SERROR\x00C42601\x00Msyntax error\x00\x00') + _msg('Z', 'I'))
+    conn.close()
+
+
+def test_query_with_md5_authentication():
+    listener = socket.socket()
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    received = []
+    server = threading.Thread(target=_serve, args=(listener, received))
+    server.start()
+    try:
+        conn = pgwire.Connection(listener.getsockname()[1], password='secret', host='127.0.0.1')
+        assert conn.query('SELECT datname, NULL') == [('galaxy', None)]
+        assert conn.parameters['server_version'] == '9.5.3'
+        assert conn.columns == ['x', 'x']
+        try:
+            conn.query('BAD')
+            assert False, "Expected a PGError"
+        except pgwire.PGError, e:
+            assert e.code == '42601'
+            assert not e.is_auth_error()
+        # The connection is still usable after an error
+        assert conn.query('SELECT 1') == [('galaxy', None)]
+        conn.close()
+        assert not conn.is_open()
+    finally:
+        server.join(5)
+        listener.close()
+    assert 'user\x00postgres\x00database\x00postgres\x00' in received[0]
+    inner = hashlib.md5('secret' + 'postgres').hexdigest()
+    assert received[1] == 'md5' + hashlib.md5(inner + 'salt').hexdigest() + '\x00'
+    assert received[2:] == ['SELECT datname, NULL\x00', 'BAD\x00', 'SELECT 1\x00']
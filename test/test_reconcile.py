@@ -0,0 +1,53 @@
+import grp
+import os
+import pwd
+import shutil
+import tempfile
+
+from cm.util import reconcile
+from cm.util.reconcile import Fingerprints
+
+
+def test_setup_skipped_until_drift():
+    tmp = tempfile.mkdtemp()
+    try:
+        store = Fingerprints(os.path.join(tmp, 'state', 'fingerprints.json'))
+        tree = os.path.join(tmp, 'data')
+        os.makedirs(os.path.join(tree, 'base'))
+        user = pwd.getpwuid(os.getuid())[0]
+        group = grp.getgrgid(os.getgid())[0]
+        runs = []
+
+        def _chown():
+            runs.append(tree)
+        assert reconcile.ensure_owner(tree, user, group, _chown, store)
+        assert reconcile.ensure_owner(tree, user, group, _chown, store)
+        assert len(runs) == 1
+        # Fingerprints are kept across restarts
+        store = Fingerprints(store.store_file)
+        assert reconcile.ensure_owner(tree, user, group, _chown, store)
+        assert len(runs) == 1
+        # A replaced tree is set up again
+        shutil.move(tree, tree + '.old')
+        shutil.copytree(tree + '.old', tree)
+        assert reconcile.ensure_owner(tree, user, group, _chown, store)
+        assert len(runs) == 2
+        # A failed setup is retried
+        config = os.path.join(tmp, 'run.sh')
+        with open(config, 'w') as f:
+            f.write('run\n')
+        assert not reconcile.reconcile('patch', lambda: reconcile.file_fingerprint(config),
+                                       lambda: False, store)
+        assert reconcile.reconcile('patch', lambda: reconcile.file_fingerprint(config),
+                                   lambda: runs.append(config), store)
+        assert reconcile.reconcile('patch', lambda: reconcile.file_fingerprint(config),
+                                   lambda: runs.append(config), store)
+        assert runs.count(config) == 1
+        # As is a changed file
+        with open(config, 'a') as f:
+            f.write('sleep 4\n')
+        assert reconcile.reconcile('patch', lambda: reconcile.file_fingerprint(config),
+                                   lambda: runs.append(config), store)
+        assert runs.count(config) == 2
+    finally:
+        shutil.rmtree(tmp)
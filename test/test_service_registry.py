@@ -0,0 +1,123 @@
+import os
+import shutil
+import sys
+import tarfile
+import tempfile
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.services import Service, ServiceRole, ServiceType
+from cm.services.registry import ServiceRegistry
+from cm.util import paths
+from cm.util.bunch import Bunch
+
+
+class TestService(Service):
+
+    def __init__(self, app, name, svc_roles, svc_type):
+        super(TestService, self).__init__(app)
+        self.name = name
+        self.svc_roles = svc_roles
+        self.svc_type = svc_type
+
+
+def _registry():
+    app = Bunch()
+    app.manager = Bunch(service_registry=ServiceRegistry(app))
+    registry = app.manager.service_registry
+    sge = TestService(app, 'SGE', [ServiceRole.SGE, ServiceRole.JOB_MANAGER],
+                      ServiceType.APPLICATION)
+    fs = TestService(app, 'galaxyData', [ServiceRole.GALAXY_DATA], ServiceType.FILE_SYSTEM)
+    registry.register(sge)
+    registry.register(fs)
+    return registry, sge, fs
+
+
+def test_active_follows_activation():
+    registry, sge, fs = _registry()
+    assert list(registry.active(service_role=ServiceRole.JOB_MANAGER)) == []
+    sge.activated = True
+    assert list(registry.active(service_role=ServiceRole.JOB_MANAGER)) == [sge]
+    assert registry.is_active('SGE')
+    assert registry.all_active(names=True) == ['SGE']
+    sge.activated = False
+    assert list(registry.active()) == []
+
+
+def test_lookup_by_role_and_type():
+    registry, sge, fs = _registry()
+    assert registry.get_by_role(ServiceRole.SGE) == [sge]
+    assert registry.get_by_type(ServiceType.FILE_SYSTEM) == [fs]
+    registry.remove('galaxyData')
+    assert registry.get_by_type(ServiceType.FILE_SYSTEM) == []
+
+
+def test_role_strings():
+    roles = ServiceRole.from_string("SLURMCTLD, JOB_MANAGER, galaxyData")
+    assert roles == [ServiceRole.SLURMCTLD, ServiceRole.JOB_MANAGER, ServiceRole.GALAXY_DATA]
+    assert ServiceRole.to_string(roles) == "Slurmctld,Job manager,galaxyData"
+    assert ServiceRole.from_string("Slurmctld") == []
+
+
+DUMMY_SERVICE = '''
+from cm.services import Service, ServiceRole, ServiceType
+
+
+class DummyService(Service):
+
+    def __init__(self, app):
+        super(DummyService, self).__init__(app)
+        self.name = "Dummy"
+        self.svc_roles = [ServiceRole.JOB_MANAGER]
+        self.svc_type = ServiceType.APPLICATION
+'''
+
+
+def _fresh_registry(package, manifest_file):
+    registry = ServiceRegistry(Bunch())
+    registry.directories = [package]
+    registry.manifest_file = manifest_file
+    registry.load_services()
+    return registry
+
+
+def test_manifest_and_lazy_loading():
+    # Service modules are imported by their path relative to the working directory
+    tmp = tempfile.mkdtemp(prefix='tmp_services', dir='.')
+    package = os.path.basename(tmp)
+    # The manifest is kept outside of CloudMan's home
+    state_dir = tempfile.mkdtemp()
+    manifest_file = os.path.join(state_dir, 'cloudman', 'service_manifest.json')
+    try:
+        assert ServiceRegistry(Bunch()).manifest_file == paths.SERVICE_MANIFEST_FILE
+        for name, source in [('__init__.py', ''), ('dummy.py', DUMMY_SERVICE),
+                             ('helper.py', 'class Helper(object):\n    pass\n')]:
+            with open(os.path.join(tmp, name), 'w') as f:
+                f.write(source)
+            os.utime(os.path.join(tmp, name), (1000, 1000))
+        registry = _fresh_registry(package, manifest_file)
+        assert registry.services.keys() == ['Dummy']
+        assert os.path.exists(manifest_file)
+        # On boot, CloudMan's home is replaced with a fresh copy extracted
+        # from the CloudMan archive
+        archive = os.path.join(state_dir, 'cm.tar.gz')
+        tar = tarfile.open(archive, 'w:gz')
+        tar.add(package)
+        tar.close()
+        shutil.rmtree(tmp)
+        tarfile.open(archive, 'r:gz').extractall('.')
+        del sys.modules[package + '.dummy']
+        # With an up to date manifest, the service is only loaded once used
+        registry = _fresh_registry(package, manifest_file)
+        assert registry.services == {}
+        assert registry.names() == ['Dummy']
+        assert package + '.dummy' not in sys.modules
+        assert registry.get_active('Dummy') is None
+        assert [s.name for s in registry.get_by_role(ServiceRole.JOB_MANAGER)] == ['Dummy']
+        assert package + '.dummy' in sys.modules
+        assert registry.services.keys() == ['Dummy']
+    finally:
+        shutil.rmtree(tmp)
+        shutil.rmtree(state_dir)
+        for module in list(sys.modules):
+            if module.startswith(package):
+                del sys.modules[module]
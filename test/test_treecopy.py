@@ -0,0 +1,54 @@
+import os
+import shutil
+import tempfile
+
+from cm.util.treecopy import TreeCopy
+
+
+def _write(path, content):
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def test_copy_resume_and_verify():
+    tmp = tempfile.mkdtemp()
+    try:
+        source = os.path.join(tmp, 'tools')
+        target = os.path.join(tmp, 'copy', 'tools')
+        _write(os.path.join(source, 'README'), 'tools')
+        for tool in ['bwa', 'samtools', 'tophat']:
+            for version in ['1.0', '2.0']:
+                _write(os.path.join(source, tool, version, 'bin', tool), '#!/bin/sh\n')
+                _write(os.path.join(source, tool, version, 'env.sh'), 'PATH=/mnt/galaxyTools\n')
+            os.symlink(os.path.join(source, tool, '2.0'), os.path.join(source, tool, 'default'))
+        os.chmod(os.path.join(source, 'bwa', '1.0', 'bin', 'bwa'), 0750)
+        os.utime(os.path.join(source, 'README'), (1000, 1000))
+        # Interrupt the copy of one part
+        copier = TreeCopy(source, target, num_workers=3)
+        copy_entry = copier._copy_entry
+
+        def _failing_copy(src_path, dst_path):
+            if src_path.endswith(os.path.join('samtools', '1.0', 'bin', 'samtools')):
+                raise IOError("Disk went away")
+            copy_entry(src_path, dst_path)
+        copier._copy_entry = _failing_copy
+        assert not copier.run()
+        assert copier.in_progress()
+        assert copier.get_progress().units_done == copier.get_progress().units_total - 1
+        # Resume: only the failed part is copied
+        copier = TreeCopy(source, target, num_workers=3)
+        assert copier.run()
+        assert not copier.in_progress()
+        assert copier.get_progress().units_done == copier.get_progress().units_total
+        assert copier.files_copied + copier.files_skipped <= 2
+        assert copier.verify() == []
+        assert os.readlink(os.path.join(target, 'bwa', 'default')) == os.path.join(source, 'bwa', '2.0')
+        assert os.stat(os.path.join(target, 'bwa', '1.0', 'bin', 'bwa')).st_mode & 0777 == 0750
+        assert os.stat(os.path.join(target, 'README')).st_mtime == 1000
+        # A changed file is picked up by the verification
+        _write(os.path.join(target, 'tophat', '1.0', 'env.sh'), 'changed')
+        assert copier.verify() == ['tophat/1.0/env.sh']
+    finally:
+        shutil.rmtree(tmp)
@@ -0,0 +1,93 @@
+from boto.exception import EC2ResponseError
+
+import cm.util  # Must be imported ahead of cm.services
+from cm.services.data.volume_monitor import VolumeStatusMonitor
+from cm.util.bunch import Bunch
+
+
+class TestCloudInterface(object):
+
+    def __init__(self):
+        self.calls = []
+        self.statuses = {}
+        self.deleted = set()  # Volumes deleted outside of CloudMan
+        self.name_missing = True  # If the errors name the missing volume
+
+    def get_all_volumes(self, volume_ids=None, filters=None):
+        self.calls.append(volume_ids)
+        missing = [vol_id for vol_id in volume_ids if vol_id in self.deleted]
+        if missing:
+            message = self.name_missing and "The volume '{0}' does not exist.".format(missing[0])
+            raise EC2ResponseError(400, 'Bad Request',
+                                   '<Response><Errors><Error><Code>InvalidVolume.NotFound</Code>'
+                                   '<Message>{0}</Message></Error></Errors></Response>'
+                                   .format(message or ''))
+        return [Bunch(id=vol_id, status=self.statuses.get(vol_id, 'available'))
+                for vol_id in volume_ids]
+
+
+class TestVolume(object):
+
+    def __init__(self, volume_id):
+        self.volume_id = volume_id
+        self.status = None
+
+    def set_volume_status(self, vol):
+        self.status = vol.status
+
+
+def _monitor():
+    app = Bunch(cloud_interface=TestCloudInterface())
+    return VolumeStatusMonitor(app, interval=0.01), app.cloud_interface
+
+
+def test_single_call_per_refresh():
+    monitor, cloud = _monitor()
+    volumes = [TestVolume('vol-%s' % i) for i in range(5)]
+    for vol in volumes:
+        monitor.track(vol)
+    monitor.refresh()
+    assert cloud.calls == [sorted(v.volume_id for v in volumes)]
+    assert all(vol.status == 'available' for vol in volumes)
+    # A refresh within the interval is a no-op
+    monitor.interval = 60
+    monitor.refresh()
+    assert len(cloud.calls) == 1
+
+
+def test_deleted_volumes_are_dropped():
+    monitor, cloud = _monitor()
+    vol = TestVolume('vol-1')
+    monitor.track(vol)
+    vol.volume_id = None
+    monitor.refresh()
+    assert cloud.calls == []
+
+
+def test_volumes_deleted_elsewhere_are_dropped():
+    for name_missing in [True, False]:
+        monitor, cloud = _monitor()
+        cloud.name_missing = name_missing
+        volumes = [TestVolume('vol-%s' % i) for i in range(3)]
+        for vol in volumes:
+            monitor.track(vol)
+        cloud.deleted.add('vol-1')
+        assert monitor.refresh()
+        assert sorted(monitor.volumes.keys()) == ['vol-0', 'vol-2']
+        assert [v.status for v in volumes] == ['available', None, 'available']
+        del cloud.calls[:]
+        assert monitor.refresh(force=True)
+        assert cloud.calls == [['vol-0', 'vol-2']]
+
+
+def test_wait_for():
+    monitor, cloud = _monitor()
+    vol = TestVolume('vol-1')
+    cloud.statuses['vol-1'] = 'creating'
+
+    def available():
+        if len(cloud.calls) > 2:
+            cloud.statuses['vol-1'] = 'available'
+        return vol.status == 'available'
+    assert monitor.wait_for(vol, available, timeout=5)
+    assert not monitor.wait_for(vol, lambda: False, timeout=0.05)